@@ -0,0 +1,150 @@
+'''
+A class that merges near-identical requests into one shared observation. During lab
+weeks many scans of the same source and type, with overlapping frequency ranges and
+similar durations, are submitted. Instead of scheduling each one, a new request joins
+a scheduled scan it is compatible with, its host, and the host's block is lengthened
+if needed. The observation covers the union of the requesters' frequency ranges, at the
+finest of their frequency steps, for the longest of their durations, and each requester
+gets its own slice of the data. Requesters are kept in the SHAREDSCANS table.
+
+Date: October 2026
+'''
+
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+from srtutility import Duration
+import math
+
+log = SRTLogging.getlogger('Coalescer')
+
+class Coalescer:
+
+	MAX_DURATION_RATIO = 2.0	# longest duration of a shared observation over the shortest
+	MAX_STEPS = 1000000			# most frequency steps in a shared observation, as for a single scan
+
+
+	# Initializes a Coalescer.
+	def __init__(self):
+
+		self.db = SRTDatabase()
+
+
+	# Method that finds a scheduled scan a request can share an observation with, and attaches the request to it.
+	# Hosts must have the same type and position, must not be survey scans (negative priority), must not start within five minutes, and must overlap the request
+	# in frequency. If the request is longer than the host's block, the block is lengthened in place or the host is passed over.
+	#
+	# :param scanparams: the request's SCANPARAMS row
+	# :param horizon: the Horizon of day and night schedules
+	# :param curtime: the current unix time
+	# :return hostid: the id of the scan the request now shares, or None if there is no compatible host
+	def attach(self, scanparams, horizon, curtime):
+
+		if len(self.getmembers(scanparams['id'])) > 0:		# a scan being rescheduled with its own requesters stays a host
+
+			return None
+
+		candidates = self.db.fetchall("SELECT SCANPARAMS.* FROM SCHEDULE JOIN SCANPARAMS ON SCHEDULE.ID = SCANPARAMS.ID \
+			WHERE SCANPARAMS.TYPE = ? AND SCANPARAMS.RAS = ? AND SCANPARAMS.DEC = ? AND SCANPARAMS.PRIORITY >= 0 AND SCHEDULE.STARTUNIX >= ? ORDER BY SCHEDULE.STARTUNIX",
+			(scanparams['type'], scanparams['ras'], scanparams['dec'], curtime + 300))
+
+		for host in candidates:
+
+			if host['id'] == scanparams['id']:
+
+				continue
+
+			requesters = [host] + self.getmembers(host['id']) + [scanparams]
+
+			if max(requester['freqlower'] for requester in requesters[:-1]) > scanparams['frequpper'] \
+				or min(requester['frequpper'] for requester in requesters[:-1]) < scanparams['freqlower']:		# must overlap every requester, so the union has no gaps
+
+				continue
+
+			durations = [Duration.toseconds(requester['duration']) for requester in requesters]
+
+			if max(durations) > Coalescer.MAX_DURATION_RATIO * min(durations):
+
+				continue
+
+			if not horizon.extend(host['id'], max(durations), self.getobservation(host)):
+
+				continue
+
+			self.db.execute("INSERT INTO SHAREDSCANS (ID, HOSTID) VALUES (?,?)", (scanparams['id'], host['id']))
+			self.db.commit()
+
+			log.info('coalesced scan', extra = {'scanid': scanparams['id'], 'hostid': host['id'], 'requesters': len(requesters)})
+
+			return host['id']
+
+		return None
+
+
+	# Method that removes every requester from a host's observation.
+	#
+	# :param hostid: the id of the host scan
+	# :return members: list of the SCANIDS and SCANPARAMS rows of the removed requesters, not including the host
+	def detach(self, hostid):
+
+		members = self.db.fetchall("SELECT SCANIDS.NAME, SCANIDS.STATUS, SCANPARAMS.* FROM SHAREDSCANS JOIN SCANIDS ON SHAREDSCANS.ID = SCANIDS.ID \
+			JOIN SCANPARAMS ON SHAREDSCANS.ID = SCANPARAMS.ID WHERE SHAREDSCANS.HOSTID = ?", (hostid,))
+
+		if len(members) > 0:
+
+			self.db.execute("DELETE FROM SHAREDSCANS WHERE HOSTID = ?", (hostid,))
+			self.db.commit()
+
+		return members
+
+
+	# Method that returns the parameters of the observation a scan hosts.
+	#
+	# :param scanparams: the host's SCANPARAMS row
+	# :return observation: dict of SCANPARAMS values covering every requester, with the requesters' rows under 'requesters'
+	#					   if the scan is shared, or a dict of the scan's own values if it is not
+	def getobservation(self, scanparams):
+
+		observation = {}
+
+		for key in scanparams.keys():
+
+			observation[key.lower()] = scanparams[key]
+
+		members = self.getmembers(scanparams['id'])
+
+		if len(members) == 0:
+
+			return observation
+
+		requesters = [scanparams] + members
+
+		longest = max(requesters, key = lambda requester: Duration.toseconds(requester['duration']))
+
+		observation['duration'] = longest['duration']
+
+		observation['freqlower'] = min(requester['freqlower'] for requester in requesters)
+		observation['frequpper'] = max(requester['frequpper'] for requester in requesters)
+
+		steps = [(requester['frequpper'] - requester['freqlower']) / (requester['stepnum'] - 1) for requester in requesters if requester['stepnum'] > 1]
+		steps = [step for step in steps if step > 0]
+
+		if len(steps) > 0:		# keep the finest step any requester asked for
+
+			observation['stepnum'] = min(Coalescer.MAX_STEPS, math.ceil(round((observation['frequpper'] - observation['freqlower']) / min(steps), 6)) + 1)
+
+		else:
+
+			observation['stepnum'] = max(requester['stepnum'] for requester in requesters)
+
+		observation['requesters'] = [dict((key.lower(), requester[key]) for key in requester.keys()) for requester in requesters]
+
+		return observation
+
+
+	# Helper method that fetches the requesters that joined a host, not including the host.
+	#
+	# :param hostid: the id of the host scan
+	# :return members: list of SCANPARAMS rows
+	def getmembers(self, hostid):
+
+		return self.db.fetchall("SELECT SCANPARAMS.* FROM SHAREDSCANS JOIN SCANPARAMS ON SHAREDSCANS.ID = SCANPARAMS.ID WHERE SHAREDSCANS.HOSTID = ?", (hostid,))
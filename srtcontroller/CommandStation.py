@@ -8,14 +8,24 @@ Date: June 2018
 
 from astropy.coordinates import SkyCoord, EarthLocation, AltAz
 from astropy.time import Time
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+from SlewModel import SlewModel
+from SerialPort import SerialPort
 import time
-import sqlite3
-import serial
 import math
 
+log = SRTLogging.getlogger('CommandStation')
+
 class CommandStation:
 	
-	database_location = '../srtdatabase/srtdata.db'
+	db = SRTDatabase()		# shared, long-lived database connections
+
+	position = None			# current (azimuth, altitude) of the station, read from CONFIG once and then kept up to date by movebyazal
+
+	slew = SlewModel()		# drive rate model, updated with the time each axis move takes
+
+	port = SerialPort()		# serial connection to the stamp controller, kept open and shared by every command
 	
 	# Method that commands the station to move to a particular azimuth and altitude.
 	#
@@ -26,16 +36,19 @@ class CommandStation:
 
 		### get current station position ###
 
-		srtdb = sqlite3.connect(database_location)	# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
+		srtdb = self.db.connection()		# get this thread's connection and a cursor into the database
 		cur = srtdb.cursor()
 
-		configdata = cur.execute("SELECT * FROM CONFIG").fetchone()			# retrieve config data from the database
+		if CommandStation.position == None:		# the station is the only writer of its position, so the db is read only once
+
+			configdata = cur.execute("SELECT AZ, AL FROM CONFIG").fetchone()
 
-		curaz = configdata['az']				# get current azimuth and altitude
-		cural = configdata['al']
+			CommandStation.position = (configdata['az'], configdata['al'])
 
-		print(str(curaz) + ' ' + str(cural))
+		curaz = CommandStation.position[0]		# get current azimuth and altitude
+		cural = CommandStation.position[1]
+
+		log.debug('moving station', extra = {'az': curaz, 'al': cural, 'newaz': newaz, 'newal': newal})
 
 		azset = False
 		alset = False
@@ -62,7 +75,7 @@ class CommandStation:
 
 				azdirection = 0
 
-			azcount = int(math.floor(abs(newaz - curaz) * 11.7))	# determine azimuth count value for the stamp controller
+			azcount = int(math.floor(abs(newaz - curaz) * SlewModel.COUNTS_PER_DEGREE))	# determine azimuth count value for the stamp controller
 
 		if not alset:
 
@@ -74,9 +87,7 @@ class CommandStation:
 
 				aldirection = 2
 
-			alcount = int(math.floor(abs(newal - cural) * 11.7)) 	# calculate altitude count value
-
-		ser = serial.Serial('/dev/ttyAMA0', baudrate = 2400, timeout = 1)		# initialize and open a serial port to the stamp controller
+			alcount = int(math.floor(abs(newal - cural) * SlewModel.COUNTS_PER_DEGREE)) 	# calculate altitude count value
 
 		while not azset or not alset:					# while loop will always set azimuth first if not already set, then altitude if not already set
 
@@ -88,77 +99,71 @@ class CommandStation:
 
 				message = ' move ' + str(aldirection) + ' ' + str(alcount) + '\n'	# move to new altitude
 
-			print(message)
-
-			ser.write(message.encode('ascii'))		# write message to the serial port
-
-			print('movement data sent')
+			log.debug('sending move command', extra = {'command': message.strip()})
 
-			received = False
-			response = ''
+			movestart = time.monotonic()
 
-			while not received:		# loop to receive response one byte at a time
+			response = self.port.command(message)		# send message and wait for the stamp controller's reply
 
-				rbyte = ser.read()	# read from serial port
+			if response == None:		# the serial port failed, keep the position of the last completed move
 
-				if len(rbyte) > 0:	# if a byte was received, decode and append to response
+				log.error('move command failed', extra = {'command': message.strip()})
 
-					response += rbyte.decode('ascii')
-
-				else:	# if no byte was received and a response has been received already, stop reading
-
-					if len(response) > 0:
-
-						received = True
+				successful = False
 
-			ser.close()		# close the serial port
+				break
 
 			# response = response.strip().split()
 
-			print('reply received')
+			log.debug('reply received', extra = {'reply': response.strip()})
 			
 			if response == message:
 				
 				curaz = newaz
 				cural = newal
-				print(str(curaz) + ' ' + str(cural))
 				break
 			
 			if response[0] == 'M':		# response indicates successful completion of movement
 
 				if not azset:
 
+					self.slew.record(azcount, time.monotonic() - movestart)
+
 					curaz = newaz
 					azset = True
 
 				elif not alset:
 
+					self.slew.record(alcount, time.monotonic() - movestart)
+
 					cural = newal
 					alset = True
 
 			else:					# response indicates stamp timeout, set telescope status to timeout and exit
 
+				log.warning('stamp controller timed out during move', extra = {'reply': response.strip()})
+
 				cur.execute("UPDATE STATUS SET CODE = ?", ('timeout',))
 
 				if not azset:
 
 					if azdirection == 1:
 
-						curaz = int(floor(curaz + (int(response[1]) / 11.7)))
+						curaz = int(math.floor(curaz + (int(response[1]) / SlewModel.COUNTS_PER_DEGREE)))
 
 					else:
 
-						curaz = int(floor(curaz - (int(response[1]) / 11.7)))
+						curaz = int(math.floor(curaz - (int(response[1]) / SlewModel.COUNTS_PER_DEGREE)))
 
 				else:
 
 					if aldirection == 3:
 
-						cural = int(floor(cural - (int(response[1]) / 11.7)))
+						cural = int(math.floor(cural - (int(response[1]) / SlewModel.COUNTS_PER_DEGREE)))
 
 					else:
 
-						cural = int(floor(cural - (int(response[1]) / 11.7)))
+						cural = int(math.floor(cural - (int(response[1]) / SlewModel.COUNTS_PER_DEGREE)))
 
 				successful = False
 
@@ -166,10 +171,10 @@ class CommandStation:
 
 		### update current station position ###
 
-		cur.execute("UPDATE CONFIG SET AZ = ?, AL = ?", (curaz, cural))		# update position values in database
-		srtdb.commit()
+		CommandStation.position = (curaz, cural)
 
-		srtdb.close()														# database connection no longer needed
+		cur.execute("UPDATE CONFIG SET AZ = ?, AL = ?", (curaz, cural))		# update position values in database for the web app
+		srtdb.commit()
 
 		return successful
 
@@ -202,49 +207,19 @@ class CommandStation:
 		
 		message = ' freq ' + str(b11) + ' ' + str(b10) + ' ' + str(b9) + ' ' + str(b8) + '\n'
 
-		print(message)
-
-		ser = serial.Serial('/dev/ttyAMA0', baudrate = 2400, timeout = 1)	# initialize and open a serial port to the stamp controller
-
-		# for e in message:
-
-		# 	ser.write(e.encode('ascii'))
-		
-		ser.write(message.encode('ascii'))
-
-		received = False
-		# response = []
-		
-		response = ''
-
-		while not received:		# loop to receive response one byte at a time
+		log.debug('sending freq command', extra = {'command': message.strip()})
 
-			rbyte = ser.read()	# read from serial port
-
-			if len(rbyte) > 0:
-
-				# response.append(int(rbyte))
-				response += rbyte.decode('ascii')
-
-			else:
-
-				if len(response) > 0:
-
-					received = True
-
-		ser.close()
+		response = self.port.command(message)		# send message and wait for the stamp controller's reply
 
 		### calculate power from received values and return ###
 		
 		if response == message:
 			
-			print('power received')
-
 			response = [100, 1, 244]
 			
 		else:
 			
-			print('power failed')
+			log.warning('power reading failed', extra = {'freq': freq, 'reply': response.strip() if response != None else None})
 			
 			return 0
 
@@ -0,0 +1,123 @@
+'''
+A class that caches the telescope's CONFIG row in memory, along with objects derived from it.
+A trigger bumps CONFIG.VERSION whenever a setting changes, so the cache is only reloaded when
+checkversion() sees a new version, or after the web app reports a change over the command channel.
+The station's current azimuth and altitude are not cached here, CommandStation keeps track of them.
+
+Date: October 2026
+'''
+
+from srtutility.SRTDatabase import SRTDatabase
+from astropy.coordinates import EarthLocation
+import threading
+
+class Config:
+
+	_lock = threading.Lock()		# cached state shared by every Config object
+	_state = None					# (version, config dict, EarthLocation)
+
+
+	# Initializes a Config object. Objects are cheap, the cache is shared between them.
+	def __init__(self):
+
+		self.db = SRTDatabase()
+
+
+	# Method that returns the cached config values.
+	#
+	# :return config: dict of CONFIG values keyed by lowercase column name, without 'az' and 'al'
+	def get(self):
+
+		return self.getstate()[1]
+
+
+	# Method that returns the version of the cached config.
+	#
+	# :return version: the CONFIG.VERSION the cache was loaded from
+	def getversion(self):
+
+		return self.getstate()[0]
+
+
+	# Method that returns the site as an astropy EarthLocation, built once per config version.
+	#
+	# :return location: EarthLocation of the telescope
+	def getlocation(self):
+
+		return self.getstate()[2]
+
+
+	# Method that returns the azimuth movement bounds.
+	#
+	# :return azbounds: tuple of lower and upper azimuth bounds in degrees
+	def getazbounds(self):
+
+		config = self.get()
+
+		return (config['azlower'], config['azupper'])
+
+
+	# Method that returns the altitude movement bounds.
+	#
+	# :return albounds: tuple of lower and upper altitude bounds in degrees
+	def getalbounds(self):
+
+		config = self.get()
+
+		return (config['allower'], config['alupper'])
+
+
+	# Method that reloads the cache if the config version in the database has changed. Costs one single-row query.
+	#
+	# :return changed: boolean indicating whether the cache was reloaded
+	def checkversion(self):
+
+		version = self.db.fetchone("SELECT VERSION FROM CONFIG")['version']
+
+		if Config._state == None or Config._state[0] != version:
+
+			self.reload()
+
+			return True
+
+		return False
+
+
+	# Helper method that returns the cached state, loading it on first use.
+	#
+	# :return state: tuple of version, config dict and EarthLocation
+	def getstate(self):
+
+		state = Config._state		# one read of the state tuple, so no lock is needed
+
+		if state == None:
+
+			state = self.reload()
+
+		return state
+
+
+	# Helper method that reads CONFIG and rebuilds the cached state.
+	#
+	# :return state: tuple of version, config dict and EarthLocation
+	def reload(self):
+
+		row = self.db.fetchone("SELECT * FROM CONFIG")
+
+		config = {}
+
+		for key in row.keys():
+
+			if key.lower() != 'az' and key.lower() != 'al':		# the station position changes with every move and is not cached
+
+				config[key.lower()] = row[key]
+
+		location = EarthLocation(lat = config['lat'], lon = config['lon'], height = config['height'])
+
+		state = (config['version'], config, location)
+
+		with Config._lock:
+
+			Config._state = state
+
+		return state
@@ -0,0 +1,132 @@
+'''
+A class that keeps a precomputed table of day and night times for the telescope's site.
+Sunrise, sunset, dusk and dawn are computed with Astral once for every day in the horizon
+and stored in the EPHEMERIS table, so building a schedule is a table lookup. The table is
+regenerated only when the CONFIG latitude or longitude changes.
+
+Date: October 2026
+'''
+
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+from astral import Astral, AstralError
+import datetime
+
+log = SRTLogging.getlogger('Ephemeris')
+
+class Ephemeris:
+
+	HORIZON_DAYS = 366		# number of days computed ahead of today
+
+
+	# Initializes an Ephemeris object.
+	#
+	# :param horizondays: number of days ahead of today to keep in the table
+	def __init__(self, horizondays = HORIZON_DAYS):
+
+		self.horizondays = horizondays
+
+		self.db = SRTDatabase()
+
+		self.astral = Astral()
+
+
+	# Method that makes sure the table is computed for the configured site and covers the horizon.
+	#
+	# :param config: the CONFIG row, used for latitude and longitude
+	# :param today: the first date that must be covered, defaults to today
+	# :return:
+	def update(self, config, today = None):
+
+		if today == None:
+
+			today = datetime.date.today()
+
+		lastday = today + datetime.timedelta(days = self.horizondays)
+
+		with self.db.transaction() as cur:
+
+			stale = cur.execute("SELECT COUNT(*) FROM EPHEMERIS WHERE LAT != ? OR LON != ?", (config['lat'], config['lon'])).fetchone()[0]
+
+			if stale > 0:			# the site moved, so every stored time is wrong
+
+				log.info('site location changed, regenerating ephemeris', extra = {'lat': config['lat'], 'lon': config['lon']})
+
+				cur.execute("DELETE FROM EPHEMERIS")
+
+			cur.execute("DELETE FROM EPHEMERIS WHERE DAY < ?", (today.isoformat(),))		# drop days that have passed
+
+			stored = set(row['day'] for row in cur.execute("SELECT DAY FROM EPHEMERIS").fetchall())
+
+			rows = []
+
+			day = today
+
+			while day <= lastday:		# compute only the days that are missing
+
+				if day.isoformat() not in stored:
+
+					rows.append(self.computeday(day, config['lat'], config['lon']))
+
+				day += datetime.timedelta(days = 1)
+
+			cur.executemany("INSERT INTO EPHEMERIS VALUES (?,?,?,?,?,?,?)", rows)
+
+
+	# Method that looks up the day and night times for a date, computing and storing them if they are missing.
+	#
+	# :param day: a datetime.date
+	# :param config: the CONFIG row, only needed if the date is not in the table
+	# :return times: dict with unix times 'sunrise', 'sunset', 'dusk' and 'dawn', any of which may be None
+	#				 at latitudes where the sun does not rise or set that day. dawn is the morning after dusk.
+	def getday(self, day, config = None):
+
+		row = self.db.fetchone("SELECT * FROM EPHEMERIS WHERE DAY = ?", (day.isoformat(),))
+
+		if row == None:
+
+			if config == None:
+
+				config = self.db.fetchone("SELECT * FROM CONFIG")
+
+			row = self.computeday(day, config['lat'], config['lon'])
+
+			self.db.execute("INSERT INTO EPHEMERIS VALUES (?,?,?,?,?,?,?)", row)
+			self.db.commit()
+
+			return {'sunrise': row[3], 'sunset': row[4], 'dusk': row[5], 'dawn': row[6]}
+
+		return {'sunrise': row['sunrise'], 'sunset': row['sunset'], 'dusk': row['dusk'], 'dawn': row['dawn']}
+
+
+	# Helper method that computes the day and night times for one date with Astral.
+	#
+	# :param day: a datetime.date
+	# :param lat: site latitude in degrees
+	# :param lon: site longitude in degrees
+	# :return row: tuple matching the columns of the EPHEMERIS table
+	def computeday(self, day, lat, lon):
+
+		try:
+
+			daytimes = self.astral.daylight_utc(day, lat, lon)
+			sunrise = daytimes[0].timestamp()
+			sunset = daytimes[1].timestamp()
+
+		except AstralError as e:		# the sun does not rise or does not set
+
+			sunrise = None
+			sunset = None
+
+		try:
+
+			nighttimes = self.astral.night_utc(day, lat, lon)
+			dusk = nighttimes[0].timestamp()
+			dawn = nighttimes[1].timestamp()
+
+		except AstralError as e:		# the sun does not get far enough below the horizon
+
+			dusk = None
+			dawn = None
+
+		return (day.isoformat(), lat, lon, sunrise, sunset, dusk, dawn)
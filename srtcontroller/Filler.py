@@ -0,0 +1,244 @@
+'''
+A class that fills large gaps in the night schedules with short survey scans, so the
+telescope observes instead of sitting parked. Pointings are taken from the SURVEY table,
+by default a strip of the galactic plane at the HI line, the longest unobserved first.
+Survey scans are ordinary scans at a priority below every user scan, so any user scan
+that needs their time bumps them, and bumped survey scans are dropped rather than moved.
+The class also keeps per-period utilization figures, logged when each period ends, that
+show how much otherwise idle time the survey scans reclaimed.
+
+Date: October 2026
+'''
+
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+import threading
+import random
+
+log = SRTLogging.getlogger('Filler')
+
+class Filler:
+
+	PRIORITY = -1			# priority of survey scans, below the normal priority of 0
+	MIN_GAP = 1800			# seconds of free time a gap needs before survey scans are put in it
+	LOOKAHEAD = 86400		# seconds ahead whose night schedules are filled, so later nights stay open to user scans
+	INTERVAL = 600			# seconds between fill passes
+	MAX_FILL = 20			# most survey scans added in one pass
+
+
+	# Initializes a Filler.
+	def __init__(self):
+
+		self.db = SRTDatabase()
+
+		self.nextfill = 0		# unix time of the next fill pass
+
+		self.periods = {}		# (starttime, endtime) of a schedule period to its utilization figures
+
+		self.lock = threading.Lock()		# held while the figures change, since the command server thread reads them
+
+
+	# Method that puts survey scans into the gaps of at least MIN_GAP seconds in the night schedules starting within LOOKAHEAD seconds.
+	# A survey scan is kept at least its overrun allowance away from the blocks on either side. Runs at most once every INTERVAL seconds.
+	#
+	# :param horizon: the Horizon of day and night schedules
+	# :param curtime: the current unix time
+	# :return added: number of survey scans scheduled
+	def fill(self, horizon, curtime):
+
+		if curtime < self.nextfill:
+
+			return 0
+
+		self.nextfill = curtime + Filler.INTERVAL
+
+		pending = self.db.fetchall("SELECT * FROM SURVEY ORDER BY LASTSCHEDULED IS NOT NULL, LASTSCHEDULED")		# never scheduled first, then longest ago
+
+		added = []
+
+		for schedule in horizon.getschedules('night', curtime):
+
+			if schedule.timeline.starttime > curtime + Filler.LOOKAHEAD or len(pending) == 0 or len(added) >= Filler.MAX_FILL:
+
+				break
+
+			placed = True
+
+			while placed and len(pending) > 0 and len(added) < Filler.MAX_FILL:		# fill the earliest large gap until none are left or no pointing fits
+
+				placed = False
+
+				for gapstart, gapend in schedule.timeline.gaps(max(schedule.timeline.starttime, curtime + 300), schedule.timeline.endtime, Filler.MIN_GAP):
+
+					for pointing in pending:
+
+						scanparams = {'id': self.getscanid(), 'type': pointing['type'], 'source': 'survey', 'ras': pointing['ras'], 'dec': pointing['dec'],
+							'duration': pointing['duration'], 'freqlower': pointing['freqlower'], 'frequpper': pointing['frequpper'],
+							'stepnum': pointing['stepnum'], 'priority': Filler.PRIORITY}
+
+						overrun = schedule.getoverrun(scanparams)		# kept free on both sides on top of the blocks' own overruns, so a late scan never runs into a survey scan or out of one
+
+						with self.db.transaction():		# the SCHEDULE, SCANIDS and SCANPARAMS rows are written together, so no schedule row is left without its scan
+
+							block = horizon.schedulebetween(schedule, scanparams['id'], scanparams, gapstart + overrun, gapend - overrun)
+
+							if block != None:
+
+								self.store(scanparams, pointing['name'], curtime)
+
+						if block != None:
+
+							with self.lock:
+
+								self.getperiod(schedule)['scheduled'] += block.endtime - block.starttime
+
+							added.append(scanparams['id'])
+
+							pending.remove(pointing)
+
+							placed = True
+
+							break
+
+					if placed:
+
+						break
+
+		if len(added) > 0:
+
+			log.info('filled gaps with survey scans', extra = {'scans': len(added)})
+
+		return len(added)
+
+
+	# Method that drops a survey scan that was bumped by a user scan. Its schedule row is already gone.
+	#
+	# :param scanid: the id of the survey scan
+	# :param seconds: the length of the survey scan's block
+	# :param schedule: the Schedule the survey scan was in
+	# :return:
+	def evict(self, scanid, seconds, schedule):
+
+		with self.db.transaction() as cur:
+
+			cur.execute("DELETE FROM SCANPARAMS WHERE ID = ?", (scanid,))
+			cur.execute("DELETE FROM SCANIDS WHERE ID = ?", (scanid,))
+
+		if schedule != None:
+
+			with self.lock:
+
+				period = self.getperiod(schedule)
+
+				period['scheduled'] -= seconds
+				period['evicted'] += 1
+
+		log.debug('evicted survey scan', extra = {'scanid': scanid})
+
+
+	# Method that adds a finished scan to its period's utilization figures.
+	#
+	# :param schedule: the Schedule the scan was in
+	# :param seconds: seconds of the scan's block that were used
+	# :param survey: boolean indicating whether the scan was a survey scan
+	# :return:
+	def record(self, schedule, seconds, survey):
+
+		with self.lock:
+
+			period = self.getperiod(schedule)
+
+			if survey:
+
+				period['survey'] += seconds
+
+				period['scheduled'] -= seconds
+
+			else:
+
+				period['user'] += seconds
+
+
+	# Method that logs the utilization of the periods that have ended and forgets them.
+	#
+	# :param curtime: the current unix time
+	# :return:
+	def roll(self, curtime):
+
+		with self.lock:
+
+			ended = [(key, self.periods.pop(key)) for key in [key for key in self.periods if key[1] < curtime]]
+
+		for key, period in ended:
+
+			length = key[1] - key[0]
+
+			log.info('period utilization', extra = {'start': key[0], 'end': key[1], 'userseconds': round(period['user']), 'surveyseconds': round(period['survey']),
+				'evicted': period['evicted'], 'utilization': round((period['user'] + period['survey']) / length, 3), 'reclaimed': round(period['survey'] / length, 3)})
+
+
+	# Method that reports the utilization figures of the periods that have not ended. Safe to call from another thread.
+	#
+	# :return stats: list of dicts, one per period
+	def getstats(self):
+
+		with self.lock:
+
+			periods = [(key, dict(period)) for key, period in self.periods.items()]
+
+		stats = []
+
+		for key, period in sorted(periods):
+
+			period['start'] = key[0]
+			period['end'] = key[1]
+
+			stats.append(period)
+
+		return stats
+
+
+	# Helper method that returns a period's utilization figures, starting them if needed. Called with the lock held.
+	#
+	# :param schedule: a Schedule
+	# :return period: dict of seconds used by user scans, seconds used by survey scans, seconds of survey scans still scheduled and number of evictions
+	def getperiod(self, schedule):
+
+		key = (schedule.timeline.starttime, schedule.timeline.endtime)
+
+		if key not in self.periods:
+
+			self.periods[key] = {'user': 0, 'survey': 0, 'scheduled': 0, 'evicted': 0}
+
+		return self.periods[key]
+
+
+	# Helper method that writes the rows of a scheduled survey scan, named after its pointing.
+	#
+	# :param scanparams: dict of the survey scan's SCANPARAMS values
+	# :param name: name of the pointing
+	# :param curtime: the current unix time
+	# :return:
+	def store(self, scanparams, name, curtime):
+
+		with self.db.transaction() as cur:
+
+			cur.execute("INSERT INTO SCANIDS VALUES (?,?,?)", (scanparams['id'], 'survey ' + name, 'scheduled'))
+			cur.execute("INSERT INTO SCANPARAMS (ID, TYPE, SOURCE, RAS, DEC, DURATION, FREQLOWER, FREQUPPER, STEPNUM, PRIORITY) VALUES (?,?,?,?,?,?,?,?,?,?)",
+				(scanparams['id'], scanparams['type'], scanparams['source'], scanparams['ras'], scanparams['dec'], scanparams['duration'],
+				scanparams['freqlower'], scanparams['frequpper'], scanparams['stepnum'], scanparams['priority']))
+			cur.execute("UPDATE SURVEY SET LASTSCHEDULED = ? WHERE NAME = ?", (curtime, name))
+
+
+	# Helper method that picks an id no scan has, in the same range as the web app's.
+	#
+	# :return scanid: a new scan id
+	def getscanid(self):
+
+		while True:
+
+			scanid = random.randint(1, 1000000000000)
+
+			if self.db.fetchone("SELECT ID FROM SCANIDS WHERE ID = ?", (scanid,)) == None:
+
+				return scanid
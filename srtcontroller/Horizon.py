@@ -0,0 +1,501 @@
+'''
+A class that keeps the telescope's schedules for a rolling horizon of days and nights.
+Schedules are built from the Ephemeris only when a scan is first tried in them, and a
+submission is placed in the earliest day or night of the horizon in which it fits, so a
+scan that does not fit tonight is scheduled for a later night instead of turned away.
+Schedules whose period has ended are dropped as time passes, and the rest, with the
+blocks already placed in them, carry over from one day to the next.
+
+Date: October 2026
+'''
+
+from Schedule import Schedule
+from Timeline import Timeline
+from Visibility import Visibility
+from SlewModel import SlewModel
+from Optimizer import Optimizer
+from srtutility import SRTLogging
+from srtutility import Duration
+import datetime
+import time
+
+log = SRTLogging.getlogger('Horizon')
+
+class Horizon:
+
+	DAYS = 7			# number of days and nights, starting today, in which scans may be scheduled
+	DAY_MARGIN = 7200	# seconds daytime scans are kept clear of sunrise and sunset
+	ERRORS = ['durationerror', 'positionerror', 'moveboundserror']		# scheduling errors, least informative first
+
+
+	# Initializes a Horizon. No schedules are built until they are needed.
+	#
+	# :param ephemeris: the Ephemeris the schedule periods are looked up in
+	# :param config: the Config, used when the ephemeris has to compute a missing day
+	# :param days: number of days and nights in the horizon
+	def __init__(self, ephemeris, config, days = DAYS):
+
+		self.ephemeris = ephemeris
+		self.config = config
+		self.days = days
+
+		self.schedules = {}		# (date, 'day' or 'night') to Schedule, for the periods built so far
+		self.scans = {}			# scan id to the Schedule it is in
+
+		self.holes = {}			# Schedule to the earliest time freed in it since the last compaction
+
+		self.visibility = Visibility()
+		self.slew = SlewModel()
+
+
+	# Method that adds a scan to the earliest schedule of the horizon it fits in. Sun scans are scheduled by day
+	# and all others by night. If an evict function is given, survey scans (negative priority) count as free time for
+	# other scans: where a scan only fits without them, they are bumped and handed to the function, before later
+	# schedules are tried.
+	#
+	# :param scanid: the id of the scan
+	# :param curtime: the current unix time
+	# :param scanparams: the scan's SCANPARAMS row
+	# :param evict: optional function called with each bumped survey scan's Timeline.Block and the Schedule it was in
+	# :return status: 'scheduled', or the most informative error of all the schedules tried
+	def schedulescan(self, scanid, curtime, scanparams, evict = None):
+
+		kind = 'day' if scanparams['source'] == 'sun' else 'night'
+
+		status = 'durationerror'
+
+		for schedule in self.getschedules(kind, curtime):
+
+			result = schedule.schedulescan(scanid, curtime, scanparams)
+
+			if result != 'scheduled' and evict != None and scanparams['priority'] >= 0:
+
+				bumped = schedule.preempt(scanid, curtime, scanparams, 0)		# only survey scans are bumped
+
+				if bumped != None:
+
+					for block in bumped:
+
+						self.scans.pop(block.scanid, None)
+
+						evict(block, schedule)
+
+					result = 'scheduled'
+
+			if result == 'scheduled':
+
+				self.scans[scanid] = schedule
+
+				return result
+
+			status = max(status, result, key = Horizon.ERRORS.index)		# error hierarchy is movebounds > position > duration, whatever order the schedules report them in
+
+		return status
+
+
+	# Method that puts a scan saved before a restart back into the schedule whose period holds its saved times.
+	#
+	# :param scanid: the id of the scan
+	# :param starttime: saved start time of the scan in unix time
+	# :param endtime: saved end time of the scan in unix time
+	# :param curtime: the current unix time
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return restored: boolean indicating whether the scan was restored. if not, it has to be scheduled again
+	def restore(self, scanid, starttime, endtime, curtime, scanparams):
+
+		kind = 'day' if scanparams['source'] == 'sun' else 'night'
+
+		for schedule in self.getschedules(kind, curtime):
+
+			if schedule.timeline.starttime <= starttime and endtime <= schedule.timeline.endtime:
+
+				if schedule.restoreblock(scanid, starttime, endtime, scanparams):
+
+					self.scans[scanid] = schedule
+
+					return True
+
+				return False
+
+			if schedule.timeline.starttime > starttime:		# schedules are in time order, so no later one holds the scan
+
+				return False
+
+		return False
+
+
+	# Method that computes the windows of scans in the first schedule of their kind, where most of them are placed, so that
+	# scheduling them afterwards finds the windows cached. Run outside a transaction, the computation does not hold the write lock.
+	#
+	# :param scans: list of SCANPARAMS rows
+	# :param curtime: the current unix time
+	# :return:
+	def prepare(self, scans, curtime):
+
+		first = {}
+
+		for kind in ('day', 'night'):
+
+			first[kind] = next(self.getschedules(kind, curtime), None)
+
+		for scanparams in scans:
+
+			schedule = first['day' if scanparams['source'] == 'sun' else 'night']
+
+			if schedule != None:
+
+				self.visibility.getwindows(scanparams['ras'], scanparams['dec'], schedule.timeline.starttime, schedule.timeline.endtime)
+
+
+	# Method that re-packs schedules to fit scans that could not be scheduled first-fit, trying each schedule of the
+	# horizon in time order until every scan is placed or the time limit, shared by every schedule, runs out.
+	#
+	# :param curtime: the current unix time
+	# :param scans: list of SCANPARAMS rows of scans that are not in any schedule
+	# :param objective: the Optimizer objective
+	# :param timelimit: seconds the optimizer may search for in total
+	# :return placed: set of the ids of the given scans that are now scheduled
+	def optimize(self, curtime, scans, objective, timelimit = Optimizer.TIME_LIMIT):
+
+		deadline = time.monotonic() + timelimit
+
+		placed = set()
+
+		for kind in ('day', 'night'):
+
+			remaining = [scanparams for scanparams in scans if (scanparams['source'] == 'sun') == (kind == 'day')]
+
+			for schedule in self.getschedules(kind, curtime):
+
+				if len(remaining) == 0 or time.monotonic() >= deadline:
+
+					break
+
+				for scanid in schedule.optimize(curtime, remaining, objective, deadline - time.monotonic()):
+
+					self.scans[scanid] = schedule
+
+					placed.add(scanid)
+
+				remaining = [scanparams for scanparams in remaining if scanparams['id'] not in placed]
+
+		return placed
+
+
+	# Method that schedules a scan that did not fit by bumping scans of lower priority, in the earliest schedule of the
+	# horizon where that makes room. Bumped scans are no longer in the horizon and have to be scheduled again.
+	#
+	# :param scanid: the id of the scan
+	# :param curtime: the current unix time
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return bumped: list of the bumped Timeline.Blocks, or None if the scan could not be scheduled
+	def preempt(self, scanid, curtime, scanparams):
+
+		kind = 'day' if scanparams['source'] == 'sun' else 'night'
+
+		for schedule in self.getschedules(kind, curtime):
+
+			bumped = schedule.preempt(scanid, curtime, scanparams)
+
+			if bumped != None:
+
+				self.scans[scanid] = schedule
+
+				for block in bumped:
+
+					self.scans.pop(block.scanid, None)
+
+				return bumped
+
+		return None
+
+
+	# Method that adds a scan to a given schedule of the horizon only if it fits within a given range.
+	#
+	# :param schedule: a Schedule of the horizon
+	# :param scanid: the id of the scan
+	# :param scanparams: the scan's SCANPARAMS values
+	# :param starttime: earliest start in unix time
+	# :param endtime: latest end in unix time
+	# :return block: the scan's new Timeline.Block, or None if it does not fit in the range
+	def schedulebetween(self, schedule, scanid, scanparams, starttime, endtime):
+
+		block = schedule.schedulebetween(scanid, scanparams, starttime, endtime)
+
+		if block != None:
+
+			self.scans[scanid] = schedule
+
+		return block
+
+
+	# Method that finds the schedule a scan is in.
+	#
+	# :param scanid: the id of the scan
+	# :return schedule: the Schedule, or None if the scan is not scheduled
+	def getschedule(self, scanid):
+
+		return self.scans.get(scanid)
+
+
+	# Method that lengthens a scheduled scan's block in place.
+	#
+	# :param scanid: the id of the scan
+	# :param seconds: the new duration in seconds
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return extended: boolean indicating whether the block is now at least seconds long
+	def extend(self, scanid, seconds, scanparams):
+
+		schedule = self.scans.get(scanid)
+
+		if schedule == None:
+
+			return False
+
+		return schedule.extend(scanid, seconds, scanparams)
+
+
+	# Method that finds the block of a scheduled scan.
+	#
+	# :param scanid: the id of the scan
+	# :return block: the scan's Timeline.Block, or None if the scan is not scheduled
+	def getblock(self, scanid):
+
+		schedule = self.scans.get(scanid)
+
+		if schedule == None:
+
+			return None
+
+		return schedule.timeline.get(scanid)
+
+
+	# Method that removes a scan from whichever schedule it is in. The freed time is remembered for compact().
+	#
+	# :param scanid: the id of the scan
+	# :return:
+	def deschedulescan(self, scanid):
+
+		schedule = self.scans.pop(scanid, None)
+
+		if schedule != None:
+
+			block = schedule.deschedulescan(scanid)
+
+			if block != None:
+
+				self.holes[schedule] = min(self.holes.get(schedule, block.starttime), block.starttime)
+
+
+	# Method that pulls blocks forward into the time freed since the last call, one schedule at a time.
+	#
+	# :param curtime: the current unix time
+	# :return moved: number of blocks that were moved
+	def compact(self, curtime):
+
+		moved = 0
+
+		for schedule, holestart in self.holes.items():
+
+			moved += schedule.compact(curtime, holestart)
+
+		self.holes = {}
+
+		return moved
+
+
+	# Method that reports the free time left in every day and night of the horizon, and optionally the earliest time a scan
+	# could start in each. It works on copies of the timelines and on cached windows, so it can be called from another thread
+	# and changes nothing. Periods whose schedule has not been built yet are reported as empty.
+	#
+	# :param curtime: the current unix time
+	# :param scanparams: optional dict with the type, ras, dec, source and duration of a scan to look for a slot for
+	# :return forecast: list of dicts, one per period in time order, with its date, kind, start, end, free seconds, largest gap
+	#					in seconds and number of scans, plus the earliest feasible start in unix time, or None, if scanparams is given
+	def forecast(self, curtime, scanparams = None):
+
+		schedules = dict(self.schedules)		# a copy, as the main loop may add or drop schedules meanwhile
+
+		today = datetime.date.today()
+
+		forecast = []
+
+		for offset in range(-1, self.days):
+
+			day = today + datetime.timedelta(days = offset)
+
+			for kind in ('day', 'night'):
+
+				schedule = schedules.get((day, kind))
+
+				if schedule != None:
+
+					timeline = schedule.timeline.copy()
+
+				else:
+
+					period = self.getperiod(day, kind)
+
+					if period == None:
+
+						continue
+
+					timeline = Timeline(period[0], period[1])
+
+				if timeline.endtime < curtime:
+
+					continue
+
+				earliest = max(timeline.starttime, curtime + 300)
+
+				gaps = timeline.gaps(earliest, timeline.endtime, 0, Schedule.PADDING)
+
+				entry = {'date': day.isoformat(), 'kind': kind, 'start': timeline.starttime, 'end': timeline.endtime, 'scans': len(timeline),
+					'free': round(sum(gapend - gapstart for gapstart, gapend in gaps)), 'largestgap': round(max([gapend - gapstart for gapstart, gapend in gaps] + [0]))}
+
+				if scanparams != None:
+
+					entry['earliest'] = None
+
+					if (scanparams['source'] == 'sun') == (kind == 'day'):		# sun scans are only scheduled by day, all others by night
+
+						entry['earliest'] = self.getearliest(timeline, earliest, scanparams)
+
+				forecast.append(entry)
+
+		forecast.sort(key = lambda entry: entry['start'])
+
+		return forecast
+
+
+	# Method that returns the ids of every scheduled scan in the horizon.
+	#
+	# :return scanids: list of scan ids
+	def scanids(self):
+
+		return list(self.scans)
+
+
+	# Method that finds the first block of any schedule starting at or after a time.
+	#
+	# :param t: unix time
+	# :return block: the next Timeline.Block, or None if no block starts at or after t
+	def nextblock(self, t):
+
+		nextblock = None
+
+		for schedule in self.schedules.values():
+
+			block = schedule.timeline.nextblock(t)
+
+			if block != None and (nextblock == None or block.starttime < nextblock.starttime):
+
+				nextblock = block
+
+		return nextblock
+
+
+	# Method that drops the schedules whose period has ended. The other schedules and their blocks are kept as they are.
+	#
+	# :param curtime: the current unix time
+	# :return unrun: list of the ids of the scans left in the dropped schedules, which are no longer in the horizon
+	def roll(self, curtime):
+
+		unrun = []
+
+		for key, schedule in list(self.schedules.items()):
+
+			if schedule.timeline.endtime < curtime:
+
+				log.info('schedule period ended', extra = {'day': key[0].isoformat(), 'kind': key[1], 'unrun': len(schedule.timeline)})
+
+				for scanid in schedule.timeline.scanids():
+
+					self.scans.pop(scanid, None)
+
+					unrun.append(scanid)
+
+				self.holes.pop(schedule, None)
+
+				del self.schedules[key]
+
+		return unrun
+
+
+	# Helper method that returns the schedules of one kind that have not ended, in time order, building them as they are reached.
+	#
+	# :param kind: 'day' or 'night'
+	# :param curtime: the current unix time
+	# :return schedules: generator of Schedules
+	def getschedules(self, kind, curtime):
+
+		today = datetime.date.today()
+
+		for offset in range(-1, self.days):		# last night may not be over yet
+
+			day = today + datetime.timedelta(days = offset)
+
+			schedule = self.schedules.get((day, kind))
+
+			if schedule == None:
+
+				period = self.getperiod(day, kind)
+
+				if period == None or period[1] < curtime:		# no such period that day, or it has ended
+
+					continue
+
+				schedule = Schedule(period[0], period[1])
+
+				self.schedules[(day, kind)] = schedule
+
+				log.debug('built schedule', extra = {'day': day.isoformat(), 'kind': kind, 'start': period[0], 'end': period[1]})
+
+			elif schedule.timeline.endtime < curtime:
+
+				continue
+
+			yield schedule
+
+
+	# Helper method that finds the earliest start of a scan in a timeline, as Schedule.schedulescan() would, without changing it.
+	#
+	# :param timeline: a Timeline
+	# :param earliest: earliest start in unix time
+	# :param scanparams: dict with the type, ras, dec and duration of the scan
+	# :return starttime: the earliest feasible start in unix time, or None if the scan does not fit
+	def getearliest(self, timeline, earliest, scanparams):
+
+		seconds = Duration.toseconds(scanparams['duration'])
+
+		windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], timeline.starttime, timeline.endtime)[1]
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], timeline.starttime, timeline.endtime)
+
+		overrun = max(Schedule.MIN_OVERRUN, scanparams.get('stepnum', 0) * Schedule.STEP_SECONDS)		# as Schedule.getoverrun(), though a forecast request may give no step count
+
+		return timeline.findslot(earliest, seconds, windows, scanparams['type'] == 'track', Schedule.PADDING, path, self.slew.getslewtime, overrun)
+
+
+	# Helper method that looks up the period a schedule covers.
+	#
+	# :param day: the date of the day, or the date on which the night starts
+	# :param kind: 'day' or 'night'
+	# :return period: tuple of start and end in unix time, or None if the sun does not rise and set, or the sky
+	#				  does not get dark, that day
+	def getperiod(self, day, kind):
+
+		times = self.ephemeris.getday(day, self.config.get())
+
+		if kind == 'day':
+
+			if times['sunrise'] == None or times['sunset'] == None or times['sunset'] - times['sunrise'] <= 2 * Horizon.DAY_MARGIN:
+
+				return None
+
+			return (times['sunrise'] + Horizon.DAY_MARGIN, times['sunset'] - Horizon.DAY_MARGIN)
+
+		if times['dusk'] == None or times['dawn'] == None:
+
+			return None
+
+		return (times['dusk'], times['dawn'])
@@ -0,0 +1,203 @@
+'''
+A class that packs a schedule period's scans together instead of one at a time.
+Scans placed first-fit in submission order can leave fragments between blocks that
+no later scan fits in. The optimizer searches over the order in which scans are
+placed, each scan still taking its earliest valid slot, and keeps the order that
+schedules the most observing time or the most scans, and among equally full
+schedules the one with the least slewing. The search stops after a fixed time,
+and scans that were already scheduled are never dropped.
+
+Date: October 2026
+'''
+
+from Timeline import Timeline
+import random
+import time
+
+class Optimizer:
+
+	TIME_LIMIT = 2.0			# seconds of search per call
+	MAX_ITERATIONS = 5000		# orders tried per call, whatever the time limit
+
+
+	# Initializes an Optimizer.
+	#
+	# :param objective: 'time' to maximize scheduled seconds, or 'count' to maximize scheduled scans
+	# :param timelimit: seconds the search may run for
+	# :param seed: seed for the search's random moves, so results can be repeated
+	# :param slewtime: optional function from two (azimuth, altitude) positions to the seconds needed to move between them.
+	#				   if given, blocks are padded by the slew between them and orders with less slewing are preferred
+	def __init__(self, objective = 'time', timelimit = TIME_LIMIT, seed = 0, slewtime = None):
+
+		if objective != 'time' and objective != 'count':
+
+			raise ValueError('unknown objective ' + repr(objective))
+
+		self.objective = objective
+		self.timelimit = timelimit
+		self.seed = seed
+		self.slewtime = slewtime
+
+		self.iterations = 0		# orders tried by the last call to pack()
+
+
+	# Internal class describing a scan to be packed
+	#
+	# :param scanid: the id of the scan
+	# :param seconds: duration of the scan in seconds
+	# :param windows: list of (start, end) unix times in which the scan may be placed
+	# :param contained: if True the whole scan must lie inside one window (tracks), if False only its start (drift scans)
+	# :param path: optional function from a unix time to the (azimuth, altitude) of the scan's source
+	# :param overrun: seconds the scan may run past its end time
+	class Job:
+
+		__slots__ = ('scanid', 'seconds', 'windows', 'contained', 'path', 'overrun')
+
+		def __init__(self, scanid, seconds, windows, contained, path = None, overrun = 0):
+
+			self.scanid = scanid
+			self.seconds = seconds
+			self.windows = windows
+			self.contained = contained
+			self.path = path
+			self.overrun = overrun
+
+
+	# Method that packs jobs into a schedule period.
+	#
+	# :param jobs: list of Jobs. required jobs should come first, in the order they are currently scheduled,
+	#			   so the starting order already places all of them
+	# :param starttime: start of the schedule period in unix time
+	# :param endtime: end of the schedule period in unix time
+	# :param earliest: earliest time a job may start in unix time
+	# :param padding: seconds kept free on either side of every block
+	# :param fixed: list of Blocks that stay where they are, e.g. a running scan
+	# :param required: set of scan ids that must stay scheduled
+	# :return timeline: the best Timeline found, holding the fixed blocks and the placed jobs
+	def pack(self, jobs, starttime, endtime, earliest, padding, fixed = (), required = ()):
+
+		deadline = time.monotonic() + self.timelimit
+
+		generator = random.Random(self.seed)
+
+		period = (starttime, endtime, earliest, padding, fixed)
+
+		current = list(jobs)
+		currentscore = self.score(self.decode(current, period), jobs, required)
+
+		best = current
+		bestscore = currentscore
+
+		greedy = sorted(jobs, key = lambda job: (job.scanid not in required, self.getslack(job, earliest, endtime), -job.seconds))		# least flexible first
+
+		greedyscore = self.score(self.decode(greedy, period), jobs, required)
+
+		if greedyscore > currentscore:
+
+			current, currentscore = greedy, greedyscore
+			best, bestscore = greedy, greedyscore
+
+		self.iterations = 2
+
+		placed = 1 if self.objective == 'count' else 2		# where the score keeps the number of placed jobs
+
+		while len(jobs) > 1 and (self.slewtime != None or bestscore[placed] < len(jobs)) and self.iterations < Optimizer.MAX_ITERATIONS and time.monotonic() < deadline:
+
+			neighbour = list(current)		# move one job to a new place in the order, or swap two
+
+			i = generator.randrange(len(neighbour))
+			j = generator.randrange(len(neighbour))
+
+			if generator.random() < 0.5:
+
+				neighbour[i], neighbour[j] = neighbour[j], neighbour[i]
+
+			else:
+
+				neighbour.insert(i, neighbour.pop(j))
+
+			neighbourscore = self.score(self.decode(neighbour, period), jobs, required)
+
+			self.iterations += 1
+
+			if neighbourscore >= currentscore:		# sideways moves let the search cross plateaus
+
+				current, currentscore = neighbour, neighbourscore
+
+				if neighbourscore > bestscore:
+
+					best, bestscore = neighbour, neighbourscore
+
+		return self.decode(best, period)
+
+
+	# Method that places jobs one at a time in the given order, each at its earliest valid slot.
+	# In submission order this is the first-fit schedule Schedule.schedulescan() builds.
+	#
+	# :param order: list of Jobs
+	# :param period: tuple of starttime, endtime, earliest, padding and fixed, as passed to pack()
+	# :return timeline: a Timeline holding the fixed blocks and every job that fit
+	def decode(self, order, period):
+
+		starttime, endtime, earliest, padding, fixed = period
+
+		timeline = Timeline(starttime, endtime)
+
+		for block in fixed:
+
+			timeline.insert(block.scanid, block.starttime, block.endtime, block.startpos, block.endpos, block.overrun)
+
+		for job in order:
+
+			slot = timeline.findslot(earliest, job.seconds, job.windows, job.contained, padding, job.path, self.slewtime, job.overrun)
+
+			if slot != None:
+
+				if job.path != None:
+
+					timeline.insert(job.scanid, slot, slot + job.seconds, job.path(slot), job.path(slot + job.seconds) if job.contained else job.path(slot), job.overrun)
+
+				else:
+
+					timeline.insert(job.scanid, slot, slot + job.seconds, overrun = job.overrun)
+
+		return timeline
+
+
+	# Method that scores a packed timeline. Higher scores are better, and keeping every required job comes first.
+	#
+	# :param timeline: a Timeline returned by decode()
+	# :param jobs: list of the Jobs being packed
+	# :param required: set of scan ids that must stay scheduled
+	# :return score: tuple of required jobs placed, then the objective, then the other measure, then less slewing
+	def score(self, timeline, jobs, required):
+
+		placed = [job for job in jobs if job.scanid in timeline]
+
+		kept = sum(1 for job in placed if job.scanid in required)
+		seconds = sum(job.seconds for job in placed)
+
+		slew = -timeline.gettotalslew(self.slewtime) if self.slewtime != None else 0
+
+		if self.objective == 'count':
+
+			return (kept, len(placed), seconds, slew)
+
+		return (kept, seconds, len(placed), slew)
+
+
+	# Helper method that measures how much freedom a job has in where it is placed.
+	#
+	# :param job: a Job
+	# :param earliest: earliest time a job may start in unix time
+	# :param endtime: end of the schedule period in unix time
+	# :return slack: seconds of window time in the period beyond the job's own duration
+	def getslack(self, job, earliest, endtime):
+
+		usable = 0
+
+		for windowstart, windowend in job.windows:
+
+			usable += max(0, min(windowend, endtime) - max(windowstart, earliest))
+
+		return usable - job.seconds
@@ -14,10 +14,15 @@ from astropy import units as u
 from numpy import linspace
 from datetime import date
 from srtutility.NTPTime import NTPTime
+from srtutility.SRTDatabase import SRTDatabase
+from Config import Config
+from srtutility import SRTLogging
+from srtutility import Duration
 import io
-import re
 import sqlite3
-import _thread
+import threading
+
+log = SRTLogging.getlogger('Scan')
 
 class Scan:
 
@@ -27,7 +32,25 @@ class Scan:
 		
 		self.ntp = NTPTime()
 		
-		self.database_location = '../srtdatabase/srtdata.db'
+		self.db = SRTDatabase()		# shared, long-lived database connections
+
+		self.config = Config()		# cached config values and site location
+
+		self.stopevent = threading.Event()		# set to end the running scan early, checked at every frequency step
+
+		self.stopreason = None					# status recorded for a scan that was stopped early
+
+		self.requesterids = []					# ids of the requesters of the running scan, which runs until all of them cancel it
+
+
+	# Method that asks the running scan to stop at the next frequency step. Data collected so far is kept.
+	#
+	# :param reason: the status to record for the stopped scan
+	def stop(self, reason):
+
+		self.stopreason = reason
+
+		self.stopevent.set()
 
 
 	# Method to take a single data point at a single frequency for a single source.
@@ -66,6 +89,10 @@ class Scan:
 
 		for freq in linspace(flimit[0], flimit[1], stepnum):	# sweep through frequencies in range, taking stepnum steps
 
+			if self.stopevent.is_set():		# if the scan was stopped, abandon the rest of the spectrum
+
+				break
+
 			if spectrumsuccess:
 
 				scan = self.singlescan(azal, freq)		# do single scan at current frequency
@@ -97,10 +124,9 @@ class Scan:
 	# :return trackdata: tuple containing a list of scan data and a string indicating the status of the scan
 	def track(self, scanid, pos, flimit, stepnum, time):
 
-		print('running a track scan')
+		log.info('running a track scan', extra = {'scanid': scanid})
 
-		srtdb = sqlite3.connect(self.database_location)		# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
+		srtdb = self.db.connection()		# get this thread's connection and a cursor into the database
 		cur = srtdb.cursor()
 
 		curtime = self.ntp.getcurrenttime()		# get start time of scan
@@ -109,13 +135,9 @@ class Scan:
 
 		while curtime < time:	# continue scanning until current time is past the end time
 
-			status = cur.execute("SELECT * FROM SCANIDS WHERE ID = ?", (scanid,)).fetchone()		# check current status to see if scan was cancelled
-
-			if status['status'] == 'cancelled':		# if scan was cancelled, return data collected so far
+			if self.iscancelled(cur):		# if every requester cancelled the scan, return data collected so far
 
-				print('scan was cancelled')
-
-				srtdb.close()
+				log.info('scan was cancelled', extra = {'scanid': scanid})
 
 				return (trackdata, 'cancelled')
 
@@ -123,27 +145,27 @@ class Scan:
 
 			if azal == 'positionerror' or azal == 'moveboundserror':	# check for invalid position or movement, return if found
 
-				srtdb.close()
-
 				return (trackdata, azal)
 
 			spectrumdata = self.singlespectrum(azal, flimit, stepnum)	# take a spectrum measurement
 
+			if self.stopevent.is_set():		# if the scan was stopped, drop the partial spectrum and return data collected so far
+
+				log.info('scan was stopped', extra = {'scanid': scanid, 'reason': self.stopreason})
+
+				return (trackdata, self.stopreason)
+
 			trackdata.append(spectrumdata)		# append spectrum data to the scan
 
 			if spectrumdata['spectrumsuccess'] == False:
 
-				print('scan timed out')
-
-				srtdb.close()
+				log.warning('scan timed out', extra = {'scanid': scanid})
 
 				return (trackdata, 'timeout')
 
 			curtime = self.ntp.getcurrenttime()		# update current time
 
-		print('scan complete')
-
-		srtdb.close()
+		log.info('scan complete', extra = {'scanid': scanid})
 
 		return (trackdata, 'complete')
 
@@ -158,10 +180,9 @@ class Scan:
 	# :return driftdata: tuple containing a list of scan data and a string indicating the status of the scan
 	def drift(self, scanid, pos, flimit, stepnum, time):
 
-		print('running a drift scan')
+		log.info('running a drift scan', extra = {'scanid': scanid})
 
-		srtdb = sqlite3.connect(self.database_location)		# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
+		srtdb = self.db.connection()		# get this thread's connection and a cursor into the database
 		cur = srtdb.cursor()
 
 		curtime = self.ntp.getcurrenttime()		# get start time of scan
@@ -172,66 +193,70 @@ class Scan:
 
 		if azal == 'positionerror' or azal == 'moveboundserror':	# check for invalid or movement, return 
 
-			srtdb.close()
-
 			return (driftdata, azal)
 
 		while curtime < time:		# continue scanning until the current time is past the end time
 
-			status = cur.execute("SELECT * FROM SCANID WHERE ID = ?", (scanid,)).fetchone()		# check current status to see if scan was cancelled
-
-			if status['status'] == 'cancelled':			# if scan was cancelled, return data collected so far
-
-				print('scan was cancelled')
+			if self.iscancelled(cur):			# if every requester cancelled the scan, return data collected so far
 
-				srtdb.close()
+				log.info('scan was cancelled', extra = {'scanid': scanid})
 
 				return (driftdata, 'cancelled')
 
 			spectrumdata = self.singlespectrum(azal, flimit, stepnum)		# take a spectrum measurement
 
+			if self.stopevent.is_set():		# if the scan was stopped, drop the partial spectrum and return data collected so far
+
+				log.info('scan was stopped', extra = {'scanid': scanid, 'reason': self.stopreason})
+
+				return (driftdata, self.stopreason)
+
 			driftdata.append(spectrumdata)		# append spectrum data to the scan
 
 			if spectrumdata['spectrumsuccess'] == False:
 
-				print('scan timed out')
-
-				srtdb.close()
+				log.warning('scan timed out', extra = {'scanid': scanid})
 
 				return (driftdata, 'timeout')
 
 			curtime = self.ntp.getcurrenttime()			# update current time
 
-		print('scan complete')
-
-		srtdb.close()
+		log.info('scan complete', extra = {'scanid': scanid})
 
 		return (driftdata, 'complete')
 
 
 	# Method that performs an entire scan and stores the collected data in the database.
+	# If the scan is a shared observation, each requester gets the slice of the data it asked for.
 	#
-	# :param nextscan: a dict object containing the parameters of a scan
+	# :param nextscan: a dict object containing the parameters of a scan, with the requesters' parameters under 'requesters' if it is shared
+	# :return status: the final status of the scan
 	def donextscan(self, nextscan):
 
-		srtdb = sqlite3.connect(self.database_location)	# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
+		srtdb = self.db.connection()		# get this thread's connection and a cursor into the database
 		cur = srtdb.cursor()
 
+		self.stopevent.clear()
+		self.stopreason = None
+
+		d = date.today()			# get today's date
+
 		pos = (nextscan['ras'], nextscan['dec'])	# get position of scan
 
 		flower   = nextscan['freqlower']			# get spectrum parameters
 		fupper	 = nextscan['frequpper']
 		stepnum  = nextscan['stepnum']
 
-		duration = re.split('[hms]', nextscan['duration'])		# get duration values of scan
-
-		seconds = int(duration[0]) * 60 * 60 + int(duration[1]) * 60 + int(duration[2])
+		seconds = Duration.toseconds(nextscan['duration'])		# get duration of scan in seconds
 
 		curtime = self.ntp.getcurrenttime()
 
 		endtime = curtime + seconds		# calculate the ending time of the scan in unix time
 
+		requesters = nextscan.pop('requesters', None)
+
+		self.requesterids = [requester['id'] for requester in requesters] if requesters != None else [nextscan['id']]
+
 		cur.execute("UPDATE STATUS SET ID = ?, CODE = ?", (nextscan['id'], 'ok'))			# update the STATUS table
 		srtdb.commit()
 
@@ -243,12 +268,18 @@ class Scan:
 
 			scandata = self.drift(nextscan['id'], pos, (flower, fupper), stepnum, endtime)		# do a drift scan
 
+		if requesters != None:
+
+			self.storeshared(nextscan, requesters, scandata)
+
+			return scandata[1]
+
 		if len(scandata[0]) != 0:
 
-			print('saving scan data')
+			log.info('saving scan data', extra = {'scanid': nextscan['id'], 'spectra': len(scandata[0])})
 
 			starttime = Time(scandata[0][0]['starttime'], format = 'unix')					# package scan time info into astropy Time objects for format conversion
-			endtime = Time(scandata[0][len(scandata) - 1]['endtime'], format = 'unix')
+			endtime = Time(scandata[0][len(scandata[0]) - 1]['endtime'], format = 'unix')
 
 			nextscan['starttime'] = starttime.iso 	# store start and end times with scan params in iso format
 			nextscan['endtime'] = endtime.iso
@@ -269,13 +300,7 @@ class Scan:
 
 			t.write(b, format='fits')	# write the Table to the byte stream in FITS format
 
-			d = date.today()			# get today's date
-			
-			with open('testfits.fits', 'w') as f:
-				
-				f.write(b.getvalue().decode('ascii'))
-
-			cur.execute("INSERT INTO SCANRESULTS VALUES (?,?)", (nextscan['id'], b.getvalue()))	# store scan name, date, type, and data in the db
+			cur.execute("INSERT INTO SCANRESULTS (ID, DATA, COMPLETED) VALUES (?,?,?)", (nextscan['id'], b.getvalue(), scandata[0][-1]['endtime']))	# store scan name, date, type, and data in the db
 			srtdb.commit()
 
 		cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", (scandata[1], nextscan['id']))
@@ -283,7 +308,90 @@ class Scan:
 		cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (nextscan['id'], scanname, nextscan['type'], d.day, d.month, d.year))
 		srtdb.commit()
 
-		srtdb.close()
+		return scandata[1]
+
+
+	# Helper method that gives each requester of a shared observation its slice of the data: the frequency steps inside
+	# its range, or the nearest step if none are, and the spectra taken within its duration. A requester cancelled while
+	# the observation ran gets nothing, and the others get the observation's own outcome. The controller leaves a running
+	# observation alone, so a host that cancelled is added to the history here.
+	#
+	# :param observation: a dict object containing the parameters of the shared observation
+	# :param requesters: list of dict objects containing the parameters of each requester
+	# :param scandata: tuple containing the list of spectra and the status of the observation
+	# :return:
+	def storeshared(self, observation, requesters, scandata):
+
+		srtdb = self.db.connection()		# get this thread's connection and a cursor into the database
+		cur = srtdb.cursor()
+
+		d = date.today()
+
+		frequencies = linspace(observation['freqlower'], observation['frequpper'], observation['stepnum'])
+
+		for requester in requesters:
+
+			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS = ?", (scandata[1], requester['id'], 'running'))
+
+			if cur.rowcount == 0:		# cancelled or rescheduled while the observation ran
+
+				scan = cur.execute("SELECT * FROM SCANIDS WHERE ID = ?", (requester['id'],)).fetchone()
+
+				if requester['id'] == observation['id'] and scan['status'] == 'cancelled':
+
+					cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (requester['id'], scan['name'], requester['type'], d.day, d.month, d.year))
+
+				continue
+
+			seconds = Duration.toseconds(requester['duration'])
+
+			columns = [i for i in range(len(frequencies)) if requester['freqlower'] - 1e-6 <= frequencies[i] <= requester['frequpper'] + 1e-6]
+
+			if len(columns) == 0:
+
+				middle = (requester['freqlower'] + requester['frequpper']) / 2
+
+				columns = [min(range(len(frequencies)), key = lambda i: abs(frequencies[i] - middle))]
+
+			spectra = [spectrum for spectrum in scandata[0] if spectrum['starttime'] < scandata[0][0]['starttime'] + seconds]
+
+			if len(spectra) != 0:
+
+				meta = dict(requester)
+
+				meta['freqlower'] = float(frequencies[columns[0]])		# the frequencies actually measured, so the slice is its own evenly stepped spectrum
+				meta['frequpper'] = float(frequencies[columns[-1]])
+				meta['stepnum'] = len(columns)
+				meta['starttime'] = Time(spectra[0]['starttime'], format = 'unix').iso
+				meta['endtime'] = Time(spectra[-1]['endtime'], format = 'unix').iso
+				meta['sharedwith'] = observation['id']
+
+				t = Table(rows = [[spectrum['spectrum'][i] for i in columns] for spectrum in spectra], meta = meta)
+
+				b = io.BytesIO()
+
+				t.write(b, format='fits')
+
+				cur.execute("INSERT INTO SCANRESULTS (ID, DATA, COMPLETED) VALUES (?,?,?)", (requester['id'], b.getvalue(), spectra[-1]['endtime']))
+
+			scanname = cur.execute("SELECT * FROM SCANIDS WHERE ID = ?", (requester['id'],)).fetchone()['name']
+			cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (requester['id'], scanname, requester['type'], d.day, d.month, d.year))
+
+		srtdb.commit()
+
+		log.info('saved shared scan data', extra = {'scanid': observation['id'], 'requesters': len(requesters), 'spectra': len(scandata[0])})
+
+
+	# Helper method that checks whether every requester of the running scan has cancelled it.
+	#
+	# :param cur: cursor into the database
+	# :return cancelled: boolean, True if no requester is still waiting for the scan's data
+	def iscancelled(self, cur):
+
+		live = cur.execute("SELECT COUNT(*) FROM SCANIDS WHERE STATUS != ? AND ID IN (" + ','.join('?' * len(self.requesterids)) + ")",
+			['cancelled'] + self.requesterids).fetchone()[0]
+
+		return live == 0
 
 
 	# Helper method to get the azimuth and altitude of a position.
@@ -292,19 +400,11 @@ class Scan:
 	# :return azal: tuple containing azimuth and altitude, or a string containing an error code
 	def getazal(self, pos):
 
-		print('calculating azal')
-
-		srtdb = sqlite3.connect(self.database_location)	# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
-		cur = srtdb.cursor()
-
-		configdata = cur.execute("SELECT * FROM CONFIG").fetchone()		# retrieve config data from the database
+		configdata = self.config.get()		# cached config data
 
 		position = SkyCoord(pos[0], pos[1], frame = 'icrs')				# convert position into astropy SkyCoord object for coord transformation
 
-		location = EarthLocation(lat = configdata['lat'], lon = configdata['lon'], height = configdata['height']) 	# convert location into astropy EarthLocation
-
-		srtdb.close()
+		location = self.config.getlocation()		# cached astropy EarthLocation of the site
 
 		unixtime = self.ntp.getcurrenttime()		# get curent time to establish AltAz reference frame
 
@@ -318,7 +418,7 @@ class Scan:
 
 		except ValueError as e:		# if transformation is impossible, return position error
 
-			print('positionerror')
+			log.info('position is not in the sky', extra = {'ras': pos[0], 'dec': pos[1]})
 
 			return 'positionerror'
 
@@ -326,23 +426,23 @@ class Scan:
 		
 		if azal[1] < 0 or azal[1] > 180:	# if position is not in the sky, return position error
 			
-			print('positionerror')
+			log.info('position is not in the sky', extra = {'ras': pos[0], 'dec': pos[1]})
 			
 			return 'positionerror'
 
 		if azal[0] < configdata['azlower'] or azal[0] > configdata['azupper']:	# if motion would violate movement bounds, return movebounds error
 
-			print('moveboundserror')
+			log.info('position is out of movement bounds', extra = {'az': azal[0], 'al': azal[1]})
 
 			return 'moveboundserror'
 
 		if azal[1] < configdata['allower'] or azal[1] > configdata['alupper']:
 
-			print('moveboundserror')
+			log.info('position is out of movement bounds', extra = {'az': azal[0], 'al': azal[1]})
 
 			return 'moveboundserror'
 
-		print(str(azal[0]) + ', ' + str(azal[1]))
+		log.debug('computed azal', extra = {'az': azal[0], 'al': azal[1]})
 
 		return azal
 
@@ -367,7 +467,6 @@ def main():
 	
 	station = Scan()
 	
-	# _thread.start_new_thread(station.donextscan, (nextscan,))
 	
 	station.donextscan(nextscan)
 
@@ -0,0 +1,172 @@
+'''
+A class that owns the telescope and runs scans on a single supervised worker thread.
+Scans are taken from a bounded job queue, so two scans can never overlap. Each scan
+gets a future that reports its final status, scans that overrun their duration are
+stopped, and exceptions raised while scanning are collected instead of lost.
+
+Date: October 2026
+'''
+
+from Scan import Scan
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+from srtutility import Duration
+from concurrent.futures import Future
+from collections import deque
+from datetime import date
+import threading
+import traceback
+import queue
+
+log = SRTLogging.getlogger('ScanExecutor')
+
+class ScanExecutor:
+
+	TIMEOUT_GRACE = 600		# seconds a scan may run past its duration before it is stopped
+	MAX_ERRORS = 20			# number of recent scan exceptions kept
+
+
+	# Initializes a ScanExecutor and starts its worker thread.
+	#
+	# :param oncomplete: optional function called with the finished job's Future when any scan ends
+	# :param maxqueue: number of scans that may wait behind the running scan
+	def __init__(self, oncomplete = None, maxqueue = 1):
+
+		self.telescope = Scan()			# the only Scan object, and so the only user of the telescope
+
+		self.db = SRTDatabase()
+
+		self.oncomplete = oncomplete
+
+		self.jobs = queue.Queue(maxsize = maxqueue)
+
+		self.currentscanid = None		# id of the scan the worker is running, or None
+
+		self.errors = deque(maxlen = ScanExecutor.MAX_ERRORS)		# (scan id, formatted traceback) of recent failed scans
+
+		self.worker = threading.Thread(target = self.run, name = 'scanexecutor', daemon = True)
+		self.worker.start()
+
+
+	# Method that queues a scan to run on the telescope.
+	#
+	# :param nextscan: a dict object containing the parameters of a scan
+	# :return future: a Future whose result is the scan's final status
+	# :raises queue.Full: if the job queue is full
+	def submit(self, nextscan):
+
+		future = Future()
+
+		future.scanid = nextscan['id']
+
+		if self.oncomplete != None:
+
+			future.add_done_callback(self.oncomplete)
+
+		self.jobs.put_nowait((nextscan, future))
+
+		return future
+
+
+	# Method that checks whether the telescope is running or about to run a scan.
+	#
+	# :return busy: boolean, True if a scan is running or queued
+	def busy(self):
+
+		return self.currentscanid != None or not self.jobs.empty()
+
+
+	# Method that stops the running scan if it has the given id.
+	#
+	# :param scanid: the id of the scan to stop
+	# :param reason: the status to record for the stopped scan
+	# :return stopped: boolean indicating whether the scan was running
+	def stop(self, scanid, reason):
+
+		if self.currentscanid != scanid:
+
+			return False
+
+		self.telescope.stop(reason)
+
+		return True
+
+
+	# Method run by the worker thread. Runs queued scans one at a time, forever.
+	def run(self):
+
+		while True:
+
+			nextscan, future = self.jobs.get()
+
+			if not future.set_running_or_notify_cancel():		# the scan was cancelled while queued
+
+				continue
+
+			self.currentscanid = nextscan['id']
+
+			requesters = nextscan.get('requesters', [nextscan])		# donextscan takes the requesters out of nextscan
+
+			watchdog = threading.Timer(self.gettimeout(nextscan), self.telescope.stop, ('timeout',))		# stop the scan if it overruns
+			watchdog.daemon = True
+			watchdog.start()
+
+			try:
+
+				status = self.telescope.donextscan(nextscan)
+
+			except Exception as e:
+
+				log.exception('scan failed', extra = {'scanid': nextscan['id']})
+
+				self.errors.append((nextscan['id'], traceback.format_exc()))
+
+				self.recordfailure(nextscan, requesters)
+
+				self.currentscanid = None
+
+				future.set_exception(e)
+
+			else:
+
+				self.currentscanid = None
+
+				future.set_result(status)
+
+			finally:
+
+				watchdog.cancel()
+
+
+	# Helper method that computes how long a scan may run before it is stopped.
+	#
+	# :param nextscan: a dict object containing the parameters of a scan
+	# :return timeout: the timeout in seconds
+	def gettimeout(self, nextscan):
+
+		return Duration.toseconds(nextscan['duration']) + ScanExecutor.TIMEOUT_GRACE
+
+
+	# Helper method that marks a scan that raised an exception as failed, so it does not stay 'running'.
+	# Every requester of a shared observation is marked.
+	#
+	# :param nextscan: a dict object containing the parameters of a scan
+	# :param requesters: list of dict objects containing the parameters of each requester, or [nextscan] if the scan is not shared
+	def recordfailure(self, nextscan, requesters):
+
+		try:
+
+			self.db.connection().rollback()		# discard anything the failed scan left uncommitted
+
+			d = date.today()
+
+			with self.db.transaction() as cur:
+
+				for requester in requesters:
+
+					cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS = ?", ('error', requester['id'], 'running'))
+					cur.execute("INSERT INTO SCANHISTORY SELECT ID, NAME, ?, ?, ?, ? FROM SCANIDS WHERE ID = ?", (requester['type'], d.day, d.month, d.year, requester['id']))
+
+		except Exception as e:
+
+			self.errors.append((nextscan['id'], traceback.format_exc()))
@@ -5,19 +5,33 @@ Author: Nathan Rowley
 Date: August 2018
 '''
 
-from astropy.coordinates import SkyCoord, EarthLocation, AltAz
-from astropy.time import Time
-from astropy import units as u
 from srtutility.NTPTime import NTPTime
+from srtutility.SRTDatabase import SRTDatabase
+from Config import Config
+from Timeline import Timeline
+from Visibility import Visibility
+from Optimizer import Optimizer
+from SlewModel import SlewModel
+from srtutility import SRTLogging
+from srtutility import Duration
+import logging
+import time
 import sqlite3
-import re
 import datetime
 import pytz
 from astral import Astral
 
+log = SRTLogging.getlogger('Schedule')
+
 
 class Schedule:
 
+	PADDING = 300		# seconds kept free next to the edges of the schedule period and next to blocks whose position is unknown
+	MIN_SHIFT = 60		# least number of seconds compaction moves a block forward by
+	STEP_SECONDS = 2	# seconds a spectrum step takes, a move and a power reading over the serial line
+	MIN_OVERRUN = 60	# least number of seconds kept free after a block for the scan to finish its last spectrum
+	MAX_QUERY_PARAMS = 900	# most parameters bound in one IN (...) query, below sqlite's default limit of 999
+
 
 	# Initializes a Schedule instance for building scan schedules.
 	#
@@ -25,224 +39,486 @@ class Schedule:
 	# :param endtime: end time of the schedule period in unix time
 	def __init__(self, starttime, endtime):
 
-		startblock = self.Block(None, starttime, starttime)			# create Blocks to mark the start and end of the schedule
-
-		endblock = self.Block(None, endtime, endtime)
-
-		self.schedule = [startblock, endblock]
+		self.timeline = Timeline(starttime, endtime)		# sorted index of the scheduled Blocks
 		
 		self.localtz = pytz.timezone('America/Chicago')		# set local timezone for display time conversions
 		
-		self.database_location = '../srtdatabase/srtdata.db'
-
+		self.db = SRTDatabase()		# shared, long-lived database connections
 
-	# Internal class for storing scan and time info in a Schedule
-	#
-	# :param scanid: the id of the scan in this block, or None if the block is an endmarker
-	# :param starttime: start time of the scan in unix time
-	# :param endtime: end time of the scan in unix time
-	class Block:
+		self.config = Config()		# cached config values and site location
 
-		def __init__(self, scanid, starttime, endtime):
+		self.visibility = Visibility()		# cached windows in which each source can be observed
 
-			self.scanid = scanid
-			self.starttime = starttime
-			self.endtime = endtime
+		self.slew = SlewModel()		# time needed to move between the positions of neighbouring blocks
 
 
-	# Method for adding a scan to the schedule. Inserts the scan at the earliest possible valid time.
+	# Method for adding a scan to the schedule. Inserts the scan at the earliest possible valid time,
+	# found by intersecting the free time of the schedule with the windows in which the source can be observed.
+	#
+	# The SCHEDULE row is committed through SRTDatabase.commit(), so inside a transaction() block it is
+	# written together with the rest of the caller's changes.
 	#
 	# :param scanid: the id of the scan to be added to the schedule
 	# :param curtime: the current unix time
+	# :param scanparams: the scan's SCANPARAMS row, fetched from the db if not given
 	# :return status: the status of the scan indicating success or failure to schedule
-	def schedulescan(self, scanid, curtime):
+	def schedulescan(self, scanid, curtime, scanparams = None):
+
+		cur = self.db.cursor()			# get a cursor on this thread's connection into the database
+
+		if scanparams == None:
+
+			scanparams = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (scanid,)).fetchone()
+
+		seconds = Duration.toseconds(scanparams['duration'])		# calculate duration in seconds
+
+		scantype = scanparams['type']
+
+		log.debug('attempting to schedule a scan', extra = {'scanid': scanid, 'ras': scanparams['ras'], 'dec': scanparams['dec'], 'type': scantype, 'seconds': seconds})
+
+		checkstart = time.monotonic()
+
+		skywindows, boundswindows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		overrun = self.getoverrun(scanparams)
 
-		srtdb = sqlite3.connect(self.database_location)			# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
-		cur = srtdb.cursor()
+		starttime = self.timeline.findslot(curtime + 300, seconds, boundswindows, scantype == 'track', Schedule.PADDING, path, self.slew.getslewtime, overrun)	# a track must stay inside one window, a drift scan only has to start inside one
 
-		scanparams = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (scanid,)).fetchone()
+		if starttime != None:		# create a new Block for the scan and insert it into the schedule
 
-		duration = re.split('[hms]', scanparams['duration'])								# get duration values of scan
+			log.info('scheduled scan', extra = {'scanid': scanid, 'slot': starttime, 'latency': round(time.monotonic() - checkstart, 4)})
 
-		seconds = int(duration[0]) * 60 * 60 + int(duration[1]) * 60 + int(duration[2])		# calculate durationin seconds
+			self.timeline.insert(scanid, starttime, starttime + seconds, *self.getpositions(scanparams, path, starttime, seconds), overrun)
 
-		if curtime > self.schedule[0].endtime:
+			self.storeblock(cur, scanid, starttime, starttime + seconds)		# update the schedule in the db
+			self.db.commit()
 
-			starttime = curtime + 300						# start time is the current time if past the start of night
+			return 'scheduled'
+
+		if self.timeline.findslot(curtime + 300, seconds, None, True, Schedule.PADDING, overrun = overrun) == None:		# error hierarchy is movebounds > position > duration
+
+			status = 'durationerror'
+
+		elif self.timeline.findslot(curtime + 300, seconds, skywindows, scantype == 'track', Schedule.PADDING, path, self.slew.getslewtime, overrun) != None:
+
+			status = 'moveboundserror'
 
 		else:
 
-			starttime = self.schedule[0].endtime + 300		# start time of new Block is after the first Block
+			status = 'positionerror'
 
-		endtime = starttime + seconds
+		log.info('could not schedule scan', extra = {'scanid': scanid, 'status': status, 'latency': round(time.monotonic() - checkstart, 4)})
 
-		scantype = scanparams['type']
+		return status
+		
 
-		print(str(starttime) + ' ' + str(endtime) + ' ' + scanparams['ras'] + ' ' + scanparams['dec'] + ' ' + scantype)
+	# Method that re-packs the scans of the schedule that have not started, together with scans that could not be
+	# scheduled first-fit, so that more observing time or more scans fit. Scans that were already scheduled stay
+	# scheduled, though they may move, and a result that drops one is thrown away. Blocks starting within five minutes of
+	# the current time are left alone.
+	#
+	# :param curtime: the current unix time
+	# :param scans: list of SCANPARAMS rows of scans that are not in the schedule
+	# :param objective: 'time' to maximize scheduled seconds, or 'count' to maximize scheduled scans
+	# :param timelimit: seconds the optimizer may search for
+	# :return placed: list of the ids of the given scans that are now scheduled
+	def optimize(self, curtime, scans, objective = 'time', timelimit = Optimizer.TIME_LIMIT):
 
-		status = 'durationerror'
+		earliest = curtime + 300
 
-		print('attempting to schedule a scan')
+		fixed = []
+		movable = []
 
-		for i in range(len(self.schedule) - 1):					# loops through the spaces between each Block in the schedule
+		for block in self.timeline:		# in start time order, so the first-fit order of the movable scans is kept
 
-			print('checking for space after block ' + str(i))
+			if block.starttime < earliest:
 
-			while starttime >= self.schedule[i].endtime + 300 and endtime <= self.schedule[i+1].starttime - 300:	# loops through five-minute steps of the time between two blocks (padded by five minutes on either side)
+				fixed.append(block)
 
-				print('there is space, checking for validity')
+			else:
 
-				result = self.checkscan(scanparams['ras'], scanparams['dec'], scantype, starttime, endtime)		# check to see if the scan is valid within a particular time window
+				movable.append(block.scanid)
 
-				print(result)
+		rows = self.getparams(movable)
 
-				if status == 'durationerror' or status == 'positionerror':		# error hierarchy is movebounds > position > duration
+		jobs = []
 
-					status = result
+		for scanparams in [rows[scanid] for scanid in movable] + list(scans):
 
-				if result == 'scheduled':		# if the scan is valid, create a new Block for the scan and insert it into the schedule
+			if scanparams['id'] in self.timeline:		# a scheduled block keeps its length, which may cover a shared observation
 
-					print('found a valid spot!')
+				block = self.timeline.get(scanparams['id'])
 
-					status = result
+				seconds = block.endtime - block.starttime
 
-					newblock = Schedule.Block(scanid, starttime, endtime)
-					
-					starttime = datetime.datetime.fromtimestamp(starttime, pytz.utc).astimezone(self.localtz).strftime('%H:%M')	# convert time values to local time strings
-					endtime = datetime.datetime.fromtimestamp(endtime, pytz.utc).astimezone(self.localtz).strftime('%H:%M')
+			else:
 
-					cur.execute("INSERT INTO SCHEDULE VALUES (?,?,?)", (scanid, starttime, endtime))	# update the schedule and scan status in the db
-					srtdb.commit()
+				seconds = Duration.toseconds(scanparams['duration'])
 
-					srtdb.close()
+			windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+			path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
 
-					self.schedule.insert(i+1, newblock)
+			jobs.append(Optimizer.Job(scanparams['id'], seconds, windows, scanparams['type'] == 'track', path, self.getoverrun(scanparams)))
 
-					return status
+		optimizer = Optimizer(objective, timelimit, slewtime = self.slew.getslewtime)
 
-				starttime += 300			# if scan is not valid within the time frame, adjust the frame five minutes forward
-				endtime += 300
+		optimizestart = time.monotonic()
 
-			starttime = self.schedule[i+1].endtime + 300	# update starttime to after the next Block
+		timeline = optimizer.pack(jobs, self.timeline.starttime, self.timeline.endtime, earliest, Schedule.PADDING, fixed, set(movable))
 
-			if starttime < curtime:							# if curtime not yet reached, reset starttime to curtime
+		dropped = [scanid for scanid in movable if scanid not in timeline]
 
-				starttime = curtime + 300
+		if len(dropped) > 0:		# the search could not keep every scheduled scan, e.g. after a change in the slew rate, so the schedule stays as it is
 
-			endtime = starttime + seconds					# update endtime to reflect new starttime
+			log.warning('optimizer dropped scheduled scans, keeping the schedule', extra = {'dropped': dropped, 'latency': round(time.monotonic() - optimizestart, 4)})
 
-		print('couldn\'t find a spot. error code: ' + status)
+			return []
 
-		srtdb.close()
+		changed = []
+
+		for job in jobs:
+
+			block = timeline.get(job.scanid)
+			previous = self.timeline.get(job.scanid)
+
+			if block != None and (previous == None or previous.starttime != block.starttime):
+
+				changed.append(block)
+
+		placed = [scanparams['id'] for scanparams in scans if scanparams['id'] in timeline]
+
+		log.info('optimized schedule', extra = {'scans': len(jobs), 'placed': len(placed), 'moved': len(changed) - len(placed), 'iterations': optimizer.iterations, 'latency': round(time.monotonic() - optimizestart, 4)})
+
+		with self.db.transaction() as cur:		# written together with the caller's changes if called inside a transaction
+
+			cur.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(block.scanid,) for block in changed])
+
+			for block in changed:
+
+				self.storeblock(cur, block.scanid, block.starttime, block.endtime)
+
+		self.timeline = timeline
+
+		return placed
+
+
+	# Method that makes room for a scan that does not fit by bumping scans of lower priority that have not started.
+	# The scan takes its earliest slot among the blocks that cannot be bumped, then each lower priority block that
+	# still fits where it was is put back and the rest are bumped. Bumped scans are taken out of the schedule and
+	# their SCHEDULE rows deleted, for the caller to schedule again in their next feasible window.
+	#
+	# :param scanid: the id of the scan to make room for
+	# :param curtime: the current unix time
+	# :param scanparams: the scan's SCANPARAMS row
+	# :param below: optional priority the bumped scans must be below, the scan's own priority if not given
+	# :return bumped: list of the bumped Blocks, or None if the scan does not fit even with every lower priority scan bumped
+	def preempt(self, scanid, curtime, scanparams, below = None):
+
+		earliest = curtime + 300
+
+		candidates = [block.scanid for block in self.timeline if block.starttime >= earliest]		# blocks starting within five minutes are left alone
+
+		if len(candidates) == 0:
+
+			return None
+
+		below = scanparams['priority'] if below == None else below
+
+		rows = dict((scanid, row) for scanid, row in self.getparams(candidates).items() if row['priority'] < below)
+
+		lower = [self.timeline.get(scanid) for scanid in candidates if scanid in rows]
+
+		if len(lower) == 0:
+
+			return None
+
+		for block in lower:
+
+			self.timeline.remove(block.scanid)
+
+		seconds = Duration.toseconds(scanparams['duration'])
+
+		windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		starttime = self.timeline.findslot(earliest, seconds, windows, scanparams['type'] == 'track', Schedule.PADDING, path, self.slew.getslewtime, self.getoverrun(scanparams))
+
+		if starttime == None:		# bumping does not help, so put everything back as it was
+
+			for block in lower:
+
+				self.timeline.insert(block.scanid, block.starttime, block.endtime, block.startpos, block.endpos, block.overrun)
+
+			return None
+
+		self.timeline.insert(scanid, starttime, starttime + seconds, *self.getpositions(scanparams, path, starttime, seconds), self.getoverrun(scanparams))
+
+		bumped = []
+
+		for block in lower:		# in start time order, so each block is checked against the ones put back before it
+
+			row = rows[block.scanid]
+
+			blockwindows = self.visibility.getwindows(row['ras'], row['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+			blockpath = self.visibility.getpath(row['ras'], row['dec'], self.timeline.starttime, self.timeline.endtime)
+
+			if self.timeline.findslot(block.starttime, block.endtime - block.starttime, blockwindows, row['type'] == 'track', Schedule.PADDING, blockpath, self.slew.getslewtime, block.overrun) == block.starttime:
+
+				self.timeline.insert(block.scanid, block.starttime, block.endtime, block.startpos, block.endpos, block.overrun)
+
+			else:
+
+				bumped.append(block)
+
+		with self.db.transaction() as cur:		# written together with the caller's changes if called inside a transaction
+
+			cur.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(block.scanid,) for block in bumped])
+
+			self.storeblock(cur, scanid, starttime, starttime + seconds)
+
+		log.info('preempted scans', extra = {'scanid': scanid, 'priority': scanparams['priority'], 'slot': starttime, 'bumped': [block.scanid for block in bumped]})
+
+		return bumped
+
+
+	# Method that adds a scan to the schedule only if it fits within a given range, e.g. one gap.
+	#
+	# :param scanid: the id of the scan
+	# :param scanparams: the scan's SCANPARAMS values
+	# :param starttime: earliest start in unix time
+	# :param endtime: latest end in unix time
+	# :return block: the scan's new Block, or None if it does not fit in the range
+	def schedulebetween(self, scanid, scanparams, starttime, endtime):
+
+		seconds = Duration.toseconds(scanparams['duration'])
+
+		windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		slot = self.timeline.findslot(starttime, seconds, windows, scanparams['type'] == 'track', Schedule.PADDING, path, self.slew.getslewtime, self.getoverrun(scanparams))
+
+		if slot == None or slot + seconds > endtime:
+
+			return None
+
+		block = self.timeline.insert(scanid, slot, slot + seconds, *self.getpositions(scanparams, path, slot, seconds), self.getoverrun(scanparams))
+
+		with self.db.transaction() as cur:		# written together with the caller's changes if called inside a transaction
+
+			self.storeblock(cur, scanid, slot, slot + seconds)
+
+		return block
+
+
+	# Method that lengthens a scheduled block in place, keeping its start time.
+	#
+	# :param scanid: the id of the scan
+	# :param seconds: the new duration in seconds
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return extended: boolean indicating whether the block is now at least seconds long
+	def extend(self, scanid, seconds, scanparams):
+
+		block = self.timeline.get(scanid)
+
+		if block == None:
+
+			return False
+
+		if block.endtime - block.starttime >= seconds:
+
+			return True
+
+		windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		self.timeline.remove(scanid)
+
+		if self.timeline.findslot(block.starttime, seconds, windows, scanparams['type'] == 'track', Schedule.PADDING, path, self.slew.getslewtime, self.getoverrun(scanparams)) != block.starttime:
+
+			self.timeline.insert(scanid, block.starttime, block.endtime, block.startpos, block.endpos, block.overrun)
+
+			return False
+
+		self.timeline.insert(scanid, block.starttime, block.starttime + seconds, *self.getpositions(scanparams, path, block.starttime, seconds), self.getoverrun(scanparams))
+
+		with self.db.transaction() as cur:		# written together with the caller's changes if called inside a transaction
+
+			cur.execute("DELETE FROM SCHEDULE WHERE ID = ?", (scanid,))
+
+			self.storeblock(cur, scanid, block.starttime, block.starttime + seconds)
+
+		log.debug('extended block', extra = {'scanid': scanid, 'seconds': seconds})
+
+		return True
+
+
+	# Helper method that fetches the SCANPARAMS rows of many scans, split into queries that stay under sqlite's parameter limit.
+	#
+	# :param scanids: list of scan ids
+	# :return rows: dict of scan id to SCANPARAMS row
+	def getparams(self, scanids):
+
+		rows = {}
+
+		for i in range(0, len(scanids), Schedule.MAX_QUERY_PARAMS):
+
+			chunk = scanids[i:i + Schedule.MAX_QUERY_PARAMS]
+
+			for row in self.db.fetchall("SELECT * FROM SCANPARAMS WHERE ID IN (" + ','.join('?' * len(chunk)) + ")", chunk):
+
+				rows[row['id']] = row
+
+		return rows
+
+
+	# Helper method that returns where the dish points at the start and end of a scan. A track follows its source,
+	# while a drift scan stays pointed at its start position and lets the source drift through the beam.
+	#
+	# :param scanparams: the scan's SCANPARAMS row
+	# :param path: function of unix time returning the source's (azimuth, altitude)
+	# :param starttime: start time of the scan in unix time
+	# :param seconds: duration of the scan in seconds
+	# :return positions: tuple of the start and end (azimuth, altitude)
+	def getpositions(self, scanparams, path, starttime, seconds):
+
+		startpos = path(starttime)
+
+		if scanparams['type'] == 'track':
+
+			return startpos, path(starttime + seconds)
+
+		return startpos, startpos
+
+
+	# Helper method that works out how long a scan may run past its end time. A scan checks the time only between
+	# spectra, so it finishes the spectrum in progress at its end time and may keep the telescope up to one spectrum longer.
+	#
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return overrun: seconds to keep free after the scan's block
+	def getoverrun(self, scanparams):
+
+		return max(Schedule.MIN_OVERRUN, scanparams['stepnum'] * Schedule.STEP_SECONDS)
+
+
+	# Helper method that writes a scheduled scan to the SCHEDULE table, with its times as local time strings for display
+	# and as unix times for restoring the schedule after a restart, along with the config version it was checked against.
+	#
+	# :param cur: cursor into the database
+	# :param scanid: the id of the scan
+	# :param starttime: start time of the scan in unix time
+	# :param endtime: end time of the scan in unix time
+	# :return:
+	def storeblock(self, cur, scanid, starttime, endtime):
+
+		localstart = datetime.datetime.fromtimestamp(starttime, pytz.utc).astimezone(self.localtz).strftime('%H:%M')	# convert time values to local time strings
+		localend = datetime.datetime.fromtimestamp(endtime, pytz.utc).astimezone(self.localtz).strftime('%H:%M')
+
+		cur.execute("INSERT INTO SCHEDULE (ID, STARTTIME, ENDTIME, STARTUNIX, ENDUNIX, VERSION) VALUES (?,?,?,?,?,?)",
+			(scanid, localstart, localend, starttime, endtime, self.config.getversion()))
+
+
+	# Method that puts a scan saved in the SCHEDULE table back into the schedule at its saved times, without checking it again.
+	#
+	# :param scanid: the id of the scan
+	# :param starttime: saved start time of the scan in unix time
+	# :param endtime: saved end time of the scan in unix time
+	# :param scanparams: the scan's SCANPARAMS row
+	# :return restored: boolean indicating whether the scan fit back into the schedule
+	def restoreblock(self, scanid, starttime, endtime, scanparams):
+
+		if starttime < self.timeline.starttime or endtime > self.timeline.endtime:
+
+			return False
+
+		path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
+
+		if path == None:
+
+			return False
+
+		try:
+
+			self.timeline.insert(scanid, starttime, endtime, *self.getpositions(scanparams, path, starttime, endtime - starttime), self.getoverrun(scanparams))
+
+		except ValueError as e:		# overlaps a block restored before it
+
+			return False
+
+		return True
 
-		return status
-		
 
 	# Method that removes a scan from the schedule with an id matching scanid.
 	#
 	# :param scanid: the id of the scan to be removed
-	# :return:
+	# :return block: the removed Block, or None if the scan was not in the schedule
 	def deschedulescan(self, scanid):
 
-		for i in range(len(self.schedule - 2)):
+		block = self.timeline.remove(scanid)
 
-			if self.schedule[i].scanid == scanid:
+		if block != None:
 
-				print('scan removed from schedule')
+			log.debug('scan removed from schedule', extra = {'scanid': scanid})
 
-				del self.schedule[i]
-				break
+		return block
 
 
-	# Helper method for checking the validity of a scan.
-	# Checks that the scan's position is in the sky and that the scan does not go out of movement bounds.
+	# Method that pulls blocks forward into time freed by a cancelled, timed out or early finished scan.
+	# Starting with the first block after the hole, each block is moved to its earliest valid slot if that
+	# is at least MIN_SHIFT seconds earlier, and the pass stops at the first block that cannot move, so
+	# only the blocks behind the hole are checked and only their SCHEDULE rows are rewritten.
 	#
-	# :param ras: right ascension of the scan to be checked
-	# :param dec: declination of the scan to be checked
-	# :param scantype: a string designating the type of scan
-	# :param starttime: start time of the scan in unix time
-	# :param endtime: end time of the scan in unix time
-	# :return: a string indicating the status of the scan
-	def checkscan(self, ras, dec, scantype, starttime, endtime):
+	# :param curtime: the current unix time
+	# :param holestart: unix time at which the freed time starts
+	# :return moved: number of blocks that were moved
+	def compact(self, curtime, holestart):
 
-		srtdb = sqlite3.connect(self.database_location)	# establish a connection and cursor into the database
-		srtdb.row_factory = sqlite3.Row
-		cur = srtdb.cursor()
+		earliest = curtime + 300
 
-		configdata = cur.execute("SELECT * FROM CONFIG").fetchone()		# retrieve config data from the database
+		block = self.timeline.nextblock(max(holestart, earliest))		# blocks starting within five minutes are left alone
 
-		position = SkyCoord(ras, dec, frame = 'icrs')					# convert position into astropy SkyCoord object for coord transformation
+		moved = []
+		reclaimed = 0
 
-		location = EarthLocation(lat = configdata['lat'], lon = configdata['lon'], height = configdata['height']) 	# convert location into astropy EarthLocation
+		while block != None:
 
-		srtdb.close()
+			scanparams = self.db.fetchone("SELECT * FROM SCANPARAMS WHERE ID = ?", (block.scanid,))
 
-		middletime = (starttime + endtime) / 2
+			windows = self.visibility.getwindows(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)[1]
+			path = self.visibility.getpath(scanparams['ras'], scanparams['dec'], self.timeline.starttime, self.timeline.endtime)
 
-		starttime = Time(starttime, format = 'unix')						# convert times into astropy Time objects
-		startframe = AltAz(location = location, obstime = starttime)		# create astropy AltAz frame objects for each time
+			seconds = block.endtime - block.starttime
 
-		if scantype == 'track':
+			self.timeline.remove(block.scanid)
 
-			middletime = Time(middletime, format = 'unix')						# necessary to check a midpoint for altitude bounds due to circumpolar positions possibly dipping too low
-			middleframe = AltAz(location = location, obstime = middletime)
-			endtime = Time(endtime, format = 'unix')
-			endframe = AltAz(location = location, obstime = endtime)
+			slot = self.timeline.findslot(earliest, seconds, windows, scanparams['type'] == 'track', Schedule.PADDING, path, self.slew.getslewtime, self.getoverrun(scanparams))
 
-		try:														# attempt to transform the position to the AltAz frame of each time
-			
-			startpos = position.transform_to(startframe)
+			if slot == None or slot > block.starttime - Schedule.MIN_SHIFT:		# the block cannot move forward, so neither can the ones after it
 
-			if scantype == 'track':
+				self.timeline.insert(block.scanid, block.starttime, block.endtime, block.startpos, block.endpos, block.overrun)
 
-				middlepos = position.transform_to(middleframe)
-				endpos = position.transform_to(endframe)
+				break
 
-		except ValueError as e:										# if the position can't be transformed, return a position error
+			moved.append(self.timeline.insert(block.scanid, slot, slot + seconds, *self.getpositions(scanparams, path, slot, seconds), self.getoverrun(scanparams)))
 
-			return 'positionerror'
+			reclaimed += block.starttime - slot
 
-		azbounds = (configdata['azlower'], configdata['azupper'])		# repackage movement bounds
-		albounds = (configdata['allower'], configdata['alupper'])
-		
-		startaz = float(startpos.az.to_string(unit=u.deg, decimal=True))
-		startal = float(startpos.alt.to_string(unit=u.deg, decimal=True))
-		
-		if scantype == 'track':
-			
-			middleaz = float(middlepos.az.to_string(unit=u.deg, decimal=True))
-			middleal = float(middlepos.alt.to_string(unit=u.deg, decimal=True))
-			endaz = float(endpos.az.to_string(unit=u.deg, decimal=True))
-			endal = float(endpos.alt.to_string(unit=u.deg, decimal=True))
-			
-		if startal < 0 or startal > 180:		# if a position has a negative altitude, object is not in the sky, so return position error
-			
-			return 'positionerror'
-			
-		if scantype == 'track' and (middleal < 0 or middleal > 180 or endal < 0 or endal > 180):
-			
-			return 'positionerror'
+			block = self.timeline.nextblock(block.starttime)		# the next block after the one that moved
 
-		valid = True 													# check that the scan stays within telscope movement bounds
+		if len(moved) > 0:
 
-		valid = valid and startaz >= azbounds[0] and startaz <= azbounds[1]
-		valid = valid and startal >= albounds[0] and startal <= albounds[1]
+			with self.db.transaction() as cur:		# rewrite only the rows of the blocks that moved
 
-		if scantype == 'track':
+				cur.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(block.scanid,) for block in moved])
 
-			valid = valid and middleaz >= azbounds[0] and middleaz <= azbounds[1]
-			valid = valid and middleal >= albounds[0] and middleal <= albounds[1]
-			valid = valid and endaz >= azbounds[0] and endaz <= azbounds[1]
-			valid = valid and endal >= albounds[0] and endal <= albounds[1]
+				for block in moved:
 
-		if not valid:
-			
-			print(str(startaz) + ' ' + str(startal))
+					self.storeblock(cur, block.scanid, block.starttime, block.endtime)
 
-			return 'moveboundserror'
+			log.info('compacted schedule', extra = {'moved': len(moved), 'reclaimed': round(reclaimed)})
 
-		return 'scheduled'
+		return len(moved)
 
 
 def main():
@@ -282,7 +558,7 @@ def main():
 	schedule.schedulescan(-20, ntp.getcurrenttime())
 	schedule.schedulescan(-30, ntp.getcurrenttime())
 
-	for block in schedule.schedule:
+	for block in schedule.timeline:
 
 		print(str(block.scanid) + ' ' + str(block.starttime) + ' ' + str(block.endtime))
 
@@ -0,0 +1,437 @@
+'''
+A benchmark that compares the schedules built first-fit in submission order with the
+schedules built by the Optimizer. Each trial packs a random queue of scans into one
+night, with windows and durations like those of real requests, and reports the share
+of the night spent observing and the number of scans scheduled by each method.
+
+Run from the srtcontroller directory, e.g. python3 ScheduleBenchmark.py --scans 40 --trials 20
+With --slew, blocks are padded by the modelled slew between their sources instead of
+a fixed five minutes, as the controller does.
+
+With --suite, it instead runs the real Schedule.schedulescan() path on
+bursts of submissions drawn from a synthetic catalog, for each of several synthetic site
+configs, in a throwaway database built by dbsetup. Each run records per-scan latency,
+wall time, coordinate transforms and utilization as one json line, so the output of two
+versions can be compared with --baseline, e.g.
+python3 ScheduleBenchmark.py --suite --sizes 10,100,1000 --output before.jsonl
+
+Date: October 2026
+'''
+
+import sys
+
+sys.path.append(r'/var/www/html/CarletonSRT')
+
+from Optimizer import Optimizer
+from SlewModel import SlewModel
+from srtutility import Duration
+import argparse
+import datetime
+import subprocess
+import tempfile
+import random
+import runpy
+import json
+import math
+import time
+import os
+
+NIGHT = 10 * 3600		# length of the benchmark night in seconds
+PADDING = 300			# seconds kept free on either side of every block, as in Schedule
+STEP_SECONDS = 2		# seconds a spectrum step takes, as in Schedule
+MIN_OVERRUN = 60		# least number of seconds kept free after a block, as in Schedule
+
+DURATIONS = [600, 1200, 1800, 2700, 3600, 5400, 7200]		# scan lengths in seconds that requests are drawn from
+STEPS = [10, 25, 50, 100]		# spectrum step counts that requests are drawn from, which set how far a scan may overrun
+
+SUITE_DURATIONS = [300, 600, 900, 1200, 1800, 3600]		# scan lengths in seconds of suite submissions, shorter so bursts pack tightly
+SUITE_NIGHT = (datetime.datetime(2026, 1, 15, tzinfo = datetime.timezone.utc).timestamp(), 12 * 3600)		# fixed start and length of the suite's schedule period
+
+SITES = {'carleton': (44.45, -93.16, 0, 360, 0, 180),		# synthetic site configs: latitude, longitude and azimuth and altitude bounds
+		'equator': (0.0, -78.5, 0, 360, 0, 180),
+		'southern': (-33.9, 18.4, 0, 360, 0, 180),
+		'restricted': (44.45, -93.16, 90, 270, 15, 85)}
+
+LATENCY_REGRESSION = 1.25		# mean latency this many times the baseline's is reported as a regression
+UTILIZATION_REGRESSION = 0.01	# utilization this much below the baseline's is reported as a regression
+
+
+# Function that makes a random queue of scans for one night.
+#
+# :param generator: a random.Random
+# :param scans: number of scans in the queue
+# :param slew: if True each scan's source gets a path across the sky
+# :return jobs: list of Optimizer.Jobs in submission order
+def makejobs(generator, scans, slew):
+
+	jobs = []
+
+	for scanid in range(scans):
+
+		seconds = generator.choice(DURATIONS)
+
+		windowstart = generator.uniform(0, NIGHT - 3 * 3600)		# sources are observable for two to eight hours of the night
+		windowend = min(NIGHT, windowstart + generator.uniform(2 * 3600, 8 * 3600))
+
+		path = None
+
+		if slew:		# sources drift across the sky at about the sidereal rate from a random starting position
+
+			az = generator.uniform(90, 270)
+			al = generator.uniform(20, 70)
+
+			path = lambda t, az = az, al = al: (az + 15 * t / 3600, al)
+
+		contained = generator.random() < 0.7
+
+		overrun = max(MIN_OVERRUN, generator.choice(STEPS) * STEP_SECONDS)
+
+		jobs.append(Optimizer.Job(scanid, seconds, [(windowstart, windowend)], contained, path, overrun))
+
+	return jobs
+
+
+# Function that runs one trial.
+#
+# :param seed: seed of the trial's queue and search
+# :param scans: number of scans in the queue
+# :param objective: the Optimizer objective
+# :param timelimit: seconds the Optimizer may search for
+# :param slew: if True blocks are padded by the modelled slew between them
+# :return result: dict of the trial's measurements
+def runtrial(seed, scans, objective, timelimit, slew):
+
+	jobs = makejobs(random.Random(seed), scans, slew)
+
+	optimizer = Optimizer(objective, timelimit, seed, SlewModel().getslewtime if slew else None)
+
+	period = (0, NIGHT, 0, PADDING, ())
+
+	firstfit = optimizer.decode(jobs, period)
+
+	packstart = time.monotonic()
+
+	optimized = optimizer.pack(jobs, 0, NIGHT, 0, PADDING)
+
+	packtime = time.monotonic() - packstart
+
+	firstfitscore = optimizer.score(firstfit, jobs, ())
+	optimizedscore = optimizer.score(optimized, jobs, ())
+
+	return {'seed': seed,
+			'firstfitutilization': sum(block.endtime - block.starttime for block in firstfit) / NIGHT,
+			'optimizedutilization': sum(block.endtime - block.starttime for block in optimized) / NIGHT,
+			'firstfitscans': len(firstfit),
+			'optimizedscans': len(optimized),
+			'iterations': optimizer.iterations,
+			'seconds': packtime,
+			'improved': optimizedscore > firstfitscore}
+
+
+# Function that makes a synthetic catalog of sources spread evenly over the sky north of -40 degrees.
+#
+# :param generator: a random.Random
+# :param sources: number of sources
+# :return catalog: list of (ras, dec) strings in the format SCANPARAMS uses
+def makecatalog(generator, sources):
+
+	catalog = []
+
+	for i in range(sources):
+
+		ra = generator.uniform(0, 24)
+		dec = math.degrees(math.asin(generator.uniform(math.sin(math.radians(-40)), 1)))
+
+		rah = int(ra)
+		ram = int((ra - rah) * 60)
+		ras = int(((ra - rah) * 60 - ram) * 60)
+
+		decd = int(abs(dec))
+		decm = int((abs(dec) - decd) * 60)
+		decs = int(((abs(dec) - decd) * 60 - decm) * 60)
+
+		catalog.append(('%dh%dm%ds' % (rah, ram, ras), '%s%dd%dm%ds' % ('-' if dec < 0 else '', decd, decm, decs)))
+
+	return catalog
+
+
+# Function that makes a burst of submissions drawn from a catalog.
+#
+# :param generator: a random.Random
+# :param catalog: list of (ras, dec) strings
+# :param scans: number of submissions
+# :return burst: list of dicts of SCANPARAMS values in submission order
+def makeburst(generator, catalog, scans):
+
+	burst = []
+
+	for scanid in range(1, scans + 1):
+
+		ras, dec = generator.choice(catalog)
+
+		seconds = generator.choice(SUITE_DURATIONS)
+
+		burst.append({'id': scanid, 'type': 'track' if generator.random() < 0.7 else 'drift', 'source': 'benchmark', 'ras': ras, 'dec': dec,
+			'duration': Duration.fromseconds(seconds), 'priority': 0})
+
+	return burst
+
+
+# Function that prepares a throwaway database with the repo's schema and counts coordinate transforms from then on.
+# The database is found the way the controller finds it, relative to the working directory.
+#
+# :return counter: dict of transform calls and transformed points, updated as the suite runs
+def setupsuite():
+
+	dbsetup = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'srtutility', 'dbsetup.py')
+
+	workdir = tempfile.mkdtemp(prefix = 'srtbenchmark')
+
+	os.mkdir(os.path.join(workdir, 'srtdatabase'))
+	os.mkdir(os.path.join(workdir, 'run'))
+
+	os.chdir(os.path.join(workdir, 'run'))
+
+	runpy.run_path(dbsetup)
+
+	from astropy.coordinates import SkyCoord
+	import numpy
+
+	counter = {'transforms': 0, 'points': 0}
+
+	transform = SkyCoord.transform_to
+
+	def countedtransform(self, frame, *args, **kwargs):		# every transform in the scheduler goes through SkyCoord.transform_to
+
+		obstime = getattr(frame, 'obstime', None)		# a frame at many times transforms a point for each
+
+		counter['transforms'] += 1
+		counter['points'] += int(numpy.size(obstime)) if obstime != None else 1
+
+		return transform(self, frame, *args, **kwargs)
+
+	SkyCoord.transform_to = countedtransform
+
+	return counter
+
+
+# Function that runs one burst through a fresh schedule with a cold visibility cache.
+#
+# :param site: name of a site config in SITES
+# :param scans: number of submissions in the burst
+# :param seed: seed of the catalog and burst
+# :param catalogsize: number of sources in the catalog
+# :param counter: the transform counter returned by setupsuite()
+# :return result: dict of the run's measurements
+def runburst(site, scans, seed, catalogsize, counter):
+
+	from Schedule import Schedule
+	from Visibility import Visibility
+	from Config import Config
+	from srtutility.SRTDatabase import SRTDatabase
+
+	db = SRTDatabase()
+
+	lat, lon, azlower, azupper, allower, alupper = SITES[site]
+
+	with db.transaction() as cur:		# the trigger bumps the config version, which the cache picks up
+
+		cur.execute("UPDATE CONFIG SET LAT = ?, LON = ?, AZLOWER = ?, AZUPPER = ?, ALLOWER = ?, ALUPPER = ?", (lat, lon, azlower, azupper, allower, alupper))
+		cur.execute("DELETE FROM SCHEDULE")
+		cur.execute("DELETE FROM VISIBILITY")
+
+	Config().checkversion()
+
+	Visibility._cache.clear()
+
+	generator = random.Random(seed)
+
+	burst = makeburst(generator, makecatalog(generator, catalogsize), scans)
+
+	schedule = Schedule(SUITE_NIGHT[0], SUITE_NIGHT[0] + SUITE_NIGHT[1])
+
+	curtime = SUITE_NIGHT[0] - 3600
+
+	transforms = dict(counter)
+
+	latencies = []
+	statuses = {}
+
+	runstart = time.perf_counter()
+
+	for scanparams in burst:
+
+		scanstart = time.perf_counter()
+
+		status = schedule.schedulescan(scanparams['id'], curtime, scanparams)
+
+		latencies.append(time.perf_counter() - scanstart)
+
+		statuses[status] = statuses.get(status, 0) + 1
+
+	walltime = time.perf_counter() - runstart
+
+	return {'site': site, 'scans': scans, 'seed': seed, 'catalog': catalogsize, 'walltime': round(walltime, 4), 'latency': getpercentiles(latencies),
+			'transforms': counter['transforms'] - transforms['transforms'], 'transformpoints': counter['points'] - transforms['points'],
+			'scheduled': len(schedule.timeline), 'statuses': statuses,
+			'utilization': round(sum(block.endtime - block.starttime for block in schedule.timeline) / SUITE_NIGHT[1], 4)}
+
+
+# Function that summarizes latencies.
+#
+# :param latencies: list of seconds
+# :return summary: dict of mean, median, 95th percentile and maximum in milliseconds
+def getpercentiles(latencies):
+
+	if len(latencies) == 0:
+
+		return {'mean': 0, 'p50': 0, 'p95': 0, 'max': 0}
+
+	ordered = sorted(latencies)
+
+	return {'mean': round(1000 * sum(ordered) / len(ordered), 3), 'p50': round(1000 * ordered[len(ordered) // 2], 3),
+			'p95': round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3), 'max': round(1000 * ordered[-1], 3)}
+
+
+# Function that compares suite results with a baseline run.
+#
+# :param results: list of result dicts
+# :param baselinefile: path of a json lines file written by an earlier --suite run
+# :return regressions: list of strings describing each regression
+def compare(results, baselinefile):
+
+	baseline = {}
+
+	with open(baselinefile) as f:
+
+		for line in f:
+
+			record = json.loads(line)
+
+			if 'site' in record:		# skip the header line
+
+				baseline[(record['site'], record['scans'], record['seed'], record['catalog'])] = record
+
+	regressions = []
+
+	for result in results:
+
+		previous = baseline.get((result['site'], result['scans'], result['seed'], result['catalog']))
+
+		if previous == None:
+
+			continue
+
+		if previous['latency']['mean'] > 0 and result['latency']['mean'] > LATENCY_REGRESSION * previous['latency']['mean']:
+
+			regressions.append('%s %d scans: mean latency %.3f ms, was %.3f ms' % (result['site'], result['scans'], result['latency']['mean'], previous['latency']['mean']))
+
+		if result['utilization'] < previous['utilization'] - UTILIZATION_REGRESSION:
+
+			regressions.append('%s %d scans: utilization %.4f, was %.4f' % (result['site'], result['scans'], result['utilization'], previous['utilization']))
+
+	return regressions
+
+
+# Function that runs the scheduler suite and writes its results.
+#
+# :param args: the parsed command line arguments
+# :return status: exit status, 1 if a regression against the baseline was found
+def runsuite(args):
+
+	sizes = [int(size) for size in args.sizes.split(',')]
+	sites = args.sites.split(',')
+
+	baselinefile = os.path.abspath(args.baseline) if args.baseline != None else None
+	outputfile = os.path.abspath(args.output) if args.output != None else None
+
+	try:
+
+		version = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+			capture_output = True, text = True).stdout.strip() or None
+
+	except OSError as e:
+
+		version = None
+
+	counter = setupsuite()
+
+	results = []
+
+	for site in sites:
+
+		for scans in sizes:
+
+			result = runburst(site, scans, args.seed, args.catalog, counter)
+
+			results.append(result)
+
+			print('%-10s %6d scans  %8.3f ms mean  %8.3f ms p95  %8.2f s wall  %7d transforms  %5.1f%% used' % (site, scans, result['latency']['mean'],
+				result['latency']['p95'], result['walltime'], result['transforms'], 100 * result['utilization']), file = sys.stderr)
+
+	lines = [json.dumps({'version': version, 'python': sys.version.split()[0], 'time': time.time()})] + [json.dumps(result, sort_keys = True) for result in results]
+
+	if outputfile != None:
+
+		with open(outputfile, 'w') as f:
+
+			f.write('\n'.join(lines) + '\n')
+
+	else:
+
+		print('\n'.join(lines))
+
+	if baselinefile != None:
+
+		regressions = compare(results, baselinefile)
+
+		for regression in regressions:
+
+			print('regression: ' + regression, file = sys.stderr)
+
+		return 1 if len(regressions) > 0 else 0
+
+	return 0
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description = 'Compare first-fit and optimized schedules, or with --suite benchmark the scheduler.')
+	parser.add_argument('--scans', type = int, default = 30, help = 'scans submitted for the night')
+	parser.add_argument('--trials', type = int, default = 20, help = 'number of random queues')
+	parser.add_argument('--objective', default = 'time', choices = ['time', 'count'])
+	parser.add_argument('--timelimit', type = float, default = Optimizer.TIME_LIMIT, help = 'seconds of search per trial')
+	parser.add_argument('--slew', action = 'store_true', help = 'pad blocks by the modelled slew instead of five minutes')
+	parser.add_argument('--suite', action = 'store_true', help = 'benchmark Schedule.schedulescan() on synthetic bursts instead')
+	parser.add_argument('--sizes', default = '10,100,1000,10000', help = 'comma separated burst sizes for --suite')
+	parser.add_argument('--sites', default = ','.join(SITES), help = 'comma separated site configs for --suite')
+	parser.add_argument('--catalog', type = int, default = 200, help = 'sources in the synthetic catalog for --suite')
+	parser.add_argument('--seed', type = int, default = 0, help = 'seed of the catalog and bursts for --suite')
+	parser.add_argument('--output', help = 'json lines file for --suite results, stdout if not given')
+	parser.add_argument('--baseline', help = 'json lines file of an earlier --suite run to check for regressions')
+	args = parser.parse_args()
+
+	if args.suite:
+
+		sys.exit(runsuite(args))
+
+	results = [runtrial(seed, args.scans, args.objective, args.timelimit, args.slew) for seed in range(args.trials)]
+
+	print('seed  firstfit  optimized  scans(ff/opt)  iterations  seconds')
+
+	for result in results:
+
+		print('%4d  %7.1f%%  %8.1f%%  %6d/%-6d  %10d  %7.2f' % (result['seed'], 100 * result['firstfitutilization'], 100 * result['optimizedutilization'],
+			result['firstfitscans'], result['optimizedscans'], result['iterations'], result['seconds']))
+
+	trials = len(results)
+
+	print('mean  %7.1f%%  %8.1f%%  %6.1f/%-6.1f  improved in %d of %d trials' % (100 * sum(result['firstfitutilization'] for result in results) / trials,
+		100 * sum(result['optimizedutilization'] for result in results) / trials,
+		sum(result['firstfitscans'] for result in results) / trials, sum(result['optimizedscans'] for result in results) / trials,
+		sum(1 for result in results if result['improved']), trials))
+
+
+if __name__ == '__main__':
+
+	main()
@@ -0,0 +1,193 @@
+'''
+A class that owns the serial connection to the telescope's stamp controller. The
+port is opened once and kept open for the life of the controller instead of once per
+command, and a lock makes each command and its reply one exchange, so commands from
+different threads cannot interleave. After a serial error the port is closed and
+reopened on the next command, waiting between attempts while the device is missing.
+
+Date: October 2026
+'''
+
+from srtutility import SRTLogging
+from SlewModel import SlewModel
+import threading
+import serial
+import time
+import os
+
+log = SRTLogging.getlogger('SerialPort')
+
+class SerialPort:
+
+	DEVICE = os.environ.get('SRT_SERIAL_PORT', '/dev/ttyAMA0')		# serial device the stamp controller is connected to
+	BAUDRATE = 2400
+	TIMEOUT = 1					# seconds without a byte that end a reply
+	RETRIES = 3					# attempts to open the port before a command fails
+	RECONNECT_DELAY = 2			# seconds between attempts to open the port
+	REPLY_TIMEOUT = 10			# seconds a reply may take in all, plus the drive time of a move
+	REPLY_MARGIN = 2			# factor applied to a move's drive time in the reply deadline
+
+	_lock = threading.Lock()	# port shared by every SerialPort object
+	_port = None
+
+
+	# Method that sends a command to the stamp controller and waits for its reply.
+	# If the port cannot be written to it is reopened and the command sent once more. A command whose reply could not be
+	# read is not sent again, since a move may already have started, and the port is reopened by the next command.
+	# A reply that has not ended by its deadline counts as a read error, so the lock is never held for longer than that.
+	#
+	# :param message: the command, ending in a newline
+	# :return response: the reply, or None if the exchange failed
+	def command(self, message):
+
+		with SerialPort._lock:
+
+			for attempt in range(2):
+
+				port = self.getport()
+
+				if port == None:
+
+					return None
+
+				try:
+
+					port.write(message.encode('ascii'))
+
+				except (serial.SerialException, OSError) as e:
+
+					log.warning('could not write to serial port', extra = {'command': message.strip(), 'error': repr(e)})
+
+					self.reset()
+
+					continue
+
+				try:
+
+					return self.readreply(port, time.monotonic() + self.getreplytimeout(message))
+
+				except (serial.SerialException, OSError) as e:
+
+					log.warning('could not read from serial port', extra = {'command': message.strip(), 'error': repr(e)})
+
+					self.reset()
+
+					return None
+
+			return None
+
+
+	# Method that closes the port. The next command opens it again.
+	#
+	# :param timeout: seconds to wait for a command in progress to finish, or -1 to wait for as long as it takes
+	# :return closed: boolean, False if a command was still in progress after timeout seconds and the port was left open
+	def close(self, timeout = -1):
+
+		if not SerialPort._lock.acquire(timeout = timeout):
+
+			return False
+
+		try:
+
+			self.reset()
+
+		finally:
+
+			SerialPort._lock.release()
+
+		return True
+
+
+	# Helper method that reads a reply one byte at a time, until bytes have been received and then none arrive for TIMEOUT seconds.
+	#
+	# :param port: the open serial.Serial
+	# :param deadline: monotonic time by which the reply must have ended
+	# :return response: the decoded reply
+	# :raises serial.SerialTimeoutException: if the reply has not ended by the deadline
+	def readreply(self, port, deadline):
+
+		response = ''
+
+		while True:
+
+			if time.monotonic() > deadline:		# the controller is silent or keeps sending, so give up rather than hold the port
+
+				raise serial.SerialTimeoutException('no complete reply by the deadline, ' + str(len(response)) + ' bytes received')
+
+			rbyte = port.read()		# read from serial port
+
+			if len(rbyte) > 0:		# if a byte was received, decode and append to response
+
+				response += rbyte.decode('ascii')
+
+			elif len(response) > 0:		# if no byte was received and a response has been received already, stop reading
+
+				return response
+
+
+	# Helper method that works out how long to wait for the reply to a command. A move is only answered once the
+	# axis stops, so its drive time at the slower of the default and measured drive rates is added.
+	#
+	# :param message: the command, e.g. ' move 1 117\n'
+	# :return seconds: seconds to wait for the reply
+	def getreplytimeout(self, message):
+
+		fields = message.split()
+
+		if len(fields) == 3 and fields[0] == 'move':
+
+			rate = min(SlewModel.DRIVE_RATE, SlewModel().getrate())
+
+			return SerialPort.REPLY_TIMEOUT + SerialPort.REPLY_MARGIN * int(fields[2]) / rate
+
+		return SerialPort.REPLY_TIMEOUT
+
+
+	# Helper method that returns the open port, opening it if needed. Called with the lock held.
+	#
+	# :return port: the open serial.Serial, or None if it could not be opened
+	def getport(self):
+
+		if SerialPort._port != None:
+
+			return SerialPort._port
+
+		for attempt in range(SerialPort.RETRIES):
+
+			if attempt > 0:
+
+				time.sleep(SerialPort.RECONNECT_DELAY)
+
+			try:
+
+				SerialPort._port = serial.Serial(SerialPort.DEVICE, baudrate = SerialPort.BAUDRATE, timeout = SerialPort.TIMEOUT)
+
+				log.info('opened serial port', extra = {'device': SerialPort.DEVICE, 'attempts': attempt + 1})
+
+				return SerialPort._port
+
+			except (serial.SerialException, OSError) as e:
+
+				log.warning('could not open serial port', extra = {'device': SerialPort.DEVICE, 'attempt': attempt + 1, 'error': repr(e)})
+
+		log.error('serial port unavailable', extra = {'device': SerialPort.DEVICE})
+
+		return None
+
+
+	# Helper method that closes the port after an error, ignoring errors from closing it. Called with the lock held.
+	#
+	# :return:
+	def reset(self):
+
+		if SerialPort._port != None:
+
+			try:
+
+				SerialPort._port.close()
+
+			except (serial.SerialException, OSError):
+
+				pass
+
+			SerialPort._port = None
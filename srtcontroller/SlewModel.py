@@ -0,0 +1,84 @@
+'''
+A model of how long the telescope takes to move between two positions. The stamp
+controller drives one axis at a time at 11.7 counts per degree, so a slew takes the
+azimuth move plus the altitude move, each at the drive rate plus a fixed settling
+time. The drive rate starts at a conservative default and is updated from every move
+CommandStation times, so the schedule's padding follows the real mount.
+
+Date: October 2026
+'''
+
+from srtutility import SRTLogging
+import threading
+import math
+
+log = SRTLogging.getlogger('SlewModel')
+
+class SlewModel:
+
+	COUNTS_PER_DEGREE = 11.7	# stamp controller counts per degree on either axis
+	DRIVE_RATE = 6.0			# counts per second assumed until a move has been measured
+	SETTLE = 15					# seconds added for each axis that moves, for the serial exchange and the dish settling
+	MARGIN = 1.25				# factor applied to drive time, so small errors in the rate do not make scans late
+	MIN_COUNTS = 20				# moves shorter than this are not used to measure the drive rate
+	WEIGHT = 0.2				# weight of each new measurement in the running drive rate
+
+	_lock = threading.Lock()	# measured rate shared by every SlewModel object
+	_rate = DRIVE_RATE
+	_measured = 0				# number of moves measured
+
+
+	# Method that estimates the time needed to move between two positions.
+	#
+	# :param fromazal: (azimuth, altitude) in degrees the telescope starts at
+	# :param toazal: (azimuth, altitude) in degrees the telescope moves to
+	# :return seconds: estimated slew time in seconds
+	def getslewtime(self, fromazal, toazal):
+
+		rate = SlewModel._rate
+
+		seconds = 0
+
+		for axis in range(2):		# the axes move one after the other, so their times add
+
+			counts = math.floor(abs(toazal[axis] - fromazal[axis]) * SlewModel.COUNTS_PER_DEGREE)
+
+			if counts > 0:
+
+				seconds += SlewModel.MARGIN * counts / rate + SlewModel.SETTLE
+
+		return seconds
+
+
+	# Method that returns the current estimate of the drive rate.
+	#
+	# :return rate: drive rate in counts per second
+	def getrate(self):
+
+		return SlewModel._rate
+
+
+	# Method that updates the drive rate from a timed move of one axis.
+	#
+	# :param counts: number of counts the axis moved
+	# :param seconds: time the move took, from sending the command to the controller's reply
+	# :return:
+	def record(self, counts, seconds):
+
+		if counts < SlewModel.MIN_COUNTS or seconds <= 0:
+
+			return
+
+		with SlewModel._lock:
+
+			if SlewModel._measured == 0:
+
+				SlewModel._rate = counts / seconds
+
+			else:
+
+				SlewModel._rate = (1 - SlewModel.WEIGHT) * SlewModel._rate + SlewModel.WEIGHT * counts / seconds
+
+			SlewModel._measured += 1
+
+		log.debug('measured drive rate', extra = {'counts': counts, 'seconds': round(seconds, 2), 'rate': round(SlewModel._rate, 3)})
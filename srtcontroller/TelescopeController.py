@@ -10,287 +10,766 @@ import sys
 
 sys.path.append(r'/var/www/html/CarletonSRT')
 
-from Scan import Scan
+from ScanExecutor import ScanExecutor
 from srtutility.NTPTime import NTPTime
-import Schedule
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility.CommandChannel import CommandServer
+from srtutility import SRTLogging
+from Ephemeris import Ephemeris
+from Visibility import Visibility
+from Config import Config
+from Horizon import Horizon
+from Coalescer import Coalescer
+from Filler import Filler
+from SlewModel import SlewModel
+from SerialPort import SerialPort
 import datetime
 import time
-import _thread
-import sqlite3
-from astral import Astral
-from astropy.time import Time
+import queue
+import threading
+import signal
+import atexit
+import os
 
 ntp = NTPTime()
 
+log = SRTLogging.getlogger('TelescopeController')
+
 database_location = '../srtdatabase/srtdata.db'
 
+db = SRTDatabase(database_location)		# shared, long-lived database connections
+
+config = Config()		# cached config values, reloaded when the config version changes
+
+coalescer = Coalescer()		# merges compatible requests into shared observations
+
+filler = Filler()		# fills large gaps in the night schedules with survey scans, and keeps utilization figures
+
+POLL_INTERVAL = 2.0		# seconds between checks for database changes while waiting, a fallback for when the web app cannot reach the command channel
+ACK_TIMEOUT = 2.0		# seconds a command waits for the main loop before acknowledging anyway
+START_WINDOW = 5		# seconds after its start time that a scan may still be started
+MAX_QUERY_PARAMS = 900	# most parameters bound in one IN (...) query, below sqlite's default limit of 999
+SHUTDOWN_TIMEOUT = 5.0	# seconds shutdown waits for a serial command in progress before leaving the port to the operating system
+OPTIMIZE_LIMIT = 1.0	# seconds of optimizer search per intake, across every schedule, so the intake transaction stays well inside the web app's 5 second lock timeout
+
+HORIZON_DAYS = int(os.environ.get('SRT_HORIZON_DAYS', Horizon.DAYS))		# number of days and nights ahead in which scans are scheduled
+OPTIMIZER = os.environ.get('SRT_OPTIMIZER', 'off')		# 'time' or 'count' re-packs a schedule when scans do not fit first-fit, maximizing observing time or scan count
+FILLER = os.environ.get('SRT_FILLER', 'off')		# 'on' fills large gaps in the night schedules with scans from the SURVEY table
+
+wakeup = threading.Event()		# set to wake the main loop early, e.g. when a scan finishes or a command arrives
+
+passes = {'started': 0, 'completed': 0}		# count of main loop passes, so commands can wait for a pass that saw their change
+passdone = threading.Condition()
+
 #
 # The main method of the telescope code. All telescope actions ultimately originate from this method.
 #
+# The main loop is event driven: it sleeps until the next scheduled scan start or the next local midnight,
+# and wakes early whenever another connection commits a change to the database
+# (a submitted or cancelled scan) or the scan executor reports that a scan finished.
 def main():
 
-	srtdb = sqlite3.connect(database_location)		# establish a connection and cursor into the database
-	srtdb.row_factory = sqlite3.Row
+	SRTLogging.setup()		# start the background log writer, with levels from SRT_LOG_LEVELS
+
+	atexit.register(SRTLogging.shutdown)		# registered first so it runs last, flushing the records of the other exit handlers
+
+	signal.signal(signal.SIGTERM, terminate)		# stopping the service exits through the same path as an interrupt
+
+	atexit.register(shutdown)
+
+	srtdb = db.connection()		# get this thread's connection and a cursor into the database
 	cur = srtdb.cursor()
 
-	telescope = Scan()			# initialize a Scan object for running scans
+	executor = ScanExecutor(oncomplete = lambda job: wakeup.set())		# initialize the executor that runs scans on the telescope
+
+	config.checkversion()		# load config data from the db
+
+	ephemeris = Ephemeris()			# initialize the table of day and night times for the site
+
+	ephemeris.update(config.get())		# regenerate the table if the site moved, and extend it to cover the horizon
 
-	config = cur.execute("SELECT * FROM CONFIG").fetchone()		# fetch config data from the db
+	visibility = Visibility()		# initialize the cache of windows in which sources can be observed
 
-	a = Astral()					# initalize an Astral object for computer day and night times
+	visibility.prune(ntp.getcurrenttime())		# drop windows left over from past periods or an old config
 
 	today = datetime.date.today()	# get today's date
 
-	daytimes = a.daylight_utc(today, config['lat'], config['lon'])			# compute date and night times in UTC using the Astral object
-	nighttimes = a.night_utc(today, config['lat'], config['lon'])
+	horizon = Horizon(ephemeris, config, HORIZON_DAYS)		# day and night schedules for the coming days, built as they are needed
 
-	print('Daystart: ' + daytimes[0].isoformat() + ', Dayend: ' + daytimes[1].isoformat())
-	print('Nightstart:' + nighttimes[0].isoformat() + ', Nightend: ' + nighttimes[1].isoformat())
+	log.info('scheduling horizon', extra = {'days': HORIZON_DAYS})
 
-	dusk = nighttimes[0].timestamp()	# get unix times for day and night
-	dawn = nighttimes[1].timestamp()
-	sunrise = daytimes[0].timestamp()
-	sunset = daytimes[1].timestamp()
+	server = startcommandserver(executor, horizon)		# start listening for commands from the web app
 
-	dayschedule = Schedule.Schedule(sunrise + 7200, sunset - 7200)		# instantiate day and night schedules
-	nightschedule = Schedule.Schedule(dusk, dawn)
+	atexit.register(server.stop)		# remove the socket on exit. exit handlers run in reverse order, so this runs before shutdown()
 
-	currentscanid = None
+	currentjob = None		# Future of the scan handed to the executor, or None
 	
-	### attempt to reschedule scans in SCHEDULE after restart ###
-	
-	schedule = cur.execute("SELECT * FROM SCHEDULE").fetchall()		# get the schedule from the db
-	
-	cur.execute("DELETE FROM SCHEDULE")		# delete all entries in SCHEDULE
-	
-	for scan in schedule:		# attempt to reschedule all scheduled scans
+	### restore the scans in SCHEDULE after restart, including any a crash left running ###
 
-		scanparams = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (scan['id'],)).fetchone()
-		
-		curtime = ntp.getcurrenttime()
+	restorestart = time.monotonic()
 
-		if scanparams['source'] == 'sun':		# if source is the sun, schedule during the day
+	curtime = ntp.getcurrenttime()
 
-			status = dayschedule.schedulescan(scanparams['id'], curtime)
+	with db.transaction() as cur:
 
-		else:		# if source is not the sun, schedule at night
+		cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE STATUS = ? AND (ID IN (SELECT ID FROM SCHEDULE) OR ID IN (SELECT ID FROM SHAREDSCANS))",
+			('scheduled', 'running'))		# scans a crash left running are scheduled again with the rest below, their data was never stored
+
+		recovered = cur.rowcount
+
+		orphaned = cur.execute("SELECT SCANIDS.ID, SCANIDS.NAME, SCANPARAMS.TYPE FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID WHERE SCANIDS.STATUS = ?", ('running',)).fetchall()
+
+		if len(orphaned) > 0:		# running scans that are no longer in the schedule cannot be run again
 
-			status = nightschedule.schedulescan(scanparams['id'], curtime)
-				
-		if status != 'scheduled':
-				
 			today = datetime.date.today()
-			cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (newscan['id'], scanparams['name'], scanparams['type'], today.day, today.month, today.year))
 
-		cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", (status, newscan['id']))
-		srtdb.commit()
+			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE STATUS = ?", ('error', 'running'))
+			cur.executemany("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", [(scan['id'], scan['name'], scan['type'], today.day, today.month, today.year) for scan in orphaned])
+
+		if recovered > 0 or len(orphaned) > 0:
+
+			log.warning('recovered scans left running', extra = {'rescheduled': recovered, 'failed': len(orphaned)})
+
+		saved = cur.execute("SELECT SCHEDULE.STARTUNIX, SCHEDULE.ENDUNIX, SCHEDULE.VERSION AS SCHEDULEVERSION, SCANIDS.NAME, SCANPARAMS.* FROM SCHEDULE \
+			JOIN SCANIDS ON SCHEDULE.ID = SCANIDS.ID JOIN SCANPARAMS ON SCHEDULE.ID = SCANPARAMS.ID ORDER BY SCHEDULE.STARTUNIX").fetchall()		# get the scheduled scans and their params from the db
+
+		stale = []
+
+		for scan in saved:		# blocks still ahead of us and checked against the current config go straight back into the timeline
+
+			if scan['startunix'] == None or scan['startunix'] + START_WINDOW < curtime or scan['scheduleversion'] != config.getversion() \
+				or not horizon.restore(scan['id'], scan['startunix'], scan['endunix'], curtime, scan):
+
+				stale.append(scan)
+
+		dropped = requeuescans(stale, horizon, curtime)		# attempt to reschedule the scans whose time has passed or could not be restored
+
+	log.info('restored schedule', extra = {'restored': len(saved) - len(stale), 'rescheduled': len(stale) - dropped, 'dropped': dropped, 'latency': round(time.monotonic() - restorestart, 4)})
 
 	### MAIN EXECUTION LOOP FOR TELESCOPE-SIDE CODE ###
 
+	dataversion = None		# database change counter seen on the last pass, None forces a full first pass
+
 	while True:
 
-		time.sleep(0.5)			# sleep for half a second to reduce looping speed
+		### sleep until there is something to do ###
+
+		midnight = datetime.datetime.combine(today + datetime.timedelta(days = 1), datetime.time()).timestamp()	# unix time of the next local midnight
+
+		wakeuptime = nextwakeup(horizon, currentjob, curtime, [midnight])
+
+		newversion = waitforchange(cur, dataversion, time.monotonic() + (wakeuptime - curtime))		# sleep on the monotonic clock, offset from ntp time
 
+		changed = newversion != dataversion
+
+		dataversion = newversion
+
+		with passdone:
+
+			passes['started'] += 1
 
-		### set whether it is day or night ###
 
 		curtime = ntp.getcurrenttime()
 
-		if curtime >= dusk and curtime <= dawn:
 
-			currentschedule = nightschedule
+		### roll the horizon forward ###
+
+		unrun = [scanid for scanid in horizon.roll(curtime) if currentjob == None or scanid != currentjob.scanid]		# drop schedules whose period has ended, the others keep their blocks
+
+		if len(unrun) > 0:		# scans that missed their start are scheduled again rather than left behind
+
+			missed = []
+
+			for i in range(0, len(unrun), MAX_QUERY_PARAMS):		# split very long schedules to stay under sqlite's parameter limit
 
-		else:
+				chunk = unrun[i:i + MAX_QUERY_PARAMS]
 
-			currentschedule = dayschedule
+				missed += db.fetchall("SELECT SCANIDS.NAME, SCANIDS.STATUS, SCANPARAMS.* FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID \
+					WHERE SCANIDS.ID IN (" + ','.join('?' * len(chunk)) + ")", chunk)
 
+			db.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(scan['id'],) for scan in missed if scan['status'] != 'scheduled'])		# e.g. cancelled just before the period ended
+			db.commit()
 
-		### create new schedules if current schedules are completed ###
+			missed = [scan for scan in missed if scan['status'] == 'scheduled']
 
-		config = cur.execute("SELECT * FROM CONFIG").fetchone()		# get config data from the db
+			dropped = requeuescans(missed, horizon, curtime)
+
+			log.info('rescheduled scans left in an ended period', extra = {'scans': len(missed) - dropped, 'dropped': dropped})
+
+		filler.roll(curtime)		# log the utilization of the periods that ended
 
 		newday = datetime.date.today()								# get today's date
 
-		if newday.day != today.day or newday.month != today.month or newday.year != today.year:	# if the day has changed, create new day schedule
+		if newday != today:		# if the day has changed, extend the ephemeris and drop stale visibility windows
 
-			print('it\'s a new day! setting up new daytime schedule')
+			log.info('new day')
 
 			today = newday
 
-			daytimes = a.daylight_utc(today, config['lat'], config['lon'])
+			ephemeris.update(config.get(), today)		# drop yesterday from the table and compute one more day ahead
+
+			visibility.prune(curtime)
+
+		if changed:		# submissions, cancellations and config changes can only appear after a database change
 
-			sunrise = Time(daytimes[0], format = 'datetime', scale = 'utc').unix
-			sunset = Time(daytimes[1], format = 'datetime', scale = 'utc').unix
+			if config.checkversion():		# reload the cached config if the web app changed it
 
-			dayschedule = Schedule(sunrise + 7200, sunset - 7200)
+				log.info('config changed', extra = {'version': config.getversion()})
 
-		if curtime > dawn:											# if the night is over, create new night schedule
+				ephemeris.update(config.get(), today)
 
-			print('good morning! setting up new nighttime schedule')
+				visibility.prune(curtime)		# windows depend on the site and movement bounds
 
-			nighttimes = a.night_utc(today, config['lat'], config['lon'])
+			### remove cancelled scans from schedules ###
 
-			dusk = Time(nighttimes[0], format = 'datetime', scale = 'utc').unix
-			dawn = Time(nighttimes[1], format = 'datetime', scale = 'utc').unix
+			cancelscans(horizon, currentjob.scanid if currentjob != None else None)
 
-			nightschedule = Schedule(dusk, dawn)
 
+			### insert newly submitted scans into the schedules ###
 
-		### remove cancelled scans from schedules ###
+			submitted = cur.execute("SELECT SCANIDS.NAME, SCANPARAMS.* FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID \
+				WHERE SCANIDS.STATUS = ? ORDER BY SCANPARAMS.PRIORITY DESC, SCANIDS.ROWID", ('submitted',)).fetchall()		# get every pending submission, highest priority first, then in submission order
 
-		print('might be time to cancel some scans')
+			if len(submitted) > 0:
 
-		cancelscans(dayschedule)
-		cancelscans(nightschedule)
+				intakestart = time.monotonic()
 
+				horizon.prepare(submitted, curtime)		# compute windows before the transaction, so the write lock is not held meanwhile
 
-		### insert a new scan into the schedule ###
+				with db.transaction():
 
-		print('is there a new scan to add?')
+					schedulescans(submitted, horizon, curtime, 'submitted')
 
-		newscan = cur.execute("SELECT * FROM SCANIDS WHERE STATUS = ?", ('submitted',)).fetchone()
+				log.info('scheduled submitted scans', extra = {'scans': len(submitted), 'latency': round(time.monotonic() - intakestart, 4)})
 
-		if newscan != None:				# check if a scan has been submitted
 
-			print('yes there is!')
+		### remove current scan from the schedule when it finishes ###
 
-			scanparams = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (newscan['id'],)).fetchone()
+		if currentjob != None and currentjob.done():		# the executor finished the scan, successfully or not
 
-			if scanparams['source'] == 'sun':		# if source is the sun, schedule during the day
+			if currentjob.exception() != None:
 
-				status = dayschedule.schedulescan(scanparams['id'], curtime)
+				log.error('scan raised an exception', extra = {'scanid': currentjob.scanid, 'error': repr(currentjob.exception())})
 
-			else:		# if source is not the sun, schedule at night
+			else:
 
-				status = nightschedule.schedulescan(scanparams['id'], curtime)
-				
-			if status != 'scheduled':
-				
-				today = datetime.date.today()
-				cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (newscan['id'], scanparams['name'], scanparams['type'], today.day, today.month, today.year))
+				log.info('scan finished', extra = {'scanid': currentjob.scanid, 'status': currentjob.result()})
 
-			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", (status, newscan['id']))
+			cur.execute("DELETE FROM SCHEDULE WHERE ID = ?", (currentjob.scanid,))
 			srtdb.commit()
 
+			block = horizon.getblock(currentjob.scanid)
 
-		### remove current scan from the schedule when it finishes ###
+			if block != None:		# count the time the scan used towards its period's utilization
+
+				priority = db.fetchone("SELECT PRIORITY FROM SCANPARAMS WHERE ID = ?", (currentjob.scanid,))
+
+				filler.record(horizon.getschedule(currentjob.scanid), max(0, min(curtime, block.endtime) - block.starttime), priority != None and priority['priority'] == Filler.PRIORITY)
 
-		print('did the current scan finish running?')
+			horizon.deschedulescan(currentjob.scanid)
 
-		if currentscanid != None:		# check to see if a scan is supposed to be running
+			coalescer.detach(currentjob.scanid)		# the requesters' results and statuses were written with the host's
 
-			currentscan = cur.execute("SELECT * FROM SCANIDS WHERE ID = ?", (currentscanid,)).fetchone()
+			currentjob = None
 
-			if currentscan == None or currentscan['status'] != 'running':	# if scan is not running anymore, remove from schedule and reset currentscanid
 
-				print('yes it did!')
+		### pull later scans forward into time freed by cancelled, timed out or finished scans ###
 
-				cur.execute("DELETE FROM SCHEDULE WHERE ID = ?", (currentscanid,))
-				srtdb.commit()
+		horizon.compact(curtime)
 
-				currentschedule.deschedulescan(currentscanid)
 
-				currentscanid = None
+		### put survey scans into large gaps in the coming nights ###
+
+		if FILLER != 'off':
+
+			filler.fill(horizon, curtime)
 
 
 		### run the next scan in the schedule ###
 
-		print('time to run a scan?')
+		if currentjob == None:
+
+			currentjob = runscan(horizon, executor, curtime)
+
+		with passdone:		# acknowledge commands waiting on this pass
 
-		currentscanid = runscan(currentschedule)
+			passes['completed'] = passes['started']
 
+			passdone.notify_all()
 
-# Helper method that checks for any cancelled scans that must be removed from a schedule.
+
+# Helper method that turns a termination signal into SystemExit, so the controller's exit handlers run.
 #
-# :param schedule: the schedule to check for cancelled scans
+# :param signum: the signal number
+# :param frame: the interrupted stack frame
 # :return:
-def cancelscans(schedule):
+def terminate(signum, frame):
 
-	srtdb = sqlite3.connect(database_location)		# establish a connection and cursor into the database
-	srtdb.row_factory = sqlite3.Row
-	cur = srtdb.cursor()
+	raise SystemExit(0)
+
+
+# Helper method that releases the controller's resources when it exits.
+#
+# :return:
+def shutdown():
+
+	log.info('shutting down')
+
+	if not SerialPort().close(SHUTDOWN_TIMEOUT):
+
+		log.warning('serial command still in progress, leaving the port open')
+
+
+# Helper method that starts the command channel through which the web app reports submissions and cancellations.
+# Each command wakes the main loop and is acknowledged once a full pass of the loop has seen it.
+#
+# :param executor: the ScanExecutor running scans on the telescope
+# :param horizon: the Horizon of day and night schedules, read by forecasts
+# :return server: the running CommandServer
+def startcommandserver(executor, horizon):
+
+	# Helper function that wakes the main loop and waits until a pass started after the call has completed.
+	def waitforpass():
+
+		with passdone:
+
+			target = passes['started'] + 1
+
+			wakeup.set()
+
+			passdone.wait_for(lambda: passes['completed'] >= target, timeout = ACK_TIMEOUT)
+
+	# Helper function that reports a scan's status and scheduled times.
+	def scanstatus(scanid):
+
+		scan = db.fetchone("SELECT SCANIDS.STATUS, SCHEDULE.STARTTIME, SCHEDULE.ENDTIME FROM SCANIDS LEFT JOIN SCHEDULE ON SCANIDS.ID = SCHEDULE.ID \
+			WHERE SCANIDS.ID = ?", (scanid,))
+
+		if scan == None:
+
+			return {'id': scanid, 'ok': False, 'error': 'unknownscan'}
+
+		return {'id': scanid, 'status': scan['status'], 'starttime': scan['starttime'], 'endtime': scan['endtime']}
+
+	def handlesubmit(message):		# the web app stored a submitted scan
+
+		waitforpass()
+
+		return scanstatus(int(message['id']))
+
+	def handlecancel(message):		# the web app marked a scan cancelled
+
+		scanid = int(message['id'])
+
+		runningid = executor.currentscanid
+
+		running = runningid != None and (scanid == runningid or db.fetchone("SELECT ID FROM SHAREDSCANS WHERE ID = ? AND HOSTID = ?", (scanid, runningid)) != None)
+
+		if running and db.fetchone("SELECT COUNT(*) AS LIVE FROM SCANIDS WHERE STATUS != ? AND (ID = ? OR ID IN (SELECT ID FROM SHAREDSCANS WHERE HOSTID = ?))",
+			('cancelled', runningid, runningid))['live'] == 0:		# a running scan stops at its next frequency step once none of its requesters want it
+
+			executor.stop(runningid, 'cancelled')
+
+		waitforpass()
+
+		reply = scanstatus(scanid)
+		reply['wasrunning'] = running
+
+		return reply
+
+	def handleconfig(message):		# the web app changed the config, which the main loop reloads so it also updates the ephemeris and visibility windows
+
+		waitforpass()
+
+		return {'version': config.getversion()}
+
+	def handlestatus(message):		# the web app asked about a scan, or about the controller
+
+		if 'id' in message:
+
+			return scanstatus(int(message['id']))
+
+		return {'runningid': executor.currentscanid, 'clocksyncage': ntp.getsyncage(), 'clockdrift': ntp.getdrift(), 'errors': len(executor.errors), 'utilization': filler.getstats(),
+			'driverate': SlewModel().getrate()}
+
+	def handleforecast(message):		# the web app asked how much time is left, and optionally where a scan would fit
+
+		scanparams = None
+
+		if 'duration' in message:
+
+			scanparams = {'type': message['type'], 'source': message['source'], 'ras': message['ras'], 'dec': message['dec'], 'duration': message['duration']}
+
+		forecaststart = time.monotonic()
+
+		forecast = horizon.forecast(ntp.getcurrenttime(), scanparams)
+
+		log.debug('computed forecast', extra = {'periods': len(forecast), 'latency': round(time.monotonic() - forecaststart, 4)})
+
+		return {'periods': forecast}
+
+	server = CommandServer({'submit': handlesubmit, 'cancel': handlecancel, 'config': handleconfig, 'status': handlestatus, 'forecast': handleforecast})
+
+	server.start()
+
+	return server
+
+
+# Helper method that schedules a batch of scans and records the results. Scans that cannot be scheduled are added to the history.
+# Survey scans count as free time for user scans, and are dropped as soon as a user scan needs their slot.
+# If the optimizer is on, scans that do not fit first-fit get a second chance from re-packing their schedule. Scans with a
+# priority above that of survey scans that still do not fit bump scans of lower priority, which are then scheduled again in their next
+# feasible window, except survey scans, which are dropped.
+# A scan compatible with one already scheduled shares its observation instead of being scheduled on its own.
+# All SCHEDULE, SCANIDS and SCANHISTORY changes are written together when the caller's transaction commits.
+#
+# :param scans: list of rows holding a scan's name and SCANPARAMS columns
+# :param horizon: the Horizon of day and night schedules
+# :param curtime: the current unix time
+# :param fromstatus: the status the scans are expected to have. a scan whose status changed meanwhile, e.g. to cancelled, keeps its new status
+# :return:
+def schedulescans(scans, horizon, curtime, fromstatus):
+
+	d = datetime.date.today()
+
+	results = []
+
+	failed = []
+
+	shared = 0
+
+	evicted = []
+
+	# Helper function that drops a survey scan bumped to make room for a user scan.
+	def evict(block, schedule):
+
+		filler.evict(block.scanid, block.endtime - block.starttime, schedule)
+
+		evicted.append(block.scanid)
+
+	for scanparams in scans:
+
+		if coalescer.attach(scanparams, horizon, curtime) != None:		# joins the observation of a compatible scheduled scan
+
+			shared += 1
+
+			results.append((scanparams, 'scheduled', fromstatus))
+
+			continue
+
+		status = horizon.schedulescan(scanparams['id'], curtime, scanparams, evict)		# earliest day (sun) or night (others) the scan fits in, survey scans counting as free time
+
+		if status != 'scheduled':
+
+			failed.append(scanparams)
+
+		results.append((scanparams, status, fromstatus))
+
+	placed = set()
+
+	if OPTIMIZER != 'off' and len(failed) > 0:
+
+		placed = horizon.optimize(curtime, failed, OPTIMIZER, OPTIMIZE_LIMIT)
+
+	urgent = sorted([scanparams for scanparams in failed if scanparams['id'] not in placed and scanparams['priority'] > Filler.PRIORITY], key = lambda scanparams: -scanparams['priority'])
+
+	if len(urgent) > 0:
+
+		preemptstart = time.monotonic()
+
+		bumped = []
+
+		for scanparams in urgent:		# highest priority first, so a scan is never bumped by one of lower priority
+
+			blocks = horizon.preempt(scanparams['id'], curtime, scanparams)
+
+			if blocks != None:
+
+				placed.add(scanparams['id'])
+
+				bumped += [(block, horizon.getschedule(scanparams['id'])) for block in blocks]
+
+		delays = []
+
+		for block, schedule in bumped:		# a bumped scan keeps its status if it is scheduled again, wherever that is
+
+			scanparams = coalescer.getobservation(db.fetchone("SELECT SCANIDS.NAME, SCANPARAMS.* FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID WHERE SCANIDS.ID = ?", (block.scanid,)))
+
+			if scanparams['priority'] == Filler.PRIORITY:		# survey scans only use time no one else wants
+
+				evict(block, schedule)
+
+				continue
+
+			status = horizon.schedulescan(block.scanid, curtime, scanparams, evict)
+
+			if status == 'scheduled':
+
+				delays.append(horizon.getblock(block.scanid).starttime - block.starttime)
+
+			else:
+
+				log.warning('bumped scan could not be scheduled again', extra = {'scanid': block.scanid, 'status': status})
+
+				results.append((scanparams, status, 'scheduled'))
+
+		log.info('preempted lower priority scans', extra = {'scans': len(urgent), 'placed': len([scanparams for scanparams in urgent if scanparams['id'] in placed]),
+			'bumped': len(bumped), 'evicted': len([block for block, schedule in bumped if block.scanid in evicted]), 'rescheduled': len(delays), 'delay': round(sum(delays) / len(delays)) if len(delays) > 0 else 0,
+			'latency': round(time.monotonic() - preemptstart, 4)})
+
+	statuses = []
+	history = []
+
+	for scanparams, status, fromstatus in results:
+
+		if scanparams['id'] in placed:
+
+			status = 'scheduled'
+
+		if status != 'scheduled':
+
+			history.append((scanparams['id'], scanparams['name'], scanparams['type'], d.day, d.month, d.year))
+
+			for member in coalescer.detach(scanparams['id']):		# requesters of a host that no longer fits share its fate
+
+				history.append((member['id'], member['name'], member['type'], d.day, d.month, d.year))
+
+				statuses.append((status, member['id'], member['status']))
+
+		statuses.append((status, scanparams['id'], fromstatus))
+
+	if shared > 0:
+
+		log.info('coalesced scans into shared observations', extra = {'scans': shared})
+
+	if len(evicted) > 0:
+
+		log.info('evicted survey scans for user scans', extra = {'scans': len(evicted)})
+
+	db.executemany("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS = ?", statuses)
+	db.executemany("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", history)
+	db.commit()
+
+
+# Helper method that schedules again scans whose blocks were lost, because their time passed before they ran or they could not be restored.
+# Their SCHEDULE rows are deleted, survey scans are dropped for the next fill pass to replace, and the other scans are scheduled in their
+# next feasible window at the length of any observation they host, all in one transaction.
+#
+# :param scans: list of rows holding a scan's name and SCANPARAMS columns
+# :param horizon: the Horizon of day and night schedules
+# :param curtime: the current unix time
+# :return dropped: number of survey scans dropped
+def requeuescans(scans, horizon, curtime):
+
+	with db.transaction() as cur:
+
+		cur.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(scan['id'],) for scan in scans])
+
+		dropped = [scan for scan in scans if scan['priority'] == Filler.PRIORITY]
+
+		for scan in dropped:
+
+			filler.evict(scan['id'], 0, None)
+
+		schedulescans([coalescer.getobservation(scan) for scan in scans if scan['priority'] != Filler.PRIORITY], horizon, curtime, 'scheduled')
+
+	return len(dropped)
+
+
+# Helper method that finds the unix time at which the main loop next has to act without being prompted by the database.
+#
+# :param horizon: the Horizon of day and night schedules
+# :param currentjob: the Future of the running scan, or None
+# :param curtime: the current unix time
+# :param boundaries: list of unix times at which the main loop has other work, e.g. the date changing
+# :return wakeuptime: the unix time of the next scan start or boundary
+def nextwakeup(horizon, currentjob, curtime, boundaries):
+
+	wakeuptime = curtime + 3600		# wake up at least once an hour
+
+	for boundary in boundaries:
+
+		if boundary > curtime and boundary < wakeuptime:
+
+			wakeuptime = boundary
+
+	if currentjob != None:		# nothing can start until the running scan finishes, and the executor wakes us when it does
+
+		return wakeuptime
+
+	block = horizon.nextblock(curtime - START_WINDOW)		# the first block still inside its start window is next
+
+	if block != None:
+
+		return min(wakeuptime, max(block.starttime, curtime))
+
+	return wakeuptime
+
+
+# Helper method that sleeps until a given time, returning early if another connection commits to the database
+# or the wakeup event is set. Checking PRAGMA data_version only reads the database header, so waiting costs no table queries.
+#
+# :param cur: cursor into the database
+# :param dataversion: the data_version seen on the previous pass, or None
+# :param wakeuptime: time.monotonic() value at which to stop waiting
+# :return newversion: the current data_version of the database
+def waitforchange(cur, dataversion, wakeuptime):
+
+	while True:
+
+		newversion = cur.execute("PRAGMA data_version").fetchone()[0]
+
+		if newversion != dataversion:		# another connection committed a change
+
+			return newversion
+
+		remaining = wakeuptime - time.monotonic()
+
+		if remaining <= 0:
+
+			return newversion
+
+		if wakeup.wait(min(remaining, POLL_INTERVAL)):		# sleep, unless woken by another thread
+
+			wakeup.clear()
+
+			return newversion
+
+
+# Helper method that removes cancelled scans from the schedules.
+# The statuses of all scheduled scans are fetched with one query and every removal is written in one transaction.
+# Cancelled requesters leave their shared observation, and the other requesters of a cancelled host are submitted again.
+# The running scan is left alone: it stops by itself once all its requesters cancel it, and is removed when it finishes.
+#
+# :param horizon: the Horizon of day and night schedules
+# :param runningid: the id of the scan the executor is running, or None
+# :return:
+def cancelscans(horizon, runningid):
 
 	today = datetime.date.today()
 
-	for block in schedule.schedule:				# check all blocks for cancellation
+	leaving = db.fetchall("SELECT SCANIDS.ID, SCANIDS.NAME, SCANPARAMS.TYPE FROM SHAREDSCANS JOIN SCANIDS ON SHAREDSCANS.ID = SCANIDS.ID \
+		JOIN SCANPARAMS ON SHAREDSCANS.ID = SCANPARAMS.ID WHERE SCANIDS.STATUS = ?", ('cancelled',))
+
+	if len(leaving) > 0:
+
+		with db.transaction() as cur:
+
+			cur.executemany("DELETE FROM SHAREDSCANS WHERE ID = ?", [(scan['id'],) for scan in leaving])
+			cur.executemany("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", [(scan['id'], scan['name'], scan['type'], today.day, today.month, today.year) for scan in leaving])
+
+	scanids = [scanid for scanid in horizon.scanids() if scanid != runningid]
+
+	cancelled = []
 
-		if block.scanid != None:
+	for i in range(0, len(scanids), MAX_QUERY_PARAMS):		# split very long schedules to stay under sqlite's parameter limit
 
-			status = cur.execute("SELECT * FROM SCANIDS WHERE ID = ?", (block.scanid,)).fetchone()		# fetch scan status from the db
+		chunk = scanids[i:i + MAX_QUERY_PARAMS]
 
-			if status['status'] == 'cancelled':
+		cancelled += db.fetchall("SELECT SCANIDS.ID, SCANIDS.NAME, SCANPARAMS.TYPE FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID \
+			WHERE SCANIDS.STATUS = ? AND SCANIDS.ID IN (" + ','.join('?' * len(chunk)) + ")", ['cancelled'] + chunk)
 
-				print('found a cancelled scan')
+	if len(cancelled) == 0:
 
-				scantype = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (block.scanid,)).fetchone()['type']		# if scan is cancelled, remove from the schedule and add to history
+		return
 
-				cur.execute("DELETE FROM SCHEDULE WHERE ID = ?", (block.scanid,))
-				cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (block.scanid, status['name'], scantype, today.day, today.month, today.year))
-				srtdb.commit()
+	log.info('removing cancelled scans', extra = {'scans': len(cancelled)})
 
-				schedule.deschedulescan(block.scanid)
+	with db.transaction() as cur:		# if scans are cancelled, remove them from the schedule and add them to history
 
-	srtdb.close()
+		cur.executemany("DELETE FROM SCHEDULE WHERE ID = ?", [(scan['id'],) for scan in cancelled])
+		cur.executemany("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", [(scan['id'], scan['name'], scan['type'], today.day, today.month, today.year) for scan in cancelled])
 
+		for scan in cancelled:		# picked up again by this pass's intake
 
-# Helper method that checks a schedule and runs a scan scheduled at the current time
+			members = coalescer.detach(scan['id'])
+
+			cur.executemany("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS IN (?,?)", [('submitted', member['id'], 'scheduled', 'running') for member in members])
+
+	for scan in cancelled:
+
+		horizon.deschedulescan(scan['id'])
+
+
+# Helper method that checks the schedules and hands a scan scheduled at the current time to the executor
 #
-# :param schedule: the schedule to check for scans to run
-# :return currentscanid: the id of the currently running scan
-def runscan(schedule):
+# :param horizon: the Horizon of day and night schedules
+# :param executor: the ScanExecutor that runs scans on the telescope
+# :param curtime: the current unix time
+# :return currentjob: the Future of the scan that was started, or None
+def runscan(horizon, executor, curtime):
 
-	srtdb = sqlite3.connect(database_location)		# establish a connection and cursor into the database
-	srtdb.row_factory = sqlite3.Row
+	srtdb = db.connection()		# get this thread's connection and a cursor into the database
 	cur = srtdb.cursor()
 
-	curtime = ntp.getcurrenttime()
+	block = horizon.nextblock(curtime - START_WINDOW)		# the earliest block that may still be started
+
+	if block != None and curtime >= block.starttime:		# if the start time is now, try to run the scan
 
-	currentscanid = None
+		status = cur.execute("SELECT * FROM STATUS").fetchone()
 
-	for block in schedule.schedule:			# check eachblock for start time
+		scanparams = cur.execute("SELECT SCANIDS.NAME, SCANPARAMS.* FROM SCANIDS JOIN SCANPARAMS ON SCANIDS.ID = SCANPARAMS.ID \
+			WHERE SCANIDS.ID = ?", (block.scanid,)).fetchone()		# get scan params for the db
 
-		if block.scanid != None:
+		if status['code'] == 'timeout':						# if telescope is currently timed out, cancel the scan
 
-			if curtime >= block.starttime - 5 and curtime <= block.starttime + 5:		# if the start time is now, try to run the scan
+			log.warning('cancelling next scan due to timeout', extra = {'scanid': block.scanid})
 
-				status = cur.execute("SELECT * FROM STATUS").fetchone()
+			today = datetime.date.today()
+
+			cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (block.scanid, scanparams['name'], scanparams['type'], today.day, today.month, today.year))
+			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('timeout', block.scanid))
+			cur.execute("DELETE FROM SCHEDULE WHERE ID = ?", (block.scanid,))
+
+			for member in coalescer.detach(block.scanid):		# the requesters of a shared observation time out with it
+
+				cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (member['id'], member['name'], member['type'], today.day, today.month, today.year))
+				cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('timeout', member['id']))
+
+			srtdb.commit()
+
+			horizon.deschedulescan(block.scanid)
+
+			return None
 
-				if status['code'] == 'timeout':						# if telescope is currently timed out, cancel the scan
+		if executor.busy():
 
-					print('cancelling next scan due to timeout')
+			log.error('executor is busy, not starting scan', extra = {'scanid': block.scanid})
 
-					today = datetime.date.today()
+			return None
 
-					scantype = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (block.scanid,)).fetchone()['type']
+		nextscan = coalescer.getobservation(scanparams)		# build dict object of scan params, covering every requester if the scan is shared
 
-					cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (block.scanid, status['name'], scantype, today.day, today.month, today.year))
-					cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('timeout', block.scanid))
-					srtdb.commit()
+		del nextscan['name']
 
-				else:			# if no timeout is in effect, spawn a new thread to run the next scan
+		requesterids = [requester['id'] for requester in nextscan.get('requesters', [nextscan])]
 
-					print('spawning thread to run next scan')
+		cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('running', block.scanid))	# set scan status to running before the worker can write its final status
 
-					cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('running', block.scanid))	# set scan status to running
-					srtdb.commit()
+		for requesterid in requesterids[1:]:		# the requesters sharing the observation run with it
 
-					scanparams = cur.execute("SELECT * FROM SCANPARAMS WHERE ID = ?", (block.scanid,)).fetchone()		# get scan params for the db
-					
-					nextscan = {}
-					
-					for key in scanparams:		# build dict object of scan params
-						
-						nextscan[key.lower()] = scanparams[key]
+			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS = ?", ('running', requesterid, 'scheduled'))
 
-					_thread.start_new_thread(telescope.donextscan, (nextscan,))		# spawn a new thread running the donextscan() method
+		srtdb.commit()
+
+		try:
+
+			currentjob = executor.submit(nextscan)		# hand the scan to the executor's worker thread
+
+		except queue.Full:
+
+			log.error('executor is busy, not starting scan', extra = {'scanid': block.scanid})
+
+			cur.executemany("UPDATE SCANIDS SET STATUS = ? WHERE ID = ? AND STATUS = ?", [('scheduled', requesterid, 'running') for requesterid in requesterids])
+			srtdb.commit()
 
-				currentscanid = block.scanid
+			return None
 
-				break
+		log.info('started scan', extra = {'scanid': block.scanid, 'lateness': round(curtime - block.starttime, 3)})
 
-	srtdb.close()
+		return currentjob
 
-	return currentscanid
+	return None
 	
 
 main()
@@ -0,0 +1,361 @@
+'''
+A sorted index of the scan blocks in a schedule period. Blocks are kept in start time
+order next to a parallel list of start times, so the next block or gap after a given
+time is found by bisection, and a dict from scan id to block lets a scan be found
+without walking the schedule. Inserting or removing a block shifts the two lists, which
+is linear in the number of blocks but cheap for the few hundred a period can hold.
+
+Date: October 2026
+'''
+
+from bisect import bisect_left, bisect_right
+
+class Timeline:
+
+
+	# Initializes an empty Timeline.
+	#
+	# :param starttime: start of the schedule period in unix time
+	# :param endtime: end of the schedule period in unix time
+	def __init__(self, starttime, endtime):
+
+		self.starttime = starttime
+		self.endtime = endtime
+
+		self.blocks = []		# scan Blocks, in start time order
+		self.starts = []		# start time of each Block in self.blocks, for bisection
+
+		self.index = {}			# scan id to Block
+
+
+	# Internal class for storing scan and time info in a Timeline
+	#
+	# :param scanid: the id of the scan in this block
+	# :param starttime: start time of the scan in unix time
+	# :param endtime: end time of the scan in unix time
+	# :param startpos: (azimuth, altitude) the telescope moves to for the scan, or None if unknown
+	# :param endpos: (azimuth, altitude) the telescope is left at after the scan, or None if unknown
+	# :param overrun: seconds the scan may keep the telescope busy after its end time, finishing the spectrum in progress
+	class Block:
+
+		__slots__ = ('scanid', 'starttime', 'endtime', 'startpos', 'endpos', 'overrun')
+
+		def __init__(self, scanid, starttime, endtime, startpos = None, endpos = None, overrun = 0):
+
+			self.scanid = scanid
+			self.starttime = starttime
+			self.endtime = endtime
+			self.startpos = startpos
+			self.endpos = endpos
+			self.overrun = overrun
+
+
+	def __len__(self):
+
+		return len(self.blocks)
+
+
+	def __iter__(self):
+
+		return iter(list(self.blocks))		# a copy, so blocks can be removed while iterating
+
+
+	def __contains__(self, scanid):
+
+		return scanid in self.index
+
+
+	# Method that makes an independent copy of the timeline. Copying the block list is a single step, so a copy
+	# taken on another thread while the timeline changes is still consistent.
+	#
+	# :return timeline: a new Timeline holding the same blocks
+	def copy(self):
+
+		timeline = Timeline(self.starttime, self.endtime)
+
+		timeline.blocks = list(self.blocks)
+		timeline.starts = [block.starttime for block in timeline.blocks]
+		timeline.index = dict((block.scanid, block) for block in timeline.blocks)
+
+		return timeline
+
+
+	# Method that adds a scan to the timeline. Only the scheduled times are checked for overlaps, the overrun
+	# is kept free by findslot() and gaps() when later blocks are placed.
+	#
+	# :param scanid: the id of the scan
+	# :param starttime: start time of the scan in unix time
+	# :param endtime: end time of the scan in unix time
+	# :param startpos: (azimuth, altitude) at the start of the scan, if known
+	# :param endpos: (azimuth, altitude) at the end of the scan, if known
+	# :param overrun: seconds the scan may run past its end time
+	# :return block: the new Block
+	# :raises ValueError: if the scan is already in the timeline or overlaps another block
+	def insert(self, scanid, starttime, endtime, startpos = None, endpos = None, overrun = 0):
+
+		if scanid in self.index:
+
+			raise ValueError('scan ' + str(scanid) + ' is already scheduled')
+
+		i = bisect_right(self.starts, starttime)
+
+		if (i > 0 and self.blocks[i-1].endtime > starttime) or (i < len(self.blocks) and self.blocks[i].starttime < endtime):
+
+			raise ValueError('scan ' + str(scanid) + ' overlaps another block')
+
+		block = Timeline.Block(scanid, starttime, endtime, startpos, endpos, overrun)
+
+		self.blocks.insert(i, block)
+		self.starts.insert(i, starttime)
+		self.index[scanid] = block
+
+		return block
+
+
+	# Method that removes a scan from the timeline.
+	#
+	# :param scanid: the id of the scan
+	# :return block: the removed Block, or None if the scan was not in the timeline
+	def remove(self, scanid):
+
+		block = self.index.pop(scanid, None)
+
+		if block == None:
+
+			return None
+
+		i = bisect_left(self.starts, block.starttime)
+
+		while self.blocks[i] is not block:		# only steps past blocks sharing the start time
+
+			i += 1
+
+		del self.blocks[i]
+		del self.starts[i]
+
+		return block
+
+
+	# Method that returns the block of a scan.
+	#
+	# :param scanid: the id of the scan
+	# :return block: the scan's Block, or None if the scan is not in the timeline
+	def get(self, scanid):
+
+		return self.index.get(scanid)
+
+
+	# Method that returns the ids of every scan in the timeline, in start time order.
+	#
+	# :return scanids: list of scan ids
+	def scanids(self):
+
+		return [block.scanid for block in self.blocks]
+
+
+	# Method that finds the first block starting at or after a time.
+	#
+	# :param t: unix time
+	# :return block: the next Block, or None if no block starts at or after t
+	def nextblock(self, t):
+
+		i = bisect_left(self.starts, t)
+
+		if i < len(self.blocks):
+
+			return self.blocks[i]
+
+		return None
+
+
+	# Method that finds the free time between blocks within a range. The start and end of the schedule
+	# period are treated as blocks, so the padding also applies at the edges of the period. The time
+	# after a block starts once its overrun has passed.
+	#
+	# :param starttime: start of the range in unix time
+	# :param endtime: end of the range in unix time
+	# :param duration: minimum length in seconds of a gap that is returned
+	# :param padding: seconds kept free on either side of every block
+	# :return gaps: list of (start, end) tuples of free time in time order
+	def gaps(self, starttime, endtime, duration = 0, padding = 0):
+
+		gaps = []
+
+		i = bisect_right(self.starts, starttime)		# blocks before i start at or before starttime
+
+		if i > 0:
+
+			previous = max(self.blocks[i-1].endtime + self.blocks[i-1].overrun, self.starttime)		# the block that may reach into the range
+
+		else:
+
+			previous = self.starttime
+
+		while previous + padding < endtime:
+
+			if i < len(self.blocks):
+
+				following = self.blocks[i].starttime
+
+			else:
+
+				following = self.endtime
+
+			gapstart = max(previous + padding, starttime)
+			gapend = min(following - padding, endtime)
+
+			if gapend - gapstart >= duration:
+
+				gaps.append((gapstart, gapend))
+
+			if i >= len(self.blocks):
+
+				break
+
+			previous = self.blocks[i].endtime + self.blocks[i].overrun
+
+			i += 1
+
+		return gaps
+
+
+	# Method that finds the earliest time a block fits in the free time of the timeline and inside one of a set of windows.
+	# Without a path and slew model every block is padded by the same number of seconds. With them, the time kept free
+	# between two blocks is the time needed to slew from where the first leaves the telescope to where the second starts,
+	# and the fixed padding is only used next to the edges of the period and blocks whose positions are unknown.
+	# A block's overrun is kept free after it before any slew or padding, for both the blocks already placed and the new one.
+	#
+	# :param starttime: earliest allowed start in unix time
+	# :param duration: length of the block in seconds
+	# :param windows: list of (start, end) unix times in time order in which the block may be placed, or None for anywhere
+	# :param contained: if True the whole block must lie inside one window (a track), if False only its start must
+	#					(a drift scan, which also stays pointed at its start position)
+	# :param padding: seconds kept free on either side of a block when no slew time can be worked out
+	# :param path: optional function from a unix time to the (azimuth, altitude) of the new block's source
+	# :param slewtime: optional function from two (azimuth, altitude) positions to the seconds needed to move between them
+	# :param overrun: seconds the new block may run past its end time
+	# :return starttime: the earliest start time in unix time, or None if the block does not fit
+	def findslot(self, starttime, duration, windows = None, contained = True, padding = 0, path = None, slewtime = None, overrun = 0):
+
+		if windows == None:
+
+			windows = [(self.starttime, self.endtime)]
+
+		if path == None or slewtime == None:		# fixed padding, so the padded gaps can be used directly
+
+			for gapstart, gapend in self.gaps(starttime, self.endtime, duration + overrun, padding):
+
+				slot = self.fitwindow(gapstart, gapend - overrun, duration, windows, contained)
+
+				if slot != None:
+
+					return slot
+
+			return None
+
+		i = bisect_right(self.starts, starttime)
+
+		previous = self.blocks[i-1] if i > 0 else None		# the last block starting before the range, which the telescope slews from
+
+		while True:
+
+			following = self.blocks[i] if i < len(self.blocks) else None
+
+			gapstart = max(previous.endtime + previous.overrun if previous != None else self.starttime, starttime)
+			gapend = following.starttime if following != None else self.endtime
+
+			if gapend - gapstart >= duration + overrun:
+
+				for windowstart, windowend in windows:
+
+					if windowstart > gapend:
+
+						break
+
+					slot = max(gapstart, windowstart)		# first guess, then moved later by the slew from the previous block
+
+					if previous == None:
+
+						slot = max(slot, self.starttime + padding)
+
+					elif previous.endpos == None:
+
+						slot = max(slot, previous.endtime + previous.overrun + padding)
+
+					else:
+
+						slot = max(slot, previous.endtime + previous.overrun + slewtime(previous.endpos, path(slot)))
+
+					if following != None and following.startpos != None:
+
+						trailing = slewtime(path(slot + duration) if contained else path(slot), following.startpos)
+
+					else:
+
+						trailing = padding
+
+					if slot + duration + overrun + trailing > gapend or slot > windowend:
+
+						continue
+
+					if contained and slot + duration > windowend:
+
+						continue
+
+					return slot
+
+			if following == None:
+
+				return None
+
+			previous = following
+
+			i += 1
+
+
+	# Helper method that finds the earliest start inside one of a set of windows within a gap.
+	#
+	# :param gapstart: start of the free time in unix time
+	# :param gapend: end of the free time in unix time
+	# :param duration: length of the block in seconds
+	# :param windows: list of (start, end) unix times in time order
+	# :param contained: if True the whole block must lie inside one window, if False only its start must
+	# :return starttime: the earliest start time in unix time, or None if the block does not fit
+	def fitwindow(self, gapstart, gapend, duration, windows, contained):
+
+		for windowstart, windowend in windows:
+
+			if windowstart > gapend:		# windows are in time order, so no later window overlaps this gap
+
+				break
+
+			slot = max(gapstart, windowstart)
+
+			if slot + duration > gapend or slot > windowend:
+
+				continue
+
+			if contained and slot + duration > windowend:
+
+				continue
+
+			return slot
+
+		return None
+
+
+	# Method that adds up the slew time between consecutive blocks whose positions are known.
+	#
+	# :param slewtime: function from two (azimuth, altitude) positions to the seconds needed to move between them
+	# :return seconds: total slew time in seconds
+	def gettotalslew(self, slewtime):
+
+		seconds = 0
+
+		for i in range(1, len(self.blocks)):
+
+			if self.blocks[i-1].endpos != None and self.blocks[i].startpos != None:
+
+				seconds += slewtime(self.blocks[i-1].endpos, self.blocks[i].startpos)
+
+		return seconds
@@ -0,0 +1,270 @@
+'''
+A class that finds when a source can be observed during a schedule period. For each source
+and period it computes the windows during which the source is above the horizon and the
+windows during which it is also inside the telescope's movement bounds. The sky is sampled
+coarsely with one batched transform and each change is then narrowed down by bisection.
+The coarse samples are kept as the source's path across the sky, from which its position at
+any time in the period is interpolated for slew times. Windows and paths are kept in memory
+and in the VISIBILITY table, keyed by source, period and config version, so a source that is
+requested again is a lookup.
+
+Date: October 2026
+'''
+
+from astropy.coordinates import SkyCoord, AltAz
+from astropy.time import Time
+from astropy import units as u
+from srtutility.SRTDatabase import SRTDatabase
+from srtutility import SRTLogging
+from Config import Config
+import threading
+import numpy
+import json
+import time
+
+log = SRTLogging.getlogger('Visibility')
+
+class Visibility:
+
+	COARSE_STEP = 300		# seconds between the first samples of a period
+	TOLERANCE = 1			# seconds to which the edges of a window are found
+
+	BELOW = 0				# states of a source at a sample time
+	SKY = 1
+	BOUNDS = 2
+
+	_lock = threading.Lock()		# windows shared by every Visibility object
+	_cache = {}						# (ras, dec, starttime, endtime, version) to (skywindows, boundswindows, path)
+
+
+	# Initializes a Visibility object. Objects are cheap, the cache is shared between them.
+	def __init__(self):
+
+		self.db = SRTDatabase()
+
+		self.config = Config()
+
+
+	# Method that returns the windows of a source during a schedule period, computing and storing them if needed.
+	#
+	# :param ras: right ascension of the source
+	# :param dec: declination of the source
+	# :param starttime: start of the period in unix time
+	# :param endtime: end of the period in unix time
+	# :return windows: tuple of two lists of (start, end) unix times in time order, the first of times the source
+	#				   is in the sky and the second of times it is also inside the movement bounds
+	def getwindows(self, ras, dec, starttime, endtime):
+
+		return self.getentry(ras, dec, starttime, endtime)[:2]
+
+
+	# Method that returns a source's position at any time during a schedule period.
+	#
+	# :param ras: right ascension of the source
+	# :param dec: declination of the source
+	# :param starttime: start of the period in unix time
+	# :param endtime: end of the period in unix time
+	# :return path: function from a unix time to the source's (azimuth, altitude) in degrees, or None if the position is unreadable
+	def getpath(self, ras, dec, starttime, endtime):
+
+		times, az, alt = self.getentry(ras, dec, starttime, endtime)[2]
+
+		if len(times) == 0:
+
+			return None
+
+		return lambda t: (float(numpy.interp(t, times, az)) % 360, float(numpy.interp(t, times, alt)))		# azimuth was unwrapped, so it interpolates across north
+
+
+	# Helper method that looks up the windows and path of a source, computing and storing them if needed.
+	#
+	# :param ras: right ascension of the source
+	# :param dec: declination of the source
+	# :param starttime: start of the period in unix time
+	# :param endtime: end of the period in unix time
+	# :return entry: tuple of sky windows, bounds windows and path, the path being lists of times, azimuths and altitudes
+	def getentry(self, ras, dec, starttime, endtime):
+
+		version = self.config.getversion()
+
+		key = (ras, dec, starttime, endtime, version)
+
+		entry = Visibility._cache.get(key)
+
+		if entry != None:
+
+			return entry
+
+		row = self.db.fetchone("SELECT SKY, BOUNDS, PATH FROM VISIBILITY WHERE RAS = ? AND DEC = ? AND STARTTIME = ? AND ENDTIME = ? AND VERSION = ?", key)
+
+		if row != None and row['path'] != None:
+
+			entry = (json.loads(row['sky']), json.loads(row['bounds']), json.loads(row['path']))
+
+		else:
+
+			computestart = time.monotonic()
+
+			entry = self.computewindows(ras, dec, starttime, endtime)
+
+			log.debug('computed visibility', extra = {'ras': ras, 'dec': dec, 'windows': len(entry[1]), 'latency': round(time.monotonic() - computestart, 4)})
+
+			self.db.execute("INSERT OR REPLACE INTO VISIBILITY (RAS, DEC, STARTTIME, ENDTIME, VERSION, SKY, BOUNDS, PATH) VALUES (?,?,?,?,?,?,?,?)",
+				key + (json.dumps(entry[0]), json.dumps(entry[1]), json.dumps(entry[2])))
+			self.db.commit()
+
+		with Visibility._lock:
+
+			Visibility._cache[key] = entry
+
+		return entry
+
+
+	# Method that drops windows for periods that have ended or for an old config.
+	#
+	# :param curtime: the current unix time
+	# :return:
+	def prune(self, curtime):
+
+		version = self.config.getversion()
+
+		with self.db.transaction() as cur:
+
+			cur.execute("DELETE FROM VISIBILITY WHERE ENDTIME < ? OR VERSION != ?", (curtime, version))
+
+		with Visibility._lock:
+
+			for key in list(Visibility._cache):
+
+				if key[3] < curtime or key[4] != version:
+
+					del Visibility._cache[key]
+
+
+	# Helper method that computes the windows of a source during a schedule period.
+	# The period is sampled every COARSE_STEP seconds, then every pair of neighbouring samples
+	# in different states is bisected until it is TOLERANCE seconds wide. Each round of sampling
+	# is one batched transform. Window edges are placed on the inside of each change.
+	#
+	# :param ras: right ascension of the source
+	# :param dec: declination of the source
+	# :param starttime: start of the period in unix time
+	# :param endtime: end of the period in unix time
+	# :return entry: tuple of sky windows, bounds windows and path, as returned by getentry()
+	def computewindows(self, ras, dec, starttime, endtime):
+
+		try:
+
+			position = SkyCoord(ras, dec, frame = 'icrs')
+
+		except ValueError as e:		# an unreadable position is never in the sky
+
+			return ([], [], [[], [], []])
+
+		times = [float(t) for t in numpy.arange(starttime, endtime, Visibility.COARSE_STEP)] + [endtime]
+
+		altaz = self.getaltaz(position, times)
+
+		if altaz == None:		# if the position can't be transformed, it is not in the sky
+
+			return ([], [], [[], [], []])
+
+		path = [times, numpy.degrees(numpy.unwrap(numpy.radians(altaz[1]))).tolist(), altaz[0].tolist()]
+
+		states = self.getstates(*altaz)
+
+		points = list(zip(times, states))		# (time, state) pairs, later joined by the bisection points
+
+		changes = [(points[i], points[i+1]) for i in range(len(points) - 1) if points[i][1] != points[i+1][1]]
+
+		while len(changes) > 0:		# narrow every change down at once
+
+			middles = [(low[0] + high[0]) / 2 for low, high in changes]
+
+			middlealtaz = self.getaltaz(position, middles)
+
+			middlestates = self.getstates(*middlealtaz) if middlealtaz != None else [Visibility.BELOW] * len(middles)
+
+			narrowed = []
+
+			for (low, high), middle in zip(changes, zip(middles, middlestates)):
+
+				points.append(middle)
+
+				for part in ((low, middle), (middle, high)):
+
+					if part[0][1] != part[1][1] and part[1][0] - part[0][0] > Visibility.TOLERANCE:
+
+						narrowed.append(part)
+
+			changes = narrowed
+
+		points.sort()
+
+		return (self.getintervals(points, Visibility.SKY), self.getintervals(points, Visibility.BOUNDS), path)
+
+
+	# Helper method that finds the altitude and azimuth of a source at many times with one transform.
+	#
+	# :param position: SkyCoord of the source
+	# :param times: list of unix times
+	# :return altaz: tuple of arrays of altitudes and azimuths in degrees, or None if the position can't be transformed
+	def getaltaz(self, position, times):
+
+		frame = AltAz(location = self.config.getlocation(), obstime = Time(times, format = 'unix'))
+
+		try:
+
+			altaz = position.transform_to(frame)
+
+		except ValueError as e:
+
+			return None
+
+		return (altaz.alt.deg, altaz.az.deg)
+
+
+	# Helper method that finds the state of a source from its altitudes and azimuths.
+	#
+	# :param alt: array of altitudes in degrees
+	# :param az: array of azimuths in degrees
+	# :return states: list of BELOW, SKY or BOUNDS for each sample
+	def getstates(self, alt, az):
+
+		azbounds = self.config.getazbounds()
+		albounds = self.config.getalbounds()
+
+		insky = (alt >= 0) & (alt <= 180)
+		inbounds = insky & (az >= azbounds[0]) & (az <= azbounds[1]) & (alt >= albounds[0]) & (alt <= albounds[1])
+
+		return numpy.where(inbounds, Visibility.BOUNDS, numpy.where(insky, Visibility.SKY, Visibility.BELOW)).tolist()
+
+
+	# Helper method that turns sampled states into the windows where a source is at least in a given state.
+	#
+	# :param points: list of (time, state) tuples in time order
+	# :param state: SKY or BOUNDS
+	# :return windows: list of [start, end] unix times
+	def getintervals(self, points, state):
+
+		windows = []
+
+		start = None
+
+		for i in range(len(points)):
+
+			if points[i][1] >= state:
+
+				if start == None:
+
+					start = points[i][0]
+
+				if i == len(points) - 1 or points[i+1][1] < state:		# last sample before the source leaves the state
+
+					if points[i][0] > start:
+
+						windows.append([start, points[i][0]])
+
+					start = None
+
+		return windows
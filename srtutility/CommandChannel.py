@@ -0,0 +1,146 @@
+'''
+A local command channel between the web app and the telescope controller.
+The controller runs a CommandServer on a Unix domain socket and the web app sends
+it commands with a CommandClient. Each command is one line of json and gets one
+line of json back as a synchronous acknowledgement. SQLite stays the durable
+record: the web app writes to the database first and then notifies the controller,
+so a controller that is down or slow only delays the reaction.
+
+Date: October 2026
+'''
+
+import socketserver
+import threading
+import socket
+import json
+import os
+
+SOCKET_LOCATION = '../srtdatabase/srtcontroller.sock'
+
+
+class CommandServer:
+
+
+	# Initializes a CommandServer. The server does not listen until start() is called.
+	#
+	# :param handlers: dict mapping command names to functions that take the message dict and return a reply dict
+	# :param socket_location: path of the Unix domain socket
+	def __init__(self, handlers, socket_location = SOCKET_LOCATION):
+
+		self.handlers = handlers
+
+		self.socket_location = socket_location
+
+		self.server = None
+
+
+	# Internal class that handles one client connection, answering each line it receives.
+	class Handler(socketserver.StreamRequestHandler):
+
+		def handle(self):
+
+			for line in self.rfile:
+
+				try:
+
+					message = json.loads(line.decode('utf-8'))
+
+					handler = self.server.handlers.get(message.get('command'))
+
+					if handler == None:
+
+						reply = {'ok': False, 'error': 'unknowncommand'}
+
+					else:
+
+						reply = handler(message)
+
+						reply['ok'] = reply.get('ok', True)
+
+				except Exception as e:		# a bad message must not take down the channel
+
+					reply = {'ok': False, 'error': repr(e)}
+
+				self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+	# Method that starts listening on the socket in a background thread.
+	def start(self):
+
+		if os.path.exists(self.socket_location):		# remove a socket left behind by a previous run
+
+			os.remove(self.socket_location)
+
+		self.server = socketserver.ThreadingUnixStreamServer(self.socket_location, CommandServer.Handler)
+		self.server.daemon_threads = True
+		self.server.handlers = self.handlers
+
+		os.chmod(self.socket_location, 0o660)		# only the telescope's user and group may send commands
+
+		thread = threading.Thread(target = self.server.serve_forever, name = 'commandserver', daemon = True)
+		thread.start()
+
+
+	# Method that stops the server and removes the socket.
+	def stop(self):
+
+		if self.server != None:
+
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+		if os.path.exists(self.socket_location):
+
+			os.remove(self.socket_location)
+
+
+class CommandClient:
+
+
+	# Initializes a CommandClient.
+	#
+	# :param socket_location: path of the controller's Unix domain socket
+	# :param timeout: seconds to wait for the controller to acknowledge a command
+	def __init__(self, socket_location = SOCKET_LOCATION, timeout = 2.0):
+
+		self.socket_location = socket_location
+
+		self.timeout = timeout
+
+
+	# Method that sends one command to the controller and waits for its acknowledgement.
+	#
+	# :param command: the name of the command, e.g. 'submit', 'cancel' or 'status'
+	# :param args: keyword arguments sent along with the command
+	# :return reply: the controller's reply as a dict, or None if the controller could not be reached
+	def send(self, command, **args):
+
+		message = dict(args)
+		message['command'] = command
+
+		try:
+
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+
+				sock.settimeout(self.timeout)
+				sock.connect(self.socket_location)
+				sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+				response = b''
+
+				while not response.endswith(b'\n'):		# read until the end of the reply line
+
+					chunk = sock.recv(4096)
+
+					if len(chunk) == 0:
+
+						return None
+
+					response += chunk
+
+		except OSError as e:		# controller is not running, or did not answer in time
+
+			return None
+
+		return json.loads(response.decode('utf-8'))
@@ -0,0 +1,31 @@
+'''
+Functions that convert scan durations between the 'XhYmZs' strings stored in the
+database and seconds. Every part of the controller and the website reads and writes
+durations through these, so they are parsed and spelled the same way everywhere.
+
+Date: October 2026
+'''
+
+import re
+
+
+# Function that converts a duration string to seconds.
+#
+# :param duration: a duration such as '1h30m0s'
+# :return seconds: the duration in seconds
+def toseconds(duration):
+
+	parts = re.split('[hms]', duration)
+
+	return int(parts[0]) * 60 * 60 + int(parts[1]) * 60 + int(parts[2])
+
+
+# Function that converts seconds to a duration string, with minutes and seconds below 60.
+#
+# :param seconds: the duration in seconds
+# :return duration: a duration such as '1h30m0s'
+def fromseconds(seconds):
+
+	seconds = int(seconds)
+
+	return '%dh%dm%ds' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
@@ -1,54 +1,151 @@
 '''
 A helper class for retreiving time data from ntp servers.
 
+Time is kept by a clock service shared by every NTPTime object. A background
+thread syncs with the ntp servers periodically, and getcurrenttime() returns
+time.monotonic() corrected by the last measured offset and drift, so reading
+the time never waits on the network.
+
 Author: Nathan Rowley
 Date: August 2018
 '''
 
 import ntplib
 from ntplib import NTPException
-import datetime
-import pytz
+import threading
+import time
 
 class NTPTime:
-	
+
+	SYNC_INTERVAL = 300		# seconds between ntp syncs
+	RETRY_INTERVAL = 30		# seconds before retrying a failed sync
+	REQUEST_TIMEOUT = 2		# seconds to wait for an ntp server to reply
+	DRIFT_SAMPLES = 8		# number of recent syncs used to estimate drift
+
+	_lock = threading.Lock()		# clock state shared by every NTPTime object
+	_thread = None
+	_state = (time.time() - time.monotonic(), time.monotonic(), 0.0)		# (offset, monotonic time of last sync, drift), seeded from the system clock
+	_lastsync = None
+	_samples = []
+
 	# Initializes a new object with default and backup servers.
 	# Change these to servers that are nearby for best performance.
 	def __init__(self):
-		
+
 		self.NTP_SERVER = 'ntp.carleton.edu'
 		self.BACKUP_SERVER = '0.us.pool.ntp.org'
 		self.client = ntplib.NTPClient()
 
+		with NTPTime._lock:
+
+			if NTPTime._thread == None:		# start the shared sync thread the first time an object is created
+
+				NTPTime._thread = threading.Thread(target = self.syncloop, name = 'ntpsync', daemon = True)
+				NTPTime._thread.start()
 
+
+	# Method that returns the current unix time in seconds.
+	#
+	# :return unixtime: offset-corrected unix time as a float
 	def getcurrenttime(self):
-		
-		received = False
-		
-		try:
-			
-			ntptime = self.client.request(self.NTP_SERVER, version = 4)	# get current time from the default server
-			unixtime = ntptime.tx_time									# get unix time from ntp packet
-			received = True
-			
-		except NTPException as e:
-			
-			received = False
-			
-		if not received:
-			
+
+		return self.getcurrenttimeus() / 1e6
+
+
+	# Method that returns the current unix time in microseconds.
+	#
+	# :return unixtime: offset-corrected unix time as an integer number of microseconds
+	def getcurrenttimeus(self):
+
+		offset, syncmono, drift = NTPTime._state		# one read of the state tuple, so no lock is needed
+
+		now = time.monotonic()
+
+		return int((now + offset + drift * (now - syncmono)) * 1e6)
+
+
+	# Method that returns the time since the last successful ntp sync.
+	#
+	# :return age: seconds since the last sync, or None if the clock has never synced
+	def getsyncage(self):
+
+		lastsync = NTPTime._lastsync
+
+		if lastsync == None:
+
+			return None
+
+		return time.monotonic() - lastsync
+
+
+	# Method that returns the estimated drift of the local monotonic clock against ntp time.
+	#
+	# :return drift: drift in parts per million, positive when the local clock runs slow
+	def getdrift(self):
+
+		return NTPTime._state[2] * 1e6
+
+
+	# Method that queries the ntp servers once and updates the shared clock state.
+	#
+	# :return received: boolean indicating whether a server replied
+	def sync(self):
+
+		for server in (self.NTP_SERVER, self.BACKUP_SERVER):		# try the default server, then the backup server
+
 			try:
-			
-				ntptime = c.request(self.BACKUP_SERVER, version = 4)	# get current time from the backup server
-				unixtime = ntptime.tx_time								# get unix time from ntp packet
-				received = True
-			
-			except NTPException as e:
-			
-				received = False
-			
-		if not received:
-			
-			unixtime = datetime.now(tz=pytz.utc).timestamp()	# get timestamp by converting from utc
-
-		return unixtime
+
+				ntptime = self.client.request(server, version = 4, timeout = NTPTime.REQUEST_TIMEOUT)
+
+			except (NTPException, OSError) as e:
+
+				continue
+
+			received = time.monotonic()
+
+			offset = ntptime.dest_time + ntptime.offset - received		# true time at reception minus monotonic time at reception
+
+			with NTPTime._lock:
+
+				NTPTime._samples.append((received, offset))
+				del NTPTime._samples[:-NTPTime.DRIFT_SAMPLES]
+
+				NTPTime._state = (offset, received, self.estimatedrift(NTPTime._samples))
+				NTPTime._lastsync = received
+
+			return True
+
+		return False
+
+
+	# Helper method that fits a line through recent (monotonic time, offset) samples.
+	#
+	# :param samples: list of (monotonic time, offset) tuples
+	# :return drift: slope of offset against monotonic time, in seconds per second
+	def estimatedrift(self, samples):
+
+		if len(samples) < 2 or samples[-1][0] - samples[0][0] < NTPTime.SYNC_INTERVAL:		# too short a baseline to tell drift from jitter
+
+			return NTPTime._state[2]
+
+		meant = sum(s[0] for s in samples) / len(samples)
+		meanoffset = sum(s[1] for s in samples) / len(samples)
+
+		numerator = sum((s[0] - meant) * (s[1] - meanoffset) for s in samples)
+		denominator = sum((s[0] - meant) ** 2 for s in samples)
+
+		return numerator / denominator
+
+
+	# Method run by the shared sync thread, syncing forever at SYNC_INTERVAL.
+	def syncloop(self):
+
+		while True:
+
+			if self.sync():
+
+				time.sleep(NTPTime.SYNC_INTERVAL)
+
+			else:
+
+				time.sleep(NTPTime.RETRY_INTERVAL)
@@ -0,0 +1,167 @@
+'''
+A helper class for accessing the SRT database through long-lived connections.
+Each thread gets one connection that is opened on first use and kept open, so
+callers no longer pay for connection setup and schema parsing on every query,
+and sqlite3's per-connection statement cache keeps queries prepared between calls.
+
+Date: October 2026
+'''
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class SRTDatabase:
+
+	_local = threading.local()		# per-thread connections, shared by every SRTDatabase object
+
+	# Pragmas applied to every new connection. WAL lets the web app read while the controller writes,
+	# and NORMAL synchronous is safe under WAL while sparing the SD card a sync on every commit.
+	PRAGMAS = ('PRAGMA journal_mode = WAL',
+				'PRAGMA synchronous = NORMAL',
+				'PRAGMA busy_timeout = 5000',
+				'PRAGMA temp_store = MEMORY')
+
+	STATEMENT_CACHE = 128		# number of prepared statements each connection keeps
+
+
+	# Initializes an SRTDatabase object. Objects are cheap, all state lives in the per-thread connections.
+	#
+	# :param database_location: path to the database file
+	def __init__(self, database_location = '../srtdatabase/srtdata.db'):
+
+		self.database_location = database_location
+
+
+	# Method that returns the calling thread's connection, opening it if necessary.
+	#
+	# :return srtdb: an open sqlite3 connection with rows returned as sqlite3.Row objects
+	def connection(self):
+
+		connections = getattr(SRTDatabase._local, 'connections', None)
+
+		if connections == None:
+
+			connections = {}
+			SRTDatabase._local.connections = connections
+			SRTDatabase._local.depth = {}
+
+		srtdb = connections.get(self.database_location)
+
+		if srtdb == None:
+
+			srtdb = sqlite3.connect(self.database_location, cached_statements = SRTDatabase.STATEMENT_CACHE)
+			srtdb.row_factory = sqlite3.Row
+
+			for pragma in SRTDatabase.PRAGMAS:
+
+				srtdb.execute(pragma)
+
+			connections[self.database_location] = srtdb
+			SRTDatabase._local.depth[self.database_location] = 0
+
+		return srtdb
+
+
+	# Method that returns a new cursor on the calling thread's connection.
+	#
+	# :return cur: an sqlite3 cursor
+	def cursor(self):
+
+		return self.connection().cursor()
+
+
+	# Method that runs a query and returns its first row.
+	#
+	# :param query: the sql query to run
+	# :param params: tuple of query parameters
+	# :return row: the first result row, or None
+	def fetchone(self, query, params = ()):
+
+		return self.connection().execute(query, params).fetchone()
+
+
+	# Method that runs a query and returns all of its rows.
+	#
+	# :param query: the sql query to run
+	# :param params: tuple of query parameters
+	# :return rows: list of result rows
+	def fetchall(self, query, params = ()):
+
+		return self.connection().execute(query, params).fetchall()
+
+
+	# Method that runs a statement without committing it.
+	#
+	# :param query: the sql statement to run
+	# :param params: tuple of statement parameters
+	# :return cur: the cursor used to run the statement
+	def execute(self, query, params = ()):
+
+		return self.connection().execute(query, params)
+
+
+	# Method that runs a statement once for each set of parameters without committing.
+	#
+	# :param query: the sql statement to run
+	# :param paramlist: iterable of parameter tuples
+	# :return cur: the cursor used to run the statement
+	def executemany(self, query, paramlist):
+
+		return self.connection().executemany(query, paramlist)
+
+
+	# Method that commits the calling thread's connection, unless a transaction() block is open.
+	def commit(self):
+
+		srtdb = self.connection()
+
+		if SRTDatabase._local.depth[self.database_location] == 0:
+
+			srtdb.commit()
+
+
+	# Context manager that groups every statement run inside it into a single transaction.
+	# Nested transaction() blocks join the outermost one, which commits on exit or rolls back on error.
+	#
+	# :return cur: a cursor on the calling thread's connection
+	@contextmanager
+	def transaction(self):
+
+		srtdb = self.connection()
+
+		depth = SRTDatabase._local.depth
+
+		depth[self.database_location] += 1
+
+		try:
+
+			yield srtdb.cursor()
+
+		except:
+
+			depth[self.database_location] -= 1
+
+			if depth[self.database_location] == 0:
+
+				srtdb.rollback()
+
+			raise
+
+		depth[self.database_location] -= 1
+
+		if depth[self.database_location] == 0:
+
+			srtdb.commit()
+
+
+	# Method that closes the calling thread's connection. A later call reopens it.
+	def close(self):
+
+		connections = getattr(SRTDatabase._local, 'connections', {})
+
+		srtdb = connections.pop(self.database_location, None)
+
+		if srtdb != None:
+
+			srtdb.close()
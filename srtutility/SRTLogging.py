@@ -0,0 +1,113 @@
+'''
+Logging for the telescope controller. Records are handed to a queue and written by a
+background thread, so a log call never waits on the journal or the SD card. Levels can
+be set per module, and fields passed with extra={...} (scan id, slot time, latency, etc.)
+are written as key=value pairs after the message so the log can be searched and parsed.
+
+Levels are read from the SRT_LOG_LEVELS environment variable, e.g.
+SRT_LOG_LEVELS="INFO,Schedule=DEBUG,CommandStation=WARNING", where the first
+entry without a module name sets the default level.
+
+Date: October 2026
+'''
+
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import queue
+import sys
+import os
+
+ROOT_LOGGER = 'srt'
+
+_listener = None
+
+_standard = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}		# attributes every record has
+
+
+# Internal class that appends a record's structured fields to its message, ahead of any traceback.
+class StructuredFormatter(logging.Formatter):
+
+	def formatMessage(self, record):
+
+		line = logging.Formatter.formatMessage(self, record)
+
+		fields = []
+
+		for key, value in record.__dict__.items():		# anything beyond the standard attributes came from extra={...}
+
+			if key not in _standard:
+
+				fields.append(key + '=' + str(value))
+
+		if len(fields) > 0:
+
+			line += ' ' + ' '.join(sorted(fields))
+
+		return line
+
+
+# Function that returns the logger for a controller module.
+#
+# :param name: the module name, e.g. 'Schedule'
+# :return logger: a logging.Logger under the srt root logger
+def getlogger(name):
+
+	return logging.getLogger(ROOT_LOGGER + '.' + name)
+
+
+# Function that sets up queued logging for the controller. Safe to call more than once.
+#
+# :param levels: string of levels in the SRT_LOG_LEVELS format, read from the environment if not given
+# :param stream: where the background thread writes records, stderr by default so systemd captures them
+# :return:
+def setup(levels = None, stream = None):
+
+	global _listener
+
+	if levels == None:
+
+		levels = os.environ.get('SRT_LOG_LEVELS', 'INFO')
+
+	root = logging.getLogger(ROOT_LOGGER)
+
+	for entry in levels.split(','):		# apply the default level and any per-module levels
+
+		entry = entry.strip()
+
+		if '=' in entry:
+
+			module, level = entry.split('=', 1)
+			getlogger(module.strip()).setLevel(level.strip().upper())
+
+		elif entry != '':
+
+			root.setLevel(entry.upper())
+
+	if _listener != None:
+
+		return
+
+	records = queue.Queue(-1)
+
+	handler = logging.StreamHandler(stream if stream != None else sys.stderr)		# runs on the listener thread
+	handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+	_listener = QueueListener(records, handler, respect_handler_level = True)
+	_listener.start()
+
+	queuehandler = QueueHandler(records)		# runs in the logging thread, only merges the message with its fields before queueing
+	queuehandler.setFormatter(StructuredFormatter())
+
+	root.addHandler(queuehandler)
+	root.propagate = False
+
+
+# Function that flushes queued records and stops the background thread.
+def shutdown():
+
+	global _listener
+
+	if _listener != None:
+
+		_listener.stop()
+		_listener = None
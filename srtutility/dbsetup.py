@@ -2,6 +2,8 @@
 This module initializes the database for the website and telescope controller.
 If the database does not already exist, the module initializes it along with
 the proper tables and populates the CONFIG and STATUS tables.
+On an existing database it adds any indexes and tables introduced since
+the database was created, so it is safe to run again after an update.
 
 Author: Nathan Rowley
 Date: September 2018
@@ -29,7 +31,8 @@ if not isfile('../srtdatabase/srtdata.db'):				# check if database exists
 		ALLOWER		REAL	NOT NULL,
 		ALUPPER		REAL	NOT NULL,
 		FREQLOWER	REAL	NOT NULL,
-		FREQUPPER	REAL	NOT NULL);''')
+		FREQUPPER	REAL	NOT NULL,
+		VERSION		INT		NOT NULL DEFAULT 0);''')
 
 	### SCANIDS table contains list of scan ids, names and statuses ###
 	srt.execute('''CREATE TABLE SCANIDS(
@@ -47,12 +50,14 @@ if not isfile('../srtdatabase/srtdata.db'):				# check if database exists
 		DURATION	TEXT	NOT NULL,
 		FREQLOWER	REAL	NOT NULL,
 		FREQUPPER	REAL	NOT NULL,
-		STEPNUM		INT 	NOT NULL);''')
+		STEPNUM		INT 	NOT NULL,
+		PRIORITY	INT		NOT NULL DEFAULT 0);''')
 
 	### SCANRESULTS table contains data from completed scans ###
 	srt.execute('''CREATE TABLE SCANRESULTS(
-		ID 		INT 	NOT NULL,
-		DATA 	BLOB	NOT NULL);''')
+		ID 			INT 	NOT NULL,
+		DATA 		BLOB	NOT NULL,
+		COMPLETED	REAL);''')
 
 	### SCANHISTORY table contains date information of scan success or failure ###
 	srt.execute('''CREATE TABLE SCANHISTORY(
@@ -67,7 +72,10 @@ if not isfile('../srtdatabase/srtdata.db'):				# check if database exists
 	srt.execute('''CREATE TABLE SCHEDULE(
 		ID 			INT		NOT NULL,
 		STARTTIME	TEXT	NOT NULL,
-		ENDTIME		TEXT	NOT NULL);''')
+		ENDTIME		TEXT	NOT NULL,
+		STARTUNIX	REAL,
+		ENDUNIX		REAL,
+		VERSION		INT);''')
 
 	### SOURCES table contains list of source names and positions ###
 	srt.execute('''CREATE TABLE SOURCES(
@@ -89,3 +97,114 @@ if not isfile('../srtdatabase/srtdata.db'):				# check if database exists
 	srt.commit()
 
 	srt.close()
+
+
+### indexes and upgrades, safe to run again on an existing database ###
+
+srt = sqlite3.connect('../srtdatabase/srtdata.db')
+
+srt.execute("CREATE INDEX IF NOT EXISTS SCANIDS_STATUS ON SCANIDS(STATUS)")			# lookups of submitted and cancelled scans
+srt.execute("CREATE INDEX IF NOT EXISTS SCANPARAMS_ID ON SCANPARAMS(ID)")			# joins from SCANIDS and SCHEDULE
+srt.execute("CREATE INDEX IF NOT EXISTS SCHEDULE_ID ON SCHEDULE(ID)")
+
+### EPHEMERIS table contains precomputed day and night times for the site, in unix time ###
+srt.execute('''CREATE TABLE IF NOT EXISTS EPHEMERIS(
+	DAY TEXT PRIMARY KEY	NOT NULL,
+	LAT				REAL	NOT NULL,
+	LON				REAL	NOT NULL,
+	SUNRISE			REAL,
+	SUNSET			REAL,
+	DUSK			REAL,
+	DAWN			REAL);''')
+
+### VISIBILITY table caches the windows in which a source can be observed during a schedule period, as json lists of [start, end] unix times, ###
+### and the source's path across the sky as json lists of sample times, azimuths and altitudes ###
+srt.execute('''CREATE TABLE IF NOT EXISTS VISIBILITY(
+	RAS				TEXT	NOT NULL,
+	DEC				TEXT	NOT NULL,
+	STARTTIME		REAL	NOT NULL,
+	ENDTIME			REAL	NOT NULL,
+	VERSION			INT		NOT NULL,
+	SKY				TEXT	NOT NULL,
+	BOUNDS			TEXT	NOT NULL,
+	PATH			TEXT,
+	PRIMARY KEY(RAS, DEC, STARTTIME, ENDTIME, VERSION));''')
+
+visibilitycolumns = [column[1].upper() for column in srt.execute("PRAGMA table_info(VISIBILITY)").fetchall()]
+
+if 'PATH' not in visibilitycolumns:		# rows cached without a path are recomputed when next used
+
+	srt.execute("ALTER TABLE VISIBILITY ADD COLUMN PATH TEXT")
+
+### SCHEDULE keeps each block's exact unix times and the config version it was checked against, so a restart can restore it as it was ###
+schedulecolumns = [column[1].upper() for column in srt.execute("PRAGMA table_info(SCHEDULE)").fetchall()]
+
+for column, columntype in (('STARTUNIX', 'REAL'), ('ENDUNIX', 'REAL'), ('VERSION', 'INT')):
+
+	if column not in schedulecolumns:		# rows written before the upgrade have no times and are rescheduled on restart
+
+		srt.execute("ALTER TABLE SCHEDULE ADD COLUMN " + column + " " + columntype)
+
+### SCANPARAMS.PRIORITY lets a scan bump scans of lower priority out of its way. existing scans get the normal priority of 0 ###
+scanparamscolumns = [column[1].upper() for column in srt.execute("PRAGMA table_info(SCANPARAMS)").fetchall()]
+
+if 'PRIORITY' not in scanparamscolumns:
+
+	srt.execute("ALTER TABLE SCANPARAMS ADD COLUMN PRIORITY INT NOT NULL DEFAULT 0")
+
+### SCANRESULTS.COMPLETED is the unix time the data was taken, so recent results can be offered for identical requests. older rows are never reused ###
+scanresultscolumns = [column[1].upper() for column in srt.execute("PRAGMA table_info(SCANRESULTS)").fetchall()]
+
+if 'COMPLETED' not in scanresultscolumns:
+
+	srt.execute("ALTER TABLE SCANRESULTS ADD COLUMN COMPLETED REAL")
+
+srt.execute("CREATE INDEX IF NOT EXISTS SCANRESULTS_ID ON SCANRESULTS(ID)")
+srt.execute("CREATE INDEX IF NOT EXISTS SCANPARAMS_MATCH ON SCANPARAMS(RAS, DEC, TYPE, FREQLOWER, FREQUPPER, STEPNUM, DURATION)")		# lookups of completed scans matching a new request
+
+### SHAREDSCANS lists the requests that share another scheduled scan's observation, each with the id of that scan ###
+srt.execute('''CREATE TABLE IF NOT EXISTS SHAREDSCANS(
+	ID INT PRIMARY KEY	NOT NULL,
+	HOSTID			INT	NOT NULL);''')
+
+srt.execute("CREATE INDEX IF NOT EXISTS SHAREDSCANS_HOSTID ON SHAREDSCANS(HOSTID)")
+
+### SURVEY lists the pointings the controller fills large gaps in the night schedule with, by default a strip of the galactic plane at the HI line ###
+surveyexists = srt.execute("SELECT NAME FROM sqlite_master WHERE TYPE = 'table' AND NAME = 'SURVEY'").fetchone() != None
+
+srt.execute('''CREATE TABLE IF NOT EXISTS SURVEY(
+	NAME TEXT PRIMARY KEY	NOT NULL,
+	TYPE			TEXT	NOT NULL,
+	RAS				TEXT	NOT NULL,
+	DEC				TEXT	NOT NULL,
+	DURATION		TEXT	NOT NULL,
+	FREQLOWER		REAL	NOT NULL,
+	FREQUPPER		REAL	NOT NULL,
+	STEPNUM			INT		NOT NULL,
+	LASTSCHEDULED	REAL);''')
+
+if not surveyexists:		# galactic longitudes 10 to 230 degrees at latitude 0, in J2000 coordinates
+
+	pointings = [('G010', '18h7m46s', '-20d17m24s'), ('G030', '18h46m5s', '-2d36m33s'), ('G050', '19h23m19s', '15d8m33s'), ('G070', '20h7m28s', '32d26m33s'),
+		('G090', '21h12m1s', '48d19m47s'), ('G110', '23h4m32s', '60d9m35s'), ('G130', '1h52m17s', '62d2m2s'), ('G150', '4h4m28s', '52d25m13s'),
+		('G170', '5h19m29s', '37d18m54s'), ('G190', '6h7m46s', '20d17m24s'), ('G210', '6h46m5s', '2d36m33s'), ('G230', '7h23m19s', '-15d8m33s')]
+
+	srt.executemany("INSERT INTO SURVEY (NAME, TYPE, RAS, DEC, DURATION, FREQLOWER, FREQUPPER, STEPNUM) VALUES (?,?,?,?,?,?,?,?)",
+		[(name, 'track', ras, dec, '0h10m0s', 1418.0, 1423.0, 50) for name, ras, dec in pointings])
+
+### CONFIG.VERSION is bumped by a trigger whenever a setting changes, so the controller knows to reload its cached config ###
+configcolumns = [column[1].upper() for column in srt.execute("PRAGMA table_info(CONFIG)").fetchall()]
+
+if 'VERSION' not in configcolumns:
+
+	srt.execute("ALTER TABLE CONFIG ADD COLUMN VERSION INT NOT NULL DEFAULT 0")
+
+srt.execute('''CREATE TRIGGER IF NOT EXISTS CONFIG_VERSION
+	AFTER UPDATE OF NAME, LAT, LON, HEIGHT, AZLOWER, AZUPPER, ALLOWER, ALUPPER, FREQLOWER, FREQUPPER ON CONFIG
+	BEGIN
+		UPDATE CONFIG SET VERSION = VERSION + 1;
+	END;''')
+
+srt.commit()
+
+srt.close()
@@ -6,8 +6,14 @@ Author: Nathan Rowley
 Date: June 2018
 '''
 
+import sys
+
+sys.path.append(r'/var/www/html/CarletonSRT')
+
 from flask import Flask, render_template, make_response, send_file, request, redirect, url_for, session
 from astral import Astral
+from srtutility.CommandChannel import CommandClient
+from srtutility import Duration
 import json
 import sqlite3
 import zipfile
@@ -15,6 +21,7 @@ import io
 import os
 import re
 import random
+import time
 from datetime import date, timedelta
 
 app = Flask(__name__)
@@ -30,6 +37,11 @@ normal_password = 'something'
 
 database_location = '../srtdatabase/srtdata.db'
 
+controller = CommandClient()		# command channel to the telescope controller, used to report submissions and cancellations immediately
+
+reuse_max_age = int(os.environ.get('SRT_REUSE_MAX_AGE', 86400))		# seconds for which a completed scan's results are offered for identical requests, 0 turns reuse off
+reuse_source_max_age = {'sun': 0}		# per source limits on reuse, in seconds. the sun moves against the sky and its activity changes, so it is always observed again
+
 @app.before_request
 def before_request():
 	session.permanent = True
@@ -118,7 +130,7 @@ def scan_page():
 	
 	if 'username' in session:
 
-		return render_template('scan.html')
+		return render_template('scan.html', admin = session['username'] == admin_username)
 		
 	return redirect(url_for('login'))
 
@@ -185,6 +197,14 @@ def submit_scan():
 		valid = valid and (re.fullmatch('[0-9]+\.?[0-9]*', str(newscan['frequpper'])) != None) and float(newscan['frequpper']) >= 0 and float(newscan['frequpper']) <= 10000
 		valid = valid and newscan['freqlower'] <= newscan['frequpper']
 		valid = valid and (re.fullmatch('[1-9][0-9]*', newscan['stepnumber']) != None) and int(newscan['stepnumber']) >= 1 and int(newscan['stepnumber']) <= 1000000
+
+		priority = 0		# only the admin account, used by instructors, may raise a scan's priority
+
+		if session['username'] == admin_username and 'priority' in newscan:
+
+			valid = valid and (re.fullmatch('[0-9]', str(newscan['priority'])) != None)
+
+			priority = int(newscan['priority']) if valid else 0
 	
 		if valid:
 	
@@ -240,12 +260,33 @@ def submit_scan():
 	
 				return scheduleGetter()
 	
+			newscan['duration'] = Duration.fromseconds(Duration.toseconds(newscan['duration']))		# one spelling per duration, so identical requests match
+
+			reusedid = findreusable(cur, newscan)
+
+			if reusedid != None:		# an identical scan finished recently, so its data is offered instead of observing again
+
+				today = date.today()
+
+				cur.execute("INSERT INTO SCANIDS VALUES (?,?,?)", (scanid, newscan['name'], 'complete'))
+				cur.execute("INSERT INTO SCANPARAMS (ID, TYPE, SOURCE, RAS, DEC, DURATION, FREQLOWER, FREQUPPER, STEPNUM, PRIORITY) VALUES (?,?,?,?,?,?,?,?,?,?)",
+					(scanid, newscan['type'], newscan['source'], newscan['ras'], newscan['dec'], newscan['duration'], float(newscan['freqlower']), float(newscan['frequpper']), int(newscan['stepnumber']), priority))
+				cur.execute("INSERT INTO SCANRESULTS (ID, DATA, COMPLETED) SELECT ?, DATA, COMPLETED FROM SCANRESULTS WHERE ID = ?", (scanid, reusedid))
+				cur.execute("INSERT INTO SCANHISTORY VALUES (?,?,?,?,?,?)", (scanid, newscan['name'], newscan['type'], today.day, today.month, today.year))
+				srtdb.commit()
+
+				srtdb.close()
+
+				return scheduleGetter()
+
 			# build a new row for the database containing scan parameters
-			params = (scanid, newscan['type'], newscan['source'], newscan['ras'], newscan['dec'], newscan['duration'], float(newscan['freqlower']), float(newscan['frequpper']), int(newscan['stepnumber']))
+			params = (scanid, newscan['type'], newscan['source'], newscan['ras'], newscan['dec'], newscan['duration'], float(newscan['freqlower']), float(newscan['frequpper']), int(newscan['stepnumber']), priority)
 	
 			cur.execute("INSERT INTO SCANIDS VALUES (?,?,?)", (scanid, newscan['name'], 'submitted'))
-			cur.execute("INSERT INTO SCANPARAMS VALUES (?,?,?,?,?,?,?,?,?)", params)	# insert new scan into database and commit change
+			cur.execute("INSERT INTO SCANPARAMS (ID, TYPE, SOURCE, RAS, DEC, DURATION, FREQLOWER, FREQUPPER, STEPNUM, PRIORITY) VALUES (?,?,?,?,?,?,?,?,?,?)", params)	# insert new scan into database and commit change
 			srtdb.commit()
+
+			controller.send('submit', id = scanid)		# have the controller schedule it now. if it is unreachable, it picks the scan up from the db later
 	
 		srtdb.close()
 	
@@ -253,6 +294,67 @@ def submit_scan():
 		
 	return redirect(url_for('login'))
 
+# url for the remaining capacity of each day and night in the schedule horizon. if a scan's type, source or position and duration
+# are posted, also returns the earliest time that scan could start in each. answered by the controller from its schedules in memory
+@app.route('/forecast', methods=['GET','POST'])
+def get_forecast():
+
+	if 'username' in session:
+
+		scan = request.get_json(force=True, silent=True)		# optional json-formatted scan parameters
+
+		args = {}
+
+		if scan != None and 'duration' in scan:
+
+			valid = True		# check client data for validity before asking the controller
+
+			valid = valid and (scan.get('type') == 'track' or scan.get('type') == 'drift')
+			valid = valid and len(scan.get('source', '')) <= 30
+			valid = valid and (re.fullmatch('0*[0-7]h0*(?:[0-9]|[1-5]\d)m0*(?:[0-9]|[1-5]\d)s|0*8h0+m0+s', scan['duration']) != None)
+
+			if not valid:
+
+				return make_response(json.JSONEncoder().encode({'error': 'invalidscan'}))
+
+			args = {'type': scan['type'], 'source': scan.get('source', 'no source'), 'duration': scan['duration'], 'ras': scan.get('ras'), 'dec': scan.get('dec')}
+
+			if args['source'] == 'sun':
+
+				args['ras'] = 'sunras'
+				args['dec'] = 'sundec'
+
+			elif args['source'] != 'no source':
+
+				srtdb = sqlite3.connect(database_location)
+				srtdb.row_factory = sqlite3.Row
+
+				sourcepos = srtdb.execute("SELECT * FROM SOURCES WHERE NAME = ?", (args['source'],)).fetchone()		# fetch source position data from db
+
+				srtdb.close()
+
+				if sourcepos == None:
+
+					return make_response(json.JSONEncoder().encode({'error': 'sourceerror'}))
+
+				args['ras'] = sourcepos['ras']
+				args['dec'] = sourcepos['dec']
+
+			elif args['ras'] == None or re.fullmatch('0*(?:[0-9]|1\d|2[0-3])h0*(?:[0-9]|[1-5]\d)m0*(?:[0-9]|[1-5]\d)s|0*24h0+m0+s', args['ras']) == None \
+				or args['dec'] == None or re.fullmatch('-?0*(?:[0-9]|[1-8]\d)d0*(?:[0-9]|[1-5]\d)m0*(?:[0-9]|[1-5]\d)s|-?0*90d0+m0+s', args['dec']) == None:
+
+				return make_response(json.JSONEncoder().encode({'error': 'invalidscan'}))
+
+		reply = controller.send('forecast', **args)
+
+		if reply == None:		# the forecast comes from the controller's memory, so there is none while it is down
+
+			return make_response(json.JSONEncoder().encode({'error': 'unavailable'}))
+
+		return make_response(json.JSONEncoder().encode(reply))
+
+	return redirect(url_for('login'))
+
 # url for updating the list of scheduled scans, activated periodically via automatic ajax calls by the scan page
 @app.route('/schedule', methods=['GET','POST'])
 def get_schedule():
@@ -283,6 +385,8 @@ def deschedule_scan():
 	
 			cur.execute("UPDATE SCANIDS SET STATUS = ? WHERE ID = ?", ('cancelled', scanid))	# set scan status to cancelled
 			srtdb.commit()
+
+			controller.send('cancel', id = scanid)		# have the controller stop or deschedule it now
 	
 		srtdb.close()
 	
@@ -438,6 +542,8 @@ def update_config():
 		srtdb.commit()
 	
 		srtdb.close()								# database connection no longer needed
+
+		controller.send('config')					# have the controller reload its cached config now
 	
 		return configGetter(newconfig[0])
 		
@@ -704,7 +810,7 @@ def scheduleGetter():
 	srtdb.row_factory = sqlite3.Row
 	cur = srtdb.cursor()
 
-	schedule = cur.execute("SELECT * FROM SCHEDULE ORDER BY STARTTIME ASC").fetchall()	# get scheduled scans in ascending order by starttime
+	schedule = cur.execute("SELECT * FROM SCHEDULE ORDER BY STARTUNIX ASC").fetchall()	# get scheduled scans in ascending order by starttime, across nights
 
 	firstchecked = False
 
@@ -738,6 +844,15 @@ def scheduleGetter():
 		scan['endtime'] = block['endtime']
 
 		scanlist.append(scan)						# add scan to response
+
+		members = cur.execute("SELECT SCANIDS.NAME, SCANPARAMS.* FROM SHAREDSCANS JOIN SCANIDS ON SHAREDSCANS.ID = SCANIDS.ID \
+			JOIN SCANPARAMS ON SHAREDSCANS.ID = SCANPARAMS.ID WHERE SHAREDSCANS.HOSTID = ?", (block['id'],)).fetchall()		# requests sharing this scan's observation
+
+		for member in members:
+
+			scanlist.append({'id': member['id'], 'name': member['name'], 'type': member['type'], 'source': member['source'], 'ras': member['ras'],
+					'dec': member['dec'], 'freqlower': member['freqlower'], 'frequpper': member['frequpper'], 'current': scan['current'],
+					'starttime': block['starttime'], 'endtime': block['endtime'], 'sharedwith': block['id']})
 		
 	srtdb.close()
 
@@ -747,6 +862,34 @@ def scheduleGetter():
 
 	return response
 
+'''
+Function that finds a recently completed scan with the same parameters as a new request, whose results can be reused.
+The lookup is a single query on the SCANPARAMS_MATCH index.
+
+:param cur: cursor into the database
+:param newscan: dict of the new request's validated parameters
+:return scanid: id of the most recent matching scan with results, or None if there is none or the source is never reused
+'''
+def findreusable(cur, newscan):
+
+	maxage = reuse_source_max_age.get(newscan['source'], reuse_max_age)
+
+	if maxage <= 0:
+
+		return None
+
+	match = cur.execute("SELECT SCANRESULTS.ID FROM SCANPARAMS JOIN SCANIDS ON SCANPARAMS.ID = SCANIDS.ID JOIN SCANRESULTS ON SCANPARAMS.ID = SCANRESULTS.ID \
+		WHERE SCANPARAMS.RAS = ? AND SCANPARAMS.DEC = ? AND SCANPARAMS.TYPE = ? AND SCANPARAMS.FREQLOWER = ? AND SCANPARAMS.FREQUPPER = ? \
+		AND SCANPARAMS.STEPNUM = ? AND SCANPARAMS.DURATION = ? AND SCANIDS.STATUS = ? AND SCANRESULTS.COMPLETED >= ? ORDER BY SCANRESULTS.COMPLETED DESC LIMIT 1",
+		(newscan['ras'], newscan['dec'], newscan['type'], float(newscan['freqlower']), float(newscan['frequpper']), int(newscan['stepnumber']),
+		newscan['duration'], 'complete', time.time() - maxage)).fetchone()
+
+	if match == None:
+
+		return None
+
+	return match['id']
+
 '''
 Function that gets source data from the database and returns it as a Flask Response object containing json.
 
@@ -7,6 +7,8 @@ $( function() {
 		name = $( "#dialog-scanform #name" ), position = $( "#dialog-scanform #position" ), ras = position.find( "#ras" ), dec = position.find( "#dec" ),
 		step_num = $( "#dialog-scanform #stepnum" ), source = $( "#dialog-scanform #source" ), sourcelist = source.find( "#sourcelist" );
 
+	var priority = $( "#dialog-scanform #priority" );
+
 	var allFields = $( [] ).add( type ).add( duration ).add( freqlower ).add( frequpper ).add( step_num ).add( name ).add( ras ).add( dec ).add( sourcelist );
 
 	position.hide();
@@ -319,6 +321,12 @@ $( function() {
 			var scanvalues = { "name": name.val(), "type": type.val(), "source": sourcelist.val(), "ras": ras.val(), "dec": dec.val(),
 								"duration": duration.val(), "freqlower": freqlower.val(), "frequpper": frequpper.val(), "stepnumber": step_num.val()};
 
+			// only the admin form has a priority field
+			if ( priority.length > 0 ) {
+
+				scanvalues["priority"] = priority.val();
+			}
+
 			// convert javascript object to json
 			var scanjson = JSON.stringify( scanvalues );
 